@@ -170,6 +170,22 @@ def load_config():
             cfg["conversation_lock_model"] = True
         if "web_preview_enabled" not in cfg:
             cfg["web_preview_enabled"] = True
+        if "conversation_backend" not in cfg:
+            cfg["conversation_backend"] = "sqlite"
+        if "conversation_cache_mb" not in cfg:
+            cfg["conversation_cache_mb"] = 64
+        if "conversation_archive_days" not in cfg:
+            cfg["conversation_archive_days"] = 0
+        if "recorder_max_packets" not in cfg:
+            cfg["recorder_max_packets"] = 20000
+        if "recorder_queue_size" not in cfg:
+            cfg["recorder_queue_size"] = 10000
+        if "recorder_overflow_policy" not in cfg:
+            cfg["recorder_overflow_policy"] = "drop"
+        if "recorder_body_limit" not in cfg:
+            cfg["recorder_body_limit"] = 1048576
+        if "recorder_blob_compress" not in cfg:
+            cfg["recorder_blob_compress"] = False
         return cfg
     _env_safe = os.environ.get("SafeMode", "false").strip().lower() in ("1", "true", "yes")
     _env_debug = os.environ.get("DebugMode", "false").strip().lower() in ("1", "true", "yes")
@@ -183,6 +199,14 @@ def load_config():
         "utcp_long_task_seconds": 10,
         "conversation_lock_model": True,
         "web_preview_enabled": True,
+        "conversation_backend": "sqlite",
+        "conversation_cache_mb": 64,
+        "conversation_archive_days": 0,
+        "recorder_max_packets": 20000,
+        "recorder_queue_size": 10000,
+        "recorder_overflow_policy": "drop",
+        "recorder_body_limit": 1048576,
+        "recorder_blob_compress": False,
         "safe_mode": False,
         "ai_default_language": "zh",
         "access_safe_mode": _env_safe,
@@ -211,6 +235,14 @@ def save_config(cfg):
         "utcp_long_task_seconds": max(1, min(3600, int(cfg.get("utcp_long_task_seconds", 10)))),
         "conversation_lock_model": bool(cfg.get("conversation_lock_model", True)),
         "web_preview_enabled": bool(cfg.get("web_preview_enabled", True)),
+        "conversation_backend": cfg.get("conversation_backend") or "sqlite",
+        "conversation_cache_mb": max(0, int(cfg.get("conversation_cache_mb", 64))),
+        "conversation_archive_days": max(0, int(cfg.get("conversation_archive_days", 0))),
+        "recorder_max_packets": max(100, int(cfg.get("recorder_max_packets", 20000))),
+        "recorder_queue_size": max(100, int(cfg.get("recorder_queue_size", 10000))),
+        "recorder_overflow_policy": cfg.get("recorder_overflow_policy") or "drop",
+        "recorder_body_limit": max(0, int(cfg.get("recorder_body_limit", 1048576))),
+        "recorder_blob_compress": bool(cfg.get("recorder_blob_compress", False)),
         "system_prompt": cfg.get("system_prompt", ""),
         "safe_mode": bool(cfg.get("safe_mode", False)),
         "ai_default_language": cfg.get("ai_default_language") or "zh",
@@ -368,15 +400,41 @@ def create_app():
     app.register_blueprint(utcp_bp, url_prefix="/api/utcp")
     _debug_log("Blueprint 已注册: utcp", _force=debug_mode)
 
+    from services import conversation_store
+    conversation_store.set_backend(cfg.get("conversation_backend"))
+    conversation_store.set_cache_budget(max(0, int(cfg.get("conversation_cache_mb", 64))) * 1024 * 1024)
+    _debug_log("对话存储后端: %s" % conversation_store.get_backend().name, _force=debug_mode)
+    from services import conversation_buffer
+    replayed = conversation_buffer.replay_journal()
+    _debug_log("对话写回日志已重放: %s 个未结束的流" % replayed, _force=debug_mode)
+    archive_days = max(0, int(cfg.get("conversation_archive_days", 0)))
+    if archive_days:
+        conversation_store.start_compaction_schedule(archive_days)
+        _debug_log("对话归档任务已启动: 归档 %s 天未更新的对话" % archive_days, _force=debug_mode)
+
     from services import browser_packets
-    persist_path = _ROOT / "data" / "browser_packets.json"
+    persist_path = _ROOT / "data" / "browser_packets"
     browser_packets.set_persist_path(persist_path)
+    browser_packets.set_retention(max(100, int(cfg.get("recorder_max_packets", 20000))))
+    browser_packets.set_blob_store(_ROOT / "data" / "blobs", compress=bool(cfg.get("recorder_blob_compress", False)))
+    browser_packets.set_body_limit(max(0, int(cfg.get("recorder_body_limit", 1048576))))
     _debug_log("browser_packets 持久化路径已设置: %s" % persist_path, _force=debug_mode)
     browser_packets.load_packets()
     _debug_log("browser_packets 已加载", _force=debug_mode)
+    from services import packet_writer
+    packet_writer.writer.configure(
+        max_queue=max(100, int(cfg.get("recorder_queue_size", 10000))),
+        policy=cfg.get("recorder_overflow_policy") or "drop",
+    )
+    from services import packet_search
+    packet_search.index.start()
 
     from routes.browser import set_filter_path
     set_filter_path(_ROOT / "data" / "recorder_filter.json")
+    from services import tls_passthrough
+    tls_passthrough.policy.set_path(_ROOT / "data" / "recorder_passthrough.json")
+    from services.traffic_rules import traffic_rules
+    traffic_rules.set_persist_path(_ROOT / "data" / "traffic_rules.json")
 
     _debug_log("create_app 完成", _force=debug_mode)
     return app
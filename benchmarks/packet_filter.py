@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+过滤表达式基准：合成一段抓包（默认 500000 条、200 个站点，每 50 条有一条响应体含 "token"），每个表达式取一页 50 条。
+有可索引条件的表达式由 packet_index 选驱动列表，其余逐条求值；与不用索引提示、从新到旧逐条求值同一表达式的结果比对。
+首次查询含编译，第二次命中 compile_filter 的缓存。
+用法：python benchmarks/packet_filter.py [录包条数，默认 500000]
+"""
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from services import browser_packets  # noqa: E402
+from services.packet_filter import compile_filter  # noqa: E402
+from services.packet_index import packet_keys  # noqa: E402
+
+PAGE = 50
+EXPRESSIONS = [
+    'host == "h7.test" && status >= 400 && resp.body ~ "token"',
+    'method == POST && status == 500',
+    'resp.body ~ "token"',
+    'host == "h7.test" || host == "h8.test"',
+]
+
+
+def capture(n, seed=2):
+    rnd = random.Random(seed)
+    for i in range(n):
+        yield dict(
+            method=rnd.choice(["GET"] * 8 + ["POST"]),
+            url="https://h%d.test/api/%d" % (rnd.randrange(200), i),
+            request_headers={},
+            request_body=None,
+            response_status=rnd.choice([200] * 20 + [404, 500]),
+            response_headers={"content-type": "application/json"},
+            response_body="x token" if i % 50 == 0 else "y",
+        )
+
+
+def scan(expr, limit=PAGE):
+    """基线：不用索引提示，从新到旧逐条求值"""
+    match = compile_filter(expr).match
+    out = []
+    for p in reversed(browser_packets._PACKETS):
+        if match(p, packet_keys(p)):
+            out.append(p)
+            if len(out) >= limit:
+                break
+    return out
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    browser_packets.set_persist_path(None)
+    browser_packets.set_blob_store(None)
+    browser_packets.set_retention(n + 1)
+    browser_packets.clear_packets()
+    items = list(capture(n))
+    for i in range(0, n, 1000):
+        browser_packets.add_packets(items[i:i + 1000])
+    del items
+
+    print("录包: %d  每页: %d" % (n, PAGE))
+    for expr in EXPRESSIONS:
+        compile_filter.cache_clear()
+        t0 = time.perf_counter()
+        browser_packets.list_packets(filter_expr=expr, limit=PAGE)
+        first_s = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        rows = browser_packets.list_packets(filter_expr=expr, limit=PAGE)
+        cached_s = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        expected = scan(expr)
+        scan_s = time.perf_counter() - t0
+        assert [str(p["id"]) for p in rows] == [str(p.id) for p in expected], expr
+        plan = "索引" if compile_filter(expr).hints else "扫描"
+        print("%-58s %s %8.2f ms（已编译 %7.2f ms，无提示 %8.2f ms）行数 %d"
+              % (expr, plan, first_s * 1000, cached_s * 1000, scan_s * 1000, len(rows)))
+    browser_packets.clear_packets()
+
+
+if __name__ == "__main__":
+    main()
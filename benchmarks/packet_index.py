@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+录包二级索引基准：合成一段抓包（默认 500000 条、200 个站点、每 0.1 秒一条），每个查询取一页 50 条，
+比较 list_packets 的结构化条件（packet_index 选最短倒排列表驱动）与从新到旧逐条计算派生键的线性扫描，并校验两者结果一致。
+另测追加时维护索引的单条代价。
+用法：python benchmarks/packet_index.py [录包条数，默认 500000]
+"""
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from services import browser_packets  # noqa: E402
+from services.packet_index import packet_keys  # noqa: E402
+
+PAGE = 50
+T0 = 1.7e9
+HOSTS = ["h%d.example.com" % i for i in range(200)]
+CTYPES = ["application/json", "text/html", "image/png", "text/css", "application/javascript"]
+
+
+def capture(n, seed=1):
+    rnd = random.Random(seed)
+    for i in range(n):
+        host = rnd.choice(HOSTS)
+        yield dict(
+            method=rnd.choice(["GET"] * 8 + ["POST", "PUT"]),
+            url="https://%s/api/v%d/item/%d" % (host, rnd.randint(1, 3), i),
+            request_headers={},
+            request_body=None,
+            response_status=rnd.choice([200] * 20 + [404, 500, 301]),
+            response_headers={"Content-Type": rnd.choice(CTYPES) + "; charset=utf-8"},
+            response_body=None,
+            timestamp=T0 + i * 0.1,
+        )
+
+
+def scan(pred, limit=PAGE):
+    """基线：从新到旧逐条计算派生键，取前 limit 条"""
+    out = []
+    for p in reversed(browser_packets._PACKETS):
+        if pred(packet_keys(p)):
+            out.append(p)
+            if len(out) >= limit:
+                break
+    return out
+
+
+# (名称, list_packets 条件, 等价的派生键判定；派生键见 packet_index.packet_keys)
+QUERIES = [
+    ("host", dict(host="h7.example.com"),
+     lambda k: k[0] == "h7.example.com"),
+    ("host + POST + 5xx", dict(host="h7.example.com", method="POST", status="5xx"),
+     lambda k: k[0] == "h7.example.com" and k[2] == "POST" and k[4] == "5xx"),
+    ("image/png + 404", dict(content_type="image/png", status="404"),
+     lambda k: k[5] == "image/png" and k[3] == 404),
+    ("time window + PUT", dict(since=T0 + 1000, until=T0 + 1600, method="PUT"),
+     lambda k: T0 + 1000 <= k[6] <= T0 + 1600 and k[2] == "PUT"),
+    ("path prefix + host", dict(path_prefix="/api/v2", host="h3.example.com"),
+     lambda k: k[0] == "h3.example.com" and (k[1] + "/").startswith("/api/v2/")),
+    ("since only", dict(since=T0 + 1000), None),
+]
+
+
+def timed(fn, repeat):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        out = fn()
+    return out, (time.perf_counter() - t0) / repeat
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    browser_packets.set_persist_path(None)
+    browser_packets.set_blob_store(None)
+    browser_packets.set_retention(n + 1)
+    browser_packets.clear_packets()
+    items = list(capture(n))
+    t0 = time.perf_counter()
+    for i in range(0, n, 1000):
+        browser_packets.add_packets(items[i:i + 1000])
+    append_s = time.perf_counter() - t0
+    del items
+
+    print("录包: %d  站点: %d  每页: %d" % (n, len(HOSTS), PAGE))
+    print("%-22s %12s %12s %6s" % ("查询", "索引", "线性扫描", "行数"))
+    for name, kw, pred in QUERIES:
+        rows, index_s = timed(lambda: browser_packets.list_packets(limit=PAGE, **kw), 20)
+        if pred is None:
+            print("%-22s %9.2f ms %12s %6d" % (name, index_s * 1000, "-", len(rows)))
+            continue
+        expected, scan_s = timed(lambda: scan(pred), 1)
+        assert [str(p["id"]) for p in rows] == [str(p.id) for p in expected], name
+        print("%-22s %9.2f ms %9.1f ms %6d" % (name, index_s * 1000, scan_s * 1000, len(rows)))
+    print("追加（含索引维护）:    %.1f µs/条" % (append_s / n * 1e6))
+    print("索引取值数: %s" % browser_packets.get_store_stats()["index_values"])
+    browser_packets.clear_packets()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+录包全文检索基准：合成一段抓包（默认 60000 条，约三分之一为 JSON 接口、其余为 HTML 页面，词频近似 Zipf 分布，
+请求头带随机会话 Cookie，每 997 条插入一个 ERR_MAGIC_<n> 标记），测 packet_search 的建索引吞吐、倒排表占用与几类查询的耗时：
+罕见令牌（某条录包的 Cookie 值）、约 20 条命中的罕见字符串、常见前缀、两个常见词组成的短语、
+两个罕见词拼接后不存在的单词，以及没有 4 字符单词、也没有命中的查询（退化为顺序比对，最坏情况）。
+用法：python benchmarks/packet_search.py [录包条数，默认 60000]
+"""
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from services import browser_packets, packet_search  # noqa: E402
+
+LETTERS = "abcdefghijklmnopqrstuvwxyz"
+
+
+def vocabulary(rnd, size=20000):
+    voc = ["".join(rnd.choice(LETTERS) for _ in range(rnd.randint(3, 9))) for _ in range(size)]
+    zipf = [voc[int(rnd.paretovariate(1.1)) % size] for _ in range(200000)]
+    return voc, zipf
+
+
+def body(rnd, zipf, i):
+    if i % 3 == 0:
+        return json.dumps({"data": [{"id": rnd.getrandbits(40), "name": rnd.choice(zipf), "token": "%024x" % rnd.getrandbits(96),
+                                     "text": " ".join(rnd.choices(zipf, k=20))} for _ in range(30)]})
+    return "<html><body>" + "".join(
+        '<div class="%s"><a href="/%s/%d">%s</a></div>' % (rnd.choice(zipf), rnd.choice(zipf), rnd.randrange(1000),
+                                                           " ".join(rnd.choices(zipf, k=10)))
+        for _ in range(60)) + "</body></html>"
+
+
+def capture(n, rnd, zipf):
+    for i in range(n):
+        yield dict(
+            method="GET",
+            url="https://h%d.test/p/%d" % (i % 50, i),
+            request_headers={"Cookie": "sid=%016x" % rnd.getrandbits(64)},
+            request_body=None,
+            response_status=200,
+            response_headers={"Content-Type": "text/html"},
+            response_body=body(rnd, zipf, i) + (" ERR_MAGIC_%d" % i if i % 997 == 0 else ""),
+        )
+
+
+def postings_bytes(idx):
+    """倒排表（n-gram 键与 array 本身）占用的字节数"""
+    with idx._lock:
+        return sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in idx._postings.items()) + sys.getsizeof(idx._postings)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 60000
+    rnd = random.Random(5)
+    voc, zipf = vocabulary(rnd)
+    browser_packets.set_persist_path(None)
+    browser_packets.set_blob_store(None)
+    browser_packets.set_retention(n + 1)
+    browser_packets.clear_packets()
+    items = list(capture(n, rnd, zipf))
+    cookie = items[n // 2]["request_headers"]["Cookie"][len("sid="):]
+    for i in range(0, n, 1000):
+        browser_packets.add_packets(items[i:i + 1000])
+    del items
+
+    idx = packet_search.index
+    t0 = time.perf_counter()
+    while idx.index_pending():
+        pass
+    build_s = time.perf_counter() - t0
+    st = idx.stats()
+    print("录包: %d  正文: %.0f MB" % (n, st["indexed_chars"] / 1e6))
+    print("建索引: %.1f s  %.1f MB/s  倒排表: %.0f MB（%d 个 n-gram）"
+          % (build_s, st["indexed_chars"] / 1e6 / build_s, postings_bytes(idx) / 1e6, st["grams"]))
+    queries = [
+        ("罕见令牌（Cookie 值）", cookie),
+        ("罕见字符串（约 %d 条）" % (n // 997 + 1), "err_magic"),
+        ("常见前缀", "sid="),
+        ("常见短语", zipf[0] + " " + zipf[1]),
+        ("不存在的拼接词", voc[-1] + voc[-2]),
+        ("无 n-gram 且无命中", '"token":"'),  # json.dumps 的冒号后有空格；只能顺序比对，最多 MAX_SCAN 条
+    ]
+    for name, q in queries:
+        r = idx.search(q, limit=20)
+        print("%-24s %-34s 命中 %3d  %8.2f ms" % (name, q[:34], r["count"], r["elapsed_ms"]))
+    browser_packets.clear_packets()
+
+
+if __name__ == "__main__":
+    main()
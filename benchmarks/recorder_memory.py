@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+录包内存基准：模拟一段浏览抓包（若干站点、浏览器请求头、服务器响应头），
+比较每条录包占用的字节数——旧格式（每条录包各自的 dict 与头字典）与 browser_packets.PacketRecord。
+用法：python benchmarks/recorder_memory.py [录包条数，默认 50000]
+只统计录包记录本身（不含 body 预览与 blob，两种格式相同），用 tracemalloc 计量存完后仍被占用的内存。
+"""
+import random
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from services import browser_packets  # noqa: E402
+
+UA = ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+      "Chrome/124.0.0.0 Safari/537.36")
+ACCEPT = {
+    "document": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8",
+    "script": "*/*",
+    "style": "text/css,*/*;q=0.1",
+    "image": "image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8",
+    "xhr": "application/json, text/plain, */*",
+}
+CTYPE = {
+    "document": "text/html; charset=utf-8",
+    "script": "application/javascript",
+    "style": "text/css",
+    "image": "image/webp",
+    "xhr": "application/json; charset=utf-8",
+}
+SERVERS = ["nginx", "cloudflare", "Apache/2.4.57 (Ubuntu)", "AmazonS3", "gws", "openresty"]
+
+
+def _fresh(s):
+    """模拟代理每次解析出的新字符串对象"""
+    return (s + ".")[:-1]
+
+
+def capture(n, seed=1):
+    rnd = random.Random(seed)
+    hosts = ["www.site%d.com" % i for i in range(25)] + ["cdn%d.static.net" % i for i in range(10)] + ["api.svc%d.io" % i for i in range(5)]
+    cookies = {h: "session=%032x; _ga=GA1.2.%d.%d" % (rnd.getrandbits(128), rnd.randrange(10 ** 9), rnd.randrange(10 ** 9)) for h in hosts}
+    servers = {h: rnd.choice(SERVERS) for h in hosts}
+    t = 1.7e9
+    page = "https://www.site0.com/"
+    for i in range(n):
+        host = rnd.choice(hosts)
+        kind = "document" if rnd.random() < 0.08 else rnd.choice(["script", "style", "image", "image", "xhr", "xhr"])
+        path = "/%s/%d/%x" % (kind, rnd.randrange(300), rnd.getrandbits(32))
+        url = "https://%s%s" % (host, path)
+        if kind == "document":
+            page = url
+        t += rnd.random() * 0.2
+        req = {
+            "Host": host,
+            "User-Agent": UA,
+            "Accept": ACCEPT[kind],
+            "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8",
+            "Accept-Encoding": "gzip, deflate, br",
+            "sec-ch-ua": '"Chromium";v="124", "Google Chrome";v="124", "Not-A.Brand";v="99"',
+            "sec-ch-ua-platform": '"Windows"',
+            "Sec-Fetch-Dest": kind if kind != "xhr" else "empty",
+            "Sec-Fetch-Mode": "navigate" if kind == "document" else "cors" if kind == "xhr" else "no-cors",
+            "Referer": page,
+        }
+        if not host.startswith("cdn"):
+            req["Cookie"] = cookies[host]
+        res = {
+            "Server": servers[host],
+            "Date": time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(t)),
+            "Content-Type": CTYPE[kind],
+            "Content-Length": str(rnd.randrange(200, 200000)),
+            "Cache-Control": "max-age=31536000, immutable" if host.startswith("cdn") else "no-cache",
+            "Vary": "Accept-Encoding",
+            "Strict-Transport-Security": "max-age=63072000; includeSubDomains; preload",
+            "X-Content-Type-Options": "nosniff",
+        }
+        if rnd.random() < 0.3:
+            res["ETag"] = '"%x"' % rnd.getrandbits(64)
+        yield dict(
+            method="POST" if kind == "xhr" and rnd.random() < 0.3 else "GET",
+            url=url,
+            request_headers={_fresh(k): _fresh(v) for k, v in req.items()},
+            request_body=None,
+            response_status=rnd.choice([200] * 18 + [304, 404]),
+            response_headers={_fresh(k): _fresh(v) for k, v in res.items()},
+            response_body=None,
+        ), t
+
+
+def _legacy_entry(i, t, method, url, request_headers, request_body, response_status, response_headers, response_body):
+    """改动前 _make_entry 的录包格式"""
+    return {
+        "id": str(i),
+        "time": t,
+        "method": (method or "GET").upper(),
+        "url": url or "",
+        "request_headers": dict(request_headers) if request_headers else {},
+        "request_body_preview": request_body,
+        "response_status": response_status,
+        "response_headers": dict(response_headers) if response_headers else {},
+        "response_body_preview": response_body,
+    }
+
+
+def measure(n, build):
+    """逐条生成并存入，统计存完后仍被占用的内存（生成时的临时对象已释放）"""
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    store = build(capture(n))
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    return store, sum(s.size_diff for s in after.compare_to(before, "filename"))
+
+
+def build_legacy(items):
+    return [_legacy_entry(i + 1, t, **kw) for i, (kw, t) in enumerate(items)]
+
+
+def build_records(items):
+    out = []
+    for i, (kw, t) in enumerate(items):
+        r = browser_packets._make_entry(**kw)
+        r.id = i + 1
+        r.time = t
+        out.append(r)
+    return out
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    browser_packets.set_blob_store(None)
+    _, legacy = measure(n, build_legacy)
+    records, compact = measure(n, build_records)
+    assert records[0].to_dict()["request_headers"]
+    print("录包条数: %d" % n)
+    print("旧格式 dict:        %8.0f 字节/条" % (legacy / n))
+    print("PacketRecord:       %8.0f 字节/条" % (compact / n))
+    print("节省:               %7.1f%%" % (100.0 * (legacy - compact) / legacy))
+    print("头集合/头字段对:    %s" % browser_packets._HEADERS.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -5,8 +5,17 @@ from pathlib import Path
 
 from flask import Blueprint, render_template, request, jsonify, redirect, url_for, send_file, current_app
 
+from services import body_rewrite
 from services import browser_packets
 from services import browser_session
+from services import packet_feed
+from services import packet_filter
+from services import packet_search
+from services import packet_writer
+from services import proxy_metrics
+from services import recorder_filter
+from services import tls_passthrough
+from services.traffic_rules import traffic_rules
 
 _FILTER_PATH = None  # 由应用设置，如 Path("data/recorder_filter.json")
 
@@ -14,6 +23,7 @@ _FILTER_PATH = None  # 由应用设置，如 Path("data/recorder_filter.json")
 def set_filter_path(path):
     global _FILTER_PATH
     _FILTER_PATH = path
+    recorder_filter.capture.set_path(path)
 
 
 def _get_filter_path():
@@ -102,7 +112,7 @@ def recorder_filter_get():
 
 @browser_bp.route("api/recorder/filter", methods=["POST"])
 def recorder_filter_post():
-    """更新过滤器：body 可含 enabled(bool)、add(str)、remove(str)。"""
+    """更新过滤器：body 可含 enabled(bool)、add(str)、remove(str)。启用时代理只录制匹配的流量，修改立即生效。"""
     data = _load_recorder_filter()
     body = request.get_json(silent=True) or {}
     if "enabled" in body:
@@ -116,18 +126,13 @@ def recorder_filter_post():
         if val in data["addresses"]:
             data["addresses"].remove(val)
     _save_recorder_filter(data)
+    recorder_filter.capture.update(data)
     return jsonify(data)
 
 
-@browser_bp.route("api/browser/packets", methods=["GET", "POST"])
-def packets_list_or_clear():
-    """GET：返回录包列表（可选 url_contains, url_contains_any, limit）；POST：清空录包。"""
-    if request.method == "POST":
-        browser_packets.clear_packets()
-        _browser_debug("录包已清空")
-        return jsonify({"ok": True, "message": "已清空"})
+def _list_filters():
+    """从查询参数取 list_packets 的过滤条件（录包列表与实时推送共用）"""
     url_contains = request.args.get("url_contains") or ""
-    limit = request.args.get("limit", type=int) or 200
     url_contains_any = request.args.getlist("url_contains_any") or request.args.get("url_contains_any")
     if isinstance(url_contains_any, str) and url_contains_any.strip():
         try:
@@ -136,13 +141,119 @@ def packets_list_or_clear():
             url_contains_any = [s.strip() for s in url_contains_any.split(",") if s.strip()]
     if not isinstance(url_contains_any, list):
         url_contains_any = []
-    items = browser_packets.list_packets(
-        url_contains=url_contains if not url_contains_any else None,
-        url_contains_any=url_contains_any if url_contains_any else None,
-        limit=limit,
-    )
+    return {
+        "url_contains": url_contains if not url_contains_any else None,
+        "url_contains_any": url_contains_any if url_contains_any else None,
+        "host": request.args.get("host") or None,
+        "path_prefix": request.args.get("path_prefix") or None,
+        "method": request.args.get("method") or None,
+        "status": request.args.get("status") or None,
+        "content_type": request.args.get("content_type") or None,
+        "since": request.args.get("since", type=float),
+        "until": request.args.get("until", type=float),
+        "filter_expr": request.args.get("filter") or None,
+        "addresses": [a for a in request.args.getlist("addresses") if a.strip()] or None,
+    }
+
+
+@browser_bp.route("api/recorder/passthrough", methods=["GET"])
+def recorder_passthrough_get():
+    """返回 HTTPS 直通配置：intercept（是否解密）、hosts（直通主机名模式）、builtin（始终直通的 AI 接口）。"""
+    return jsonify(tls_passthrough.policy.config())
+
+
+@browser_bp.route("api/recorder/passthrough", methods=["POST"])
+def recorder_passthrough_post():
+    """更新 HTTPS 直通：body 可含 intercept(bool)、add(str)、remove(str)；对之后建立的连接立即生效。"""
+    body = request.get_json(silent=True) or {}
+    return jsonify(tls_passthrough.policy.update(
+        intercept=body["intercept"] if "intercept" in body else None,
+        add=body.get("add"),
+        remove=body.get("remove"),
+    ))
+
+
+@browser_bp.route("api/browser/packets", methods=["GET", "POST"])
+def packets_list_or_clear():
+    """
+    GET：返回录包列表（可选 url_contains, url_contains_any, limit, after_id/before_id 游标，
+    以及走索引的 host, path_prefix, method, status, content_type, since/until，和过滤表达式 filter）；POST：清空录包。
+    fields 为投影字段（逗号分隔，如 id,method,url,response_status,size,time；summary 为摘要），省略时返回完整录包；
+    with_total=1 时返回 total（满足过滤条件的录包总数，否则为 null；有 URL 或表达式过滤时需要逐条检查，按条件缓存）。
+    """
+    if request.method == "POST":
+        browser_packets.clear_packets()
+        _browser_debug("录包已清空")
+        return jsonify({"ok": True, "message": "已清空"})
+    limit = request.args.get("limit", type=int) or 200
+    after_id = request.args.get("after_id") or None
+    before_id = request.args.get("before_id") or None
+    filters = _list_filters()
+    try:
+        items = browser_packets.list_packets(limit=limit, after_id=after_id, before_id=before_id,
+                                             fields=request.args.get("fields") or None, **filters)
+        total = browser_packets.count_packets(**filters) if request.args.get("with_total") in ("1", "true") else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     _browser_debug("录包列表: count=%s limit=%s" % (len(items), limit))
-    return jsonify({"packets": items})
+    return jsonify({
+        "packets": items,
+        "total": total,
+        "latest_id": browser_packets.latest_id(),
+        # 结果按时间倒序：继续向旧翻页用最后一条的 id 作 before_id，拉取更新的录包用第一条的 id 作 after_id
+        "next_before_id": items[-1]["id"] if len(items) >= min(1000, max(1, limit)) else None,
+    })
+
+
+@browser_bp.route("api/browser/packets/stream", methods=["GET"])
+def packets_stream():
+    """
+    新录包实时推送（SSE）：只推送游标之后的录包摘要，过滤参数同录包列表；
+    游标取 Last-Event-ID（断线重连）或 after_id，都没有时从当前最新录包之后开始。
+    """
+    filters = _list_filters()
+    try:
+        # 先校验过滤表达式，错误时返回 400 而不是建立推送连接
+        if filters["filter_expr"] and filters["filter_expr"].strip():
+            packet_filter.compile_filter(filters["filter_expr"].strip())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not packet_feed.feed.acquire():
+        return jsonify({"error": "实时推送连接数已达上限"}), 503
+    after_id = request.headers.get("Last-Event-ID") or request.args.get("after_id") or None
+    resp = current_app.response_class(packet_feed.feed.stream(after_id, filters), mimetype="text/event-stream")
+    resp.call_on_close(packet_feed.feed.release)
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
+
+
+@browser_bp.route("api/recorder/metrics", methods=["GET"])
+def recorder_metrics():
+    """录包写入指标：队列深度、丢弃/抽样计数、批次数、存储规模、全文索引进度、实时推送连接、录制过滤、HTTPS 直通计数、拦截规则决策缓存命中率、每条规则的命中与耗时，代理插件各阶段耗时直方图与响应体改写计数。"""
+    return jsonify({
+        "writer": packet_writer.writer.stats(),
+        "store": browser_packets.get_store_stats(),
+        "search_index": packet_search.index.stats(),
+        "feed": packet_feed.feed.stats(),
+        "capture_filter": recorder_filter.capture.stats(),
+        "tls_passthrough": tls_passthrough.policy.stats(),
+        "traffic_rules": traffic_rules.cache_stats(),
+        "traffic_rule_stats": traffic_rules.rule_stats(),
+        "proxy_hooks": proxy_metrics.hook_stats(),
+        "body_rewrite": body_rewrite.rewriter.stats(),
+    })
+
+
+@browser_bp.route("api/browser/packets/search", methods=["GET"])
+def packets_search():
+    """录包全文检索：q 为检索内容（不区分大小写），limit 最多 200；返回命中录包 id 与各字段命中偏移。"""
+    q = request.args.get("q") or ""
+    if not q:
+        return jsonify({"error": "缺少参数 q"}), 400
+    limit = request.args.get("limit", type=int) or 20
+    packet_search.index.start()
+    return jsonify(packet_search.index.search(q, limit=limit))
 
 
 @browser_bp.route("api/browser/packets/<packet_id>", methods=["GET"])
@@ -154,6 +265,33 @@ def packet_detail(packet_id):
     return jsonify(p)
 
 
+@browser_bp.route("api/browser/packets/<packet_id>/body/<which>", methods=["GET"])
+def packet_body(packet_id, which):
+    """返回录包的完整请求体或响应体（which 为 request 或 response），支持 Range 字节区间请求（206）。"""
+    if which not in ("request", "response"):
+        return jsonify({"error": "which 须为 request 或 response"}), 400
+    p = browser_packets.get_packet(packet_id)  # 只取一次：之后录包被清空或裁剪也不影响本次读取
+    if p is None:
+        return jsonify({"error": "未找到"}), 404
+    total, ctype = browser_packets.body_info(p, which)
+    start, end, status = 0, total, 200
+    if request.range is not None:
+        rng = request.range.range_for_length(total)
+        if rng is None:
+            resp = current_app.response_class(status=416)
+            resp.headers["Content-Range"] = "bytes */%d" % total
+            return resp
+        start, end, status = rng[0], rng[1], 206
+    data = browser_packets.read_body(p, which, start, end)
+    if data is None:
+        return jsonify({"error": "body 文件已丢失"}), 410
+    resp = current_app.response_class(data, status=status, mimetype=ctype or "application/octet-stream")
+    resp.headers["Accept-Ranges"] = "bytes"
+    if status == 206:
+        resp.headers["Content-Range"] = "bytes %d-%d/%d" % (start, start + len(data) - 1, total)
+    return resp
+
+
 @browser_bp.route("api/recorder/cert", methods=["GET"])
 def download_cert():
     """
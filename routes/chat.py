@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 import re
+import time
 import uuid
+import zlib
 from pathlib import Path
 from urllib.parse import urlparse, urlunparse
 
@@ -66,6 +68,21 @@ def _trim_previous_long_assistant_if_new_topic(messages, use_utcp_tools):
     return out
 
 
+def _prepend_stored_history(conversation_id, messages, history_offset):
+    """前端分页只持有最近若干条消息时，用存储中 history_offset 之前的消息补全发给模型的上下文"""
+    try:
+        offset = int(history_offset or 0)
+    except (TypeError, ValueError):
+        offset = 0
+    if not conversation_id or offset <= 0:
+        return messages
+    page = get_messages_page(conversation_id, before=offset, limit=offset)
+    if not page:
+        return messages
+    earlier = [{"role": m.get("role"), "content": m.get("content") or ""} for m in page.get("messages") or []]
+    return earlier + list(messages)
+
+
 def _model_label(provider_id, model):
     """根据 provider_id 与 model 返回展示用「服务商 - 模型」"""
     for m in get_available_models():
@@ -77,8 +94,21 @@ from services.conversation_store import (
     get_conversation,
     create_conversation,
     update_conversation,
+    append_message,
     delete_conversation,
+    get_backend,
+    get_cache_stats,
+    get_conversation_meta,
+    get_messages_page,
+    get_messages_since,
+    get_message,
+    search_conversations,
+    get_search_stats,
+    compact_conversations,
+    get_archive_stats,
 )
+from services import conversation_buffer
+from services import conversation_transfer
 import json
 
 chat_bp = Blueprint("chat", __name__)
@@ -179,6 +209,95 @@ def api_conversations_list():
     return jsonify({"conversations": items})
 
 
+@chat_bp.route("/api/conversation-store/stats", methods=["GET"])
+def api_conversation_store_stats():
+    """对话存储统计：后端类型、读缓存命中情况、流式写回缓冲的事件数与实际写入次数"""
+    return jsonify({
+        "backend": get_backend().name,
+        "cache": get_cache_stats(),
+        "write_behind": conversation_buffer.get_stats(),
+        "search_index": get_search_stats(),
+        "archive": get_archive_stats(),
+    })
+
+
+@chat_bp.route("/api/conversation-store/compact", methods=["POST"])
+def api_conversation_store_compact():
+    """把 days 天未更新的对话移入压缩归档；body 可选 {"days": N}，默认取 config.json 的 conversation_archive_days（未设置时 30）"""
+    data = request.get_json(silent=True) or {}
+    cfg = current_app.config["CONFIG_LOADER"]()
+    days = data.get("days", cfg.get("conversation_archive_days") or 30)
+    try:
+        days = float(days)
+    except (TypeError, ValueError):
+        return jsonify({"error": "days 必须为数字"}), 400
+    if days < 0:
+        return jsonify({"error": "days 不能为负数"}), 400
+    return jsonify(compact_conversations(days))
+
+
+@chat_bp.route("/api/conversations/export", methods=["GET"])
+def api_conversations_export():
+    """
+    流式导出 NDJSON（每行一个完整对话）。
+    参数：since/until（按 updated_at，ISO 日期或时间）、provider_id、model、gzip=1（输出 .ndjson.gz）
+    """
+    use_gzip = request.args.get("gzip", "").strip().lower() in ("1", "true", "yes")
+    body = conversation_transfer.export_ndjson(
+        since=(request.args.get("since") or "").strip(),
+        until=(request.args.get("until") or "").strip(),
+        provider_id=request.args.get("provider_id") or None,
+        model=request.args.get("model") or None,
+        gzip=use_gzip,
+    )
+    filename = "conversations.ndjson.gz" if use_gzip else "conversations.ndjson"
+    return Response(
+        stream_with_context(body),
+        mimetype="application/gzip" if use_gzip else "application/x-ndjson",
+        headers={"Content-Disposition": "attachment; filename=%s" % filename, "X-Accel-Buffering": "no"},
+    )
+
+
+@chat_bp.route("/api/conversations/import", methods=["POST"])
+def api_conversations_import():
+    """
+    流式导入 NDJSON：请求体为原始 NDJSON，gzip 压缩（Content-Encoding: gzip 或文件本身为 .gz）自动识别。
+    参数：on_conflict=skip|replace|new（对话 id 已存在时跳过 / 覆盖 / 以新 id 导入，默认 skip）
+    所有记录都无效时返回 400，解压后超过 MAX_IMPORT_BYTES 时返回 413（此前的记录已导入）
+    """
+    on_conflict = (request.args.get("on_conflict") or "skip").strip().lower()
+    if on_conflict not in conversation_transfer.CONFLICT_MODES:
+        return jsonify({"error": "on_conflict 须为 skip、replace 或 new"}), 400
+    gzip = True if "gzip" in (request.headers.get("Content-Encoding") or "").lower() else None
+    try:
+        result = conversation_transfer.import_ndjson(request.stream, on_conflict=on_conflict, gzip=gzip)
+    except zlib.error as e:
+        return jsonify({"error": "gzip 解压失败: %s" % e}), 400
+    except conversation_transfer.ImportTooLarge as e:
+        return jsonify({"error": str(e)}), 413
+    if result["failed"] and not (result["imported"] or result["replaced"] or result["skipped"]):
+        # 没有一条有效记录：整体视为请求错误，errors 中给出前几行的原因
+        return jsonify(dict(result, error="没有可导入的对话记录")), 400
+    return jsonify(result)
+
+
+@chat_bp.route("/api/conversations/search", methods=["GET"])
+def api_conversations_search():
+    """全文检索历史消息：?q=关键词&limit=20&conversation_id=（可选，限定单个对话）"""
+    q = (request.args.get("q") or "").strip()
+    if not q:
+        return jsonify({"error": "请提供检索关键词 q"}), 400
+    try:
+        limit = min(max(int(request.args.get("limit", 20)), 1), 200)
+    except (TypeError, ValueError):
+        limit = 20
+    t0 = time.perf_counter()
+    out = search_conversations(q, limit=limit, conversation_id=request.args.get("conversation_id") or None)
+    out["query"] = q
+    out["elapsed_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+    return jsonify(out)
+
+
 @chat_bp.route("/api/conversations", methods=["POST"])
 def api_conversations_create():
     """新建对话"""
@@ -211,6 +330,77 @@ def api_conversation_update(cid):
     return jsonify(conv)
 
 
+_STEP_PREVIEW_CHARS = 200
+
+
+def _light_message(m):
+    """列表/分页返回用：工具步骤只保留前 200 字预览，完整结果在展开时按需拉取"""
+    steps = m.get("tool_steps")
+    if not steps:
+        return m
+    out = dict(m)
+    light = []
+    for st in steps:
+        text = st.get("result_full") or st.get("result_summary") or ""
+        item = {k: v for k, v in st.items() if k not in ("result_full", "result_summary")}
+        item["result_summary"] = text[:_STEP_PREVIEW_CHARS]
+        item["result_length"] = len(text)
+        item["lazy"] = len(text) > _STEP_PREVIEW_CHARS
+        light.append(item)
+    out["tool_steps"] = light
+    return out
+
+
+def _page_response(page, **extra):
+    msgs = page.get("messages") or []
+    full_steps = request.args.get("full_steps") in ("1", "true")
+    page["messages"] = msgs if full_steps else [_light_message(m) for m in msgs]
+    page["has_more"] = page.get("start", 0) > 0
+    page.update(extra)
+    return jsonify(page)
+
+
+@chat_bp.route("/api/conversations/<cid>/messages", methods=["GET"])
+def api_conversation_messages_get(cid):
+    """
+    分页 / 增量读取消息。
+    - 分页：limit（默认 50，最大 500）、before（取该下标之前最新的 limit 条，缺省为最新一页）
+    - 增量：since（返回下标 >= since 的消息）+ version、history_version（客户端已知版本）。
+      version 未变返回 unchanged；history_version 变化（历史被整体改写，如删除某轮）返回 reset 并给出最新一页。
+    工具步骤只含预览，完整结果见 /messages/<index>/tool_steps/<step>。
+    """
+    limit = max(1, min(500, request.args.get("limit", type=int) or 50))
+    since = request.args.get("since", type=int)
+    if since is not None:
+        meta = get_conversation_meta(cid)
+        if not meta:
+            return jsonify({"error": "对话不存在"}), 404
+        known_version = request.args.get("version", type=int)
+        known_history = request.args.get("history_version", type=int)
+        if known_version is not None and known_version == (meta.get("version") or 0):
+            meta.update({"unchanged": True, "messages": [], "start": meta["total"]})
+            return jsonify(meta)
+        if known_history is not None and known_history != (meta.get("history_version") or 0):
+            page = get_messages_page(cid, limit=limit)
+            return _page_response(page, reset=True) if page else (jsonify({"error": "对话不存在"}), 404)
+        page = get_messages_since(cid, since)
+        return _page_response(page) if page else (jsonify({"error": "对话不存在"}), 404)
+    page = get_messages_page(cid, before=request.args.get("before", type=int), limit=limit)
+    if not page:
+        return jsonify({"error": "对话不存在"}), 404
+    return _page_response(page)
+
+
+@chat_bp.route("/api/conversations/<cid>/messages/<int:index>/tool_steps/<int:step>", methods=["GET"])
+def api_conversation_tool_step(cid, index, step):
+    """按需返回某条消息中单个工具步骤的完整内容（含 result_full）"""
+    m = get_message(cid, index)
+    steps = (m or {}).get("tool_steps") or []
+    if step < 0 or step >= len(steps):
+        return jsonify({"error": "工具步骤不存在"}), 404
+    return jsonify(steps[step])
+
+
 @chat_bp.route("/api/conversations/<cid>/messages", methods=["PATCH"])
 def api_conversation_messages_patch(cid):
     """删除某一对话轮次。body: { "remove_turn_index": 0 }，轮次为 user+assistant 对，0 表示第一轮。"""
@@ -299,6 +489,7 @@ def api_chat():
         if conv and conv.get("provider_id") is not None and conv.get("model") is not None:
             if conv.get("provider_id") != provider_id or conv.get("model") != model:
                 return jsonify({"error": "该对话已由固定模型维护，请使用对话绑定的模型继续"}), 400
+    messages = _prepend_stored_history(conversation_id, messages, data.get("history_offset"))
     messages = _inject_system_prompt(messages, use_utcp_tools)
     messages = _inject_attachment_paths(messages, attachment_paths)
     messages = _trim_previous_long_assistant_if_new_topic(messages, use_utcp_tools)
@@ -322,12 +513,9 @@ def api_chat():
             if conv:
                 if lock_model and (conv.get("provider_id") is None or conv.get("model") is None):
                     update_conversation(conversation_id, provider_id=provider_id, model=model)
-                new_messages = conv.get("messages", []) + [
-                    {"role": "user", "content": last_user},
-                    {"role": "assistant", "content": content, "model_label": model_label},
-                ]
-                update_conversation(conversation_id, messages=new_messages)
-                if len(new_messages) == 2:
+                append_message(conversation_id, {"role": "user", "content": last_user})
+                append_message(conversation_id, {"role": "assistant", "content": content, "model_label": model_label})
+                if len(conv.get("messages") or []) == 0:
                     summary = summarize_conversation_title(provider_id, model, last_user, content)
                     if summary:
                         update_conversation(conversation_id, title=summary)
@@ -374,6 +562,7 @@ def api_chat_stream():
                 return jsonify({"error": "该对话已由固定模型维护，请使用对话绑定的模型继续"}), 400
     _chat_debug("流式对话开始: provider_id=%s model=%s use_utcp_tools=%s use_deep_thinking=%s messages_count=%s" % (
         provider_id, model, use_utcp_tools, use_deep_thinking, len(messages)))
+    messages = _prepend_stored_history(conversation_id, messages, data.get("history_offset"))
     messages = _inject_system_prompt(messages, use_utcp_tools)
     messages = _inject_attachment_paths(messages, attachment_paths)
     messages = _trim_previous_long_assistant_if_new_topic(messages, use_utcp_tools)
@@ -385,30 +574,7 @@ def api_chat_stream():
     last_user = messages[-1].get("content", "") if messages else ""
     model_label = _model_label(provider_id, model)
 
-    def _save_partial(cid, content_parts, steps, plan_content=None):
-        """流式过程中将当前进度写入对话（含计划阶段），便于刷新/切换后恢复"""
-        if not cid:
-            return
-        conv = get_conversation(cid)
-        if not conv:
-            return
-        raw = "".join(content_parts)
-        partial_content = ("【当前情况与计划】\n\n" + plan_content + "\n\n---\n\n" + raw) if plan_content else raw
-        assistant_msg = {"role": "assistant", "content": partial_content, "model_label": model_label}
-        if steps:
-            assistant_msg["tool_steps"] = list(steps)
-        msgs = conv.get("messages", [])
-        if msgs and msgs[-1].get("role") == "assistant":
-            new_messages = msgs[:-1] + [assistant_msg]
-        else:
-            new_messages = msgs + [assistant_msg]
-        update_conversation(cid, messages=new_messages)
-
     def generate():
-        full_content = []
-        tool_steps = []  # 收集本轮工具调用，用于持久化
-        plan_content = ""  # 第一轮后的「当前情况与计划」，用于与最终内容合并
-        save_interval = 0
         cid = conversation_id
         _chat_debug("AI对话 用户消息: %s" % ((last_user or "")[:200] or "(空)"))
         if not cid:
@@ -425,8 +591,9 @@ def api_chat_stream():
             if conv:
                 if lock_model and (conv.get("provider_id") is None or conv.get("model") is None):
                     update_conversation(cid, provider_id=provider_id, model=model)
-                new_msgs = conv.get("messages", []) + [{"role": "user", "content": last_user}]
-                update_conversation(cid, messages=new_msgs)
+                append_message(cid, {"role": "user", "content": last_user})
+        # 流式过程中的进度由写回缓冲合并后写入对话（含计划阶段），便于刷新/切换后恢复
+        saver = conversation_buffer.StreamSaver(cid, model_label)
         try:
             for chunk in chat_completion_stream(
                 provider_id=provider_id, model=model, messages=messages,
@@ -436,14 +603,12 @@ def api_chat_stream():
                 if use_utcp_tools and isinstance(chunk, dict):
                     ev = chunk
                     if ev.get("type") == "content":
-                        full_content.append(ev.get("content") or "")
-                        save_interval += 1
+                        saver.add_content(ev.get("content") or "")
                     elif ev.get("type") == "plan":
-                        plan_content = ev.get("content") or ""
-                        save_interval += 1
-                        _chat_debug("自动化任务栏 计划: %s" % ((plan_content or "")[:300]))
+                        saver.set_plan(ev.get("content") or "")
+                        _chat_debug("自动化任务栏 计划: %s" % ((saver.plan_content or "")[:300]))
                     elif ev.get("type") == "tool_call":
-                        tool_steps.append({
+                        saver.add_tool_step({
                             "name": ev.get("name") or "",
                             "arguments_preview": ev.get("arguments_preview") or "",
                             "result_summary": "",
@@ -451,57 +616,31 @@ def api_chat_stream():
                             "step_index": ev.get("step_index"),
                             "step_total": ev.get("step_total"),
                         })
-                        save_interval += 1
                         _chat_debug("自动化任务栏 工具调用: %s %s" % (ev.get("name") or "", (ev.get("arguments_preview") or "")[:200]))
-                    elif ev.get("type") == "tool_result" and tool_steps:
+                    elif ev.get("type") == "tool_result" and saver.tool_steps:
                         summary = (ev.get("result_summary") or ev.get("result_full") or "")[:2000]
                         full_result = (ev.get("result_full") or ev.get("result_summary") or "")[:8000]
-                        for st in tool_steps:
-                            if not st.get("result_summary") and not st.get("result_full"):
-                                st["result_summary"] = summary
-                                st["result_full"] = full_result
-                                st["success"] = ev.get("success") is not False
-                                if ev.get("elapsed_seconds") is not None:
-                                    st["elapsed_seconds"] = ev.get("elapsed_seconds")
-                                break
-                        save_interval += 1
+                        saver.set_tool_result(summary, full_result, ev.get("success") is not False, ev.get("elapsed_seconds"))
                         _chat_debug("自动化任务栏 工具结果: %s" % ((summary or full_result or "")[:300]))
-                    if save_interval >= 1:
-                        save_interval = 0
-                        _save_partial(cid, full_content, tool_steps, plan_content)
-                        raw = "".join(full_content)
-                        if raw:
-                            _chat_debug("AI对话 助手内容(片段): %d 字" % len(raw))
                     yield f"data: {json.dumps(ev, ensure_ascii=False)}\n\n"
                 else:
-                    full_content.append(chunk if isinstance(chunk, str) else "")
-                    save_interval += 1
-                    if save_interval >= 1:
-                        save_interval = 0
-                        _save_partial(cid, full_content, tool_steps)
-                        _chat_debug("AI对话 助手内容(片段): %d 字" % len("".join(full_content)))
+                    saver.add_content(chunk if isinstance(chunk, str) else "")
                     yield f"data: {json.dumps({'content': chunk}, ensure_ascii=False)}\n\n"
-            content = ("【当前情况与计划】\n\n" + plan_content + "\n\n---\n\n" + "".join(full_content)) if plan_content else "".join(full_content)
-            assistant_msg = {"role": "assistant", "content": content, "model_label": model_label}
-            if tool_steps:
-                assistant_msg["tool_steps"] = tool_steps
-            conv = get_conversation(cid)
-            if conv:
-                msgs = conv.get("messages", [])
-                if msgs and msgs[-1].get("role") == "assistant":
-                    new_messages = msgs[:-1] + [assistant_msg]
-                else:
-                    new_messages = msgs + [assistant_msg]
-                update_conversation(cid, messages=new_messages)
-                if len(new_messages) == 2:
-                    summary = summarize_conversation_title(provider_id, model, last_user, content)
-                    if summary:
-                        update_conversation(cid, title=summary)
+            content = saver.message()["content"]
+            n_messages = saver.close()
+            if n_messages == 2:
+                summary = summarize_conversation_title(provider_id, model, last_user, content)
+                if summary:
+                    update_conversation(cid, title=summary)
             yield f"data: {json.dumps({'conversation_id': cid, 'model_label': model_label}, ensure_ascii=False)}\n\n"
             _chat_debug("流式对话完成: conversation_id=%s 助手回复 %d 字" % (cid, len(content)))
         except Exception as e:
+            saver.close()
             _chat_debug("流式对话异常: %s" % str(e))
             yield f"data: {json.dumps({'error': str(e)}, ensure_ascii=False)}\n\n"
+        finally:
+            # 客户端断开时生成器被关闭，也要把已收到的内容写入
+            saver.close()
 
     return Response(
         stream_with_context(generate()),
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+录包 body 的内容寻址存储：按 SHA-256 存于 data/blobs/<前两位>/<哈希>，相同内容只存一份。
+- 写入：临时文件 + os.replace，已存在则直接复用；compress 开启且压缩后更小时存为 <哈希>.z（zlib）
+- 读取：未压缩的 blob 用 mmap 按字节区间读取，不整体载入内存；压缩的 blob 解压后再取区间
+- 清理：gc(live) 删除不再被任何录包引用的 blob（录包按保留上限删段或清空后调用）
+录包中只保存引用 {"sha256", "size", "codec"}，size 为原始字节数。
+"""
+import hashlib
+import mmap
+import os
+import threading
+import time
+import uuid
+import zlib
+from pathlib import Path
+
+ZLIB_LEVEL = 6
+MIN_COMPRESS_BYTES = 512  # 太小的 body 压缩收益不抵开销
+GC_GRACE_SECONDS = 60  # 刚写入、引用可能尚未登记的 blob 不回收
+
+
+class BlobStore:
+    def __init__(self, root, compress=False):
+        self.root = Path(root)
+        self.compress = bool(compress)
+        self._gc_lock = threading.Lock()
+        self.writes = 0
+        self.dedup_hits = 0
+
+    def _path(self, digest, codec):
+        return self.root / digest[:2] / (digest + (".z" if codec == "zlib" else ""))
+
+    def put(self, data):
+        """保存 bytes，返回引用；内容已存在时只返回引用"""
+        digest = hashlib.sha256(data).hexdigest()
+        for codec in ("raw", "zlib"):
+            path = self._path(digest, codec)
+            if path.exists():
+                try:
+                    os.utime(path)  # 刷新时间，避免复用的旧 blob 在引用登记前被 gc 回收
+                except OSError:
+                    continue
+                self.dedup_hits += 1
+                return {"sha256": digest, "size": len(data), "codec": codec}
+        codec, payload = "raw", data
+        if self.compress and len(data) >= MIN_COMPRESS_BYTES:
+            packed = zlib.compress(data, ZLIB_LEVEL)
+            if len(packed) < len(data):
+                codec, payload = "zlib", packed
+        path = self._path(digest, codec)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name("%s.%s.tmp" % (path.name, uuid.uuid4().hex[:8]))
+        with open(tmp, "wb") as f:
+            f.write(payload)
+        os.replace(tmp, path)
+        self.writes += 1
+        return {"sha256": digest, "size": len(data), "codec": codec}
+
+    def read(self, ref, start=0, end=None):
+        """读取 [start, end) 字节区间（end 为 None 表示到末尾）；blob 不存在返回 None"""
+        size = int(ref.get("size") or 0)
+        end = size if end is None else min(end, size)
+        start = max(0, min(start, end))
+        path = self._path(ref["sha256"], ref.get("codec"))
+        try:
+            if ref.get("codec") == "zlib":
+                with open(path, "rb") as f:
+                    return zlib.decompress(f.read())[start:end]
+            if start >= end:
+                return b"" if path.exists() else None
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                return m[start:end]
+        except (OSError, ValueError, zlib.error):
+            return None
+
+    def gc(self, live):
+        """删除不在 live（sha256 集合）中的 blob；返回 (删除个数, 释放字节数)"""
+        if not self.root.exists():
+            return 0, 0
+        removed = freed = 0
+        cutoff = time.time() - GC_GRACE_SECONDS
+        with self._gc_lock:
+            for p in self.root.glob("*/*"):
+                digest = p.name.split(".")[0]
+                if digest in live:
+                    continue
+                try:
+                    st = p.stat()
+                    if st.st_mtime > cutoff:
+                        continue
+                    p.unlink()
+                    removed += 1
+                    freed += st.st_size
+                except OSError:
+                    pass
+        return removed, freed
+
+    def stats(self):
+        count = size = 0
+        for p in (self.root.glob("*/*") if self.root.exists() else ()):
+            try:
+                size += p.stat().st_size
+                count += 1
+            except OSError:
+                pass
+        return {
+            "blobs": count,
+            "bytes": size,
+            "compress": self.compress,
+            "writes": self.writes,
+            "dedup_hits": self.dedup_hits,
+        }
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+响应体改写：把一个响应命中的全部 modify_response_body 规则合并为一次扫描。
+- 响应体只取一次（flow.response.content，已按 Content-Encoding 解压），改写后只写回一次；
+  不再每条规则都解码为文本、替换、再编码（压缩）一遍
+- 非文本类型（图片、音视频、字体、压缩包、二进制流等）直接跳过
+- 所有 old_text 按字符集编码为 bytes 后合并为一个多模式匹配器（按长度从长到短排列的转义正则分支，由 re 的 C 实现扫描），
+  对原始 bytes 一次替换；UTF-8 与单字节字符集下按字节匹配与按文本匹配等价。GBK、Shift_JIS 等多字节字符集的后续字节
+  可能落在 ASCII 区，会误配半个字符，这类响应先解码为文本再用同样的匹配器扫描
+- 整个响应体只由匹配器扫描一次；没有任何匹配时不修改响应
+- 匹配器按（规则集版本，规则 ID 组合，字符集）缓存，规则集变更后整体作废
+- new_text 无法用响应的字符集表示时（如 GBK 页面替换出 emoji），与 mitmproxy 的 text 赋值一样改用 UTF-8 编码，
+  并把 Content-Type 的 charset 改为 utf-8；old_text 无法用该字符集表示时它不可能出现在响应体中，该规则不生效
+
+与原来逐条 str.replace 的差别：所有规则都在原始响应体上匹配，一次扫描内取最左、同位置取最长的匹配，互不重叠；
+前一条规则替换出的文本不会再被后一条规则匹配（不再级联）。多条规则 old_text 相同时，按添加顺序第一条生效。
+"""
+import re
+import threading
+
+from .traffic_rules import traffic_rules
+
+MAX_CACHED = 256
+
+# 视为文本的 Content-Type：text/* 以及以下关键词
+_TEXT_TYPE_HINTS = ("json", "javascript", "ecmascript", "xml", "html", "x-www-form-urlencoded", "graphql", "csv")
+# 按字节匹配即与按文本匹配等价的字符集
+_BYTE_SAFE_CHARSETS = ("utf-8", "utf8", "ascii", "us-ascii", "iso-8859", "latin", "windows-125", "cp125")
+
+_CHARSET_RE = re.compile(r"charset\s*=\s*[\"']?([\w.:-]+)", re.IGNORECASE)
+
+
+def is_text_content_type(content_type):
+    """是否按文本改写；没有 Content-Type 时按文本处理（与原 flow.response.text 的行为一致）"""
+    ct = (content_type or "").split(";")[0].strip().lower()
+    if not ct:
+        return True
+    return ct.startswith("text/") or any(h in ct for h in _TEXT_TYPE_HINTS)
+
+
+def _charset(content_type):
+    m = _CHARSET_RE.search(content_type or "")
+    return m.group(1).lower() if m else "utf-8"
+
+
+def _with_utf8(content_type):
+    """把 Content-Type 的 charset 改为 utf-8"""
+    return _CHARSET_RE.sub("charset=utf-8", content_type) if _CHARSET_RE.search(content_type or "") \
+        else (content_type or "text/plain") + "; charset=utf-8"
+
+
+class _Rewriter:
+    """
+    一组规则在某个字符集下的多模式匹配器；bytes_mode 为 False 时匹配解码后的文本。
+    有 new_text 无法用该字符集编码时不走字节模式，改写结果按 UTF-8 编码
+    """
+
+    __slots__ = ("charset", "bytes_mode", "patterns", "regex")
+
+    def __init__(self, rules, charset):
+        try:
+            "".encode(charset)
+        except LookupError:
+            charset = "utf-8"
+        self.charset = charset
+        pairs = []
+        for rule in rules:
+            data = rule.get("data") or {}
+            old, new = data.get("old_text"), data.get("new_text")
+            if not old or not new:
+                continue
+            old, new = str(old), str(new)
+            try:
+                old.encode(charset)
+            except UnicodeError:
+                continue  # 响应体中不可能出现
+            pairs.append((old, new, rule))
+        self.bytes_mode = charset.startswith(_BYTE_SAFE_CHARSETS)
+        if self.bytes_mode:
+            try:
+                pairs = [(old.encode(charset), new.encode(charset), rule) for old, new, rule in pairs]
+            except UnicodeError:
+                self.bytes_mode = False
+        self.patterns = {}  # old_text（bytes 或 str）-> (new_text, 规则)
+        for old, new, rule in pairs:
+            self.patterns.setdefault(old, (new, rule))
+        keys = sorted(self.patterns, key=len, reverse=True)
+        if not keys:
+            self.regex = None
+        elif self.bytes_mode:
+            self.regex = re.compile(b"|".join(re.escape(k) for k in keys))
+        else:
+            self.regex = re.compile("|".join(re.escape(k) for k in keys))
+
+    def apply(self, body):
+        """返回 (新响应体或 None, 实际生效的规则列表, 新响应体的字符集)"""
+        if self.regex is None or not body:
+            return None, [], self.charset
+        if self.bytes_mode:
+            subject = body
+        else:
+            subject = body.decode(self.charset, errors="surrogateescape")
+        patterns = self.patterns
+        used = {}
+
+        def _replace(m):
+            new, rule = patterns[m.group(0)]
+            used[rule["id"]] = rule
+            return new
+
+        out = self.regex.sub(_replace, subject)
+        if not used:
+            return None, [], self.charset
+        charset = self.charset
+        if not self.bytes_mode:
+            try:
+                out = out.encode(charset, errors="surrogateescape")
+            except UnicodeError:
+                charset = "utf-8"
+                out = out.encode(charset, errors="surrogateescape")
+        return out, list(used.values()), charset
+
+
+class BodyRewriter:
+    """按（规则集版本，规则 ID 组合，字符集）缓存 _Rewriter"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._cache = {}
+        self._stats = {"responses": 0, "skipped_binary": 0, "rewritten": 0, "charset_to_utf8": 0, "compiled": 0,
+                       "cache_hits": 0}
+
+    def _get(self, rules, charset):
+        version = traffic_rules.version
+        key = (tuple(r["id"] for r in rules), charset)
+        with self._lock:
+            if version != self._version:
+                self._version = version
+                self._cache = {}
+            rw = self._cache.get(key)
+            if rw is not None:
+                self._stats["cache_hits"] += 1
+                return rw
+        rw = _Rewriter(rules, charset)
+        with self._lock:
+            if len(self._cache) >= MAX_CACHED:
+                self._cache.clear()
+            self._cache[key] = rw
+            self._stats["compiled"] += 1
+        return rw
+
+    def rewrite(self, body, content_type, rules):
+        """
+        对响应体执行一组 modify_response_body 规则
+
+        Args:
+            body: 响应体 bytes（已解压）
+            content_type: 响应的 Content-Type
+            rules: 命中的规则（按添加顺序）
+
+        Returns:
+            (新响应体，未修改时为 None；实际生效的规则列表；新的 Content-Type，未变时为 None)
+        """
+        if not rules:
+            return None, [], None
+        with self._lock:
+            self._stats["responses"] += 1
+        if not is_text_content_type(content_type):
+            with self._lock:
+                self._stats["skipped_binary"] += 1
+            return None, [], None
+        charset = _charset(content_type)
+        rw = self._get(rules, charset)
+        out, used, out_charset = rw.apply(body)
+        new_type = None
+        if out is not None and out_charset != rw.charset:
+            new_type = _with_utf8(content_type)
+        if out is not None:
+            with self._lock:
+                self._stats["rewritten"] += 1
+                if new_type is not None:
+                    self._stats["charset_to_utf8"] += 1
+        return out, used, new_type
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, cached=len(self._cache))
+
+
+rewriter = BodyRewriter()
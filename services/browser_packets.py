@@ -1,18 +1,324 @@
 # -*- coding: utf-8 -*-
-"""记录器流量录包存储：供录制代理与记录器页、AI 工具共用。"""
+"""
+记录器流量录包存储：供录制代理与记录器页、AI 工具共用。
+持久化为只追加的 NDJSON 段文件（data/browser_packets/seg-*.ndjson），每条录包一行：
+- 写入只追加当前段，超过 SEGMENT_BYTES 换新段；每次写入 flush，距上次 fsync 超过 FSYNC_INTERVAL 秒时 fsync
+- 超过保留条数（set_retention）时丢弃最旧的录包并删除已全部过期的段文件；clear_packets 删除全部段
+- load_packets 按顺序重放各段；旧版 data/browser_packets.json 在首次加载时导入并改名为 .json.bak
+录包 id 为单调递增的整数（字符串形式），在 _PACKETS 中连续存放，按 id 取录包与按游标翻页都是下标运算；
+旧版随机 id 在加载时统一重新编号（原 id 保存在 legacy_id，仍可查询），清空后编号继续递增不复用。
+按 host/路径前缀/方法/状态码/Content-Type/时间过滤时走 packet_index 的二级索引，不逐条扫描全部录包。
+设置了 blob 目录（set_blob_store）时，完整 body（不超过 set_body_limit 的上限）存入内容寻址的 blob_store，
+录包只保存引用 request_body/response_body 与几 KB 的预览；read_body 按字节区间读取。
+内存中每条录包是 __slots__ 的 PacketRecord：id 存整数，请求/响应头是 _HeaderTable 中共享的 (名, 值) 元组，
+名称与较短的值经 sys.intern 驻留；同一浏览器/服务器的头集合在成千上万条录包间只存一份。
+对外（list_packets/get_packet/段文件）仍是原来的 dict 格式；内部的索引与检索经 get_record/records_after 直接读 PacketRecord。
+"""
+import bisect
 import json
+import os
+import sys
+import threading
 import time
-import uuid
 from pathlib import Path
 
+from .blob_store import BlobStore
+from .packet_filter import compile_filter
+from .packet_index import PacketIndex
+from .recorder_filter import address_predicate
+
 _PACKETS = []
-_MAX_BODY_PREVIEW = 64 * 1024  # 单次请求/响应 body 预览最多 64KB
-_PERSIST_PATH = None  # 由应用设置，如 Path("data/browser_packets.json")
+_MAX_BODY_PREVIEW = 64 * 1024  # 单次请求/响应 body 预览最多 64KB（未启用 blob 存储时）
+_BLOB_PREVIEW = 4 * 1024  # 启用 blob 存储时内存中保留的预览字节数
+DEFAULT_BODY_LIMIT = 1024 * 1024
+_PERSIST_PATH = None  # 段文件目录，由应用设置，如 Path("data/browser_packets")
+SEGMENT_BYTES = 16 * 1024 * 1024
+FSYNC_INTERVAL = 1.0  # 秒
+DEFAULT_MAX_PACKETS = 20000
+_META_FILE = "meta.json"
+_INTERN_VALUE_CHARS = 256  # 更长的头值（如 Cookie）基本不重复，不驻留
+_HEADER_COMPACT_MIN = 4096  # 头集合数超过此值且比上次整理后翻倍时才整理驻留表
+
+_LOCK = threading.RLock()
+_GC_LOCK = threading.Lock()
+_gc_pending = False
+_gc_running = False
+_max_packets = DEFAULT_MAX_PACKETS
+_segments = []  # [[段文件名, 段内录包条数]]，按写入顺序
+_dropped_in_head = 0  # 最旧段中已因保留上限丢弃的条数
+_seg_fp = None
+_seg_bytes = 0
+_last_fsync = 0.0
+_next_id = 1
+_legacy_ids = {}  # 旧版随机 id -> 新编号
+_INDEX = PacketIndex()
+_LISTENERS = []  # 新录包写入后调用的无参回调（如全文索引的唤醒）
+_BLOBS = None
+_body_limit = DEFAULT_BODY_LIMIT
+_clear_count = 0  # 清空次数；推送连接据此发现录包已被清空
+_COUNT_CACHE = {}  # count_packets 的过滤条件 -> (清空次数, 首条编号, 已计到的编号, 总数)
+_COUNT_CACHE_SIZE = 32
+
+
+class _HeaderTable:
+    """
+    头集合驻留表：相同的 (名, 值) 对与相同的整组头各只保留一个元组对象。
+    intern 在 _LOCK 之外调用（构造录包时），整理会替换两张表，因此自带一把锁
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pairs = {}
+        self._sets = {}
+        self._live = 0  # 上次整理后的头集合数
+
+    def intern(self, headers):
+        if not headers:
+            return ()
+        items = []
+        for k, v in headers.items():
+            v = str(v)
+            items.append((sys.intern(str(k)), sys.intern(v) if len(v) <= _INTERN_VALUE_CHARS else v))
+        with self._lock:
+            pairs = self._pairs
+            items = tuple(pairs.setdefault(pair, pair) for pair in items)
+            return self._sets.setdefault(items, items)
+
+    def compact(self, records):
+        """只保留仍被录包引用的条目（清空、加载后调用，调用方持有 _LOCK）"""
+        with self._lock:
+            sets = {}
+            for r in records:
+                sets[r.req_headers] = r.req_headers
+                sets[r.res_headers] = r.res_headers
+            self._sets = sets
+            self._pairs = {pair: pair for h in sets for pair in h}
+            self._live = len(sets)
+
+    def maybe_compact(self, records):
+        """
+        保留裁剪后调用：头集合数超过 _HEADER_COMPACT_MIN 且是上次整理后的两倍以上时才遍历录包整理，
+        遍历的代价摊到其间新登记的头集合上
+        """
+        if len(self._sets) > max(_HEADER_COMPACT_MIN, 2 * self._live):
+            self.compact(records)
+
+    def stats(self):
+        with self._lock:
+            return {"header_sets": len(self._sets), "header_pairs": len(self._pairs)}
+
+
+_HEADERS = _HeaderTable()
+
+
+def _ref_tuple(ref):
+    if not ref:
+        return None
+    return (ref["sha256"], ref.get("size"), sys.intern(ref.get("codec") or "raw"), ref.get("original_size"))
+
+
+def _ref_dict(t):
+    if t is None:
+        return None
+    d = {"sha256": t[0], "size": t[1], "codec": t[2]}
+    if t[3] is not None:
+        d["original_size"] = t[3]
+    return d
+
+
+class PacketRecord:
+    """
+    内存中的录包；get/[] 按原 dict 的键名取值，to_dict 还原为对外格式。
+    get("request_headers") 等每次都新建 dict；内部的热路径（packet_index、packet_filter、packet_search）
+    直接读 req_headers/res_headers，即共享的 ((名, 值), ...) 元组，不要修改
+    """
+
+    __slots__ = ("id", "time", "method", "url", "req_headers", "req_preview", "status",
+                 "res_headers", "res_preview", "req_ref", "res_ref", "legacy_id")
+
+    def __init__(self, id, time, method, url, req_headers, req_preview, status, res_headers, res_preview,
+                 req_ref=None, res_ref=None, legacy_id=None):
+        self.id = id
+        self.time = time
+        self.method = method
+        self.url = url
+        self.req_headers = req_headers
+        self.req_preview = req_preview
+        self.status = status
+        self.res_headers = res_headers
+        self.res_preview = res_preview
+        self.req_ref = req_ref
+        self.res_ref = res_ref
+        self.legacy_id = legacy_id
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(
+            _packet_id(d.get("id")), d.get("time"), sys.intern((d.get("method") or "GET").upper()), d.get("url") or "",
+            _HEADERS.intern(d.get("request_headers")), d.get("request_body_preview"), d.get("response_status"),
+            _HEADERS.intern(d.get("response_headers")), d.get("response_body_preview"),
+            _ref_tuple(d.get("request_body")), _ref_tuple(d.get("response_body")), d.get("legacy_id"),
+        )
+
+    def get(self, key, default=None):
+        getter = _RECORD_GETTERS.get(key)
+        if getter is None:
+            return default
+        value = getter(self)
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if key == "id":
+            self.id = _packet_id(value)
+        elif key == "legacy_id":
+            self.legacy_id = value
+        else:
+            raise KeyError(key)
+
+    def to_dict(self):
+        d = {
+            "id": None if self.id is None else str(self.id),
+            "time": self.time,
+            "method": self.method,
+            "url": self.url,
+            "request_headers": dict(self.req_headers),
+            "request_body_preview": self.req_preview,
+            "response_status": self.status,
+            "response_headers": dict(self.res_headers),
+            "response_body_preview": self.res_preview,
+        }
+        if self.req_ref is not None:
+            d["request_body"] = _ref_dict(self.req_ref)
+        if self.res_ref is not None:
+            d["response_body"] = _ref_dict(self.res_ref)
+        if self.legacy_id is not None:
+            d["legacy_id"] = self.legacy_id
+        return d
+
+    def project(self, fields):
+        """只取 fields（PROJECTION_FIELDS 中的名称）组成 dict，键名即字段名"""
+        return {f: _PROJECTIONS[f](self) for f in fields}
+
+
+_MISSING = object()
+_RECORD_GETTERS = {
+    "id": lambda r: None if r.id is None else str(r.id),
+    "time": lambda r: r.time,
+    "method": lambda r: r.method,
+    "url": lambda r: r.url,
+    "request_headers": lambda r: dict(r.req_headers),
+    "request_body_preview": lambda r: r.req_preview,
+    "response_status": lambda r: r.status,
+    "response_headers": lambda r: dict(r.res_headers),
+    "response_body_preview": lambda r: r.res_preview,
+    "request_body": lambda r: _ref_dict(r.req_ref),
+    "response_body": lambda r: _ref_dict(r.res_ref),
+    "legacy_id": lambda r: r.legacy_id,
+}
+
+
+def _body_size(ref, preview):
+    """body 字节数：有 blob 时为完整大小，否则为预览长度"""
+    if ref is not None:
+        return ref[1]
+    return len(preview) if preview else 0
+
+
+def _content_type(headers):
+    for k, v in headers:
+        if k.lower() == "content-type":
+            return v
+    return ""
+
+
+# 投影字段；SUMMARY_FIELDS 为列表与实时推送用的摘要（不含头与 body）；size/req_size 为 body 字节数
+_PROJECTIONS = dict(_RECORD_GETTERS, **{
+    "size": lambda r: _body_size(r.res_ref, r.res_preview),
+    "req_size": lambda r: _body_size(r.req_ref, r.req_preview),
+    "content_type": lambda r: _content_type(r.res_headers),
+})
+PROJECTION_FIELDS = tuple(_PROJECTIONS)
+SUMMARY_FIELDS = ("id", "time", "method", "url", "response_status", "size", "content_type")
+
+
+def parse_fields(fields):
+    """
+    fields 为逗号分隔字符串或列表；返回字段元组（总含 id，翻页游标要用），"all" 或空返回 None（完整录包），
+    "summary" 为 SUMMARY_FIELDS；未知字段抛出 ValueError。
+    """
+    if fields is None:
+        return None
+    if isinstance(fields, str):
+        fields = fields.split(",")
+    names = tuple(dict.fromkeys(str(f).strip() for f in fields if str(f).strip()))
+    if not names or names == ("all",):
+        return None
+    if names == ("summary",):
+        return SUMMARY_FIELDS
+    unknown = [f for f in names if f not in _PROJECTIONS]
+    if unknown:
+        raise ValueError("未知字段：%s（可选：%s）" % (", ".join(unknown), ", ".join(PROJECTION_FIELDS)))
+    return names if "id" in names else ("id",) + names
+
+
+def _packet_id(value):
+    """编号存为整数；旧版随机 id（迁移前）保持字符串"""
+    if value is None or isinstance(value, int):
+        return value
+    s = str(value)
+    return int(s) if s.isdigit() else s
 
 
 def set_persist_path(path):
+    """设置段文件目录；同名 .json 文件视为旧版整体文件，首次加载时导入"""
     global _PERSIST_PATH
-    _PERSIST_PATH = path
+    _close_segment()
+    _PERSIST_PATH = Path(path) if path else None
+
+
+def set_blob_store(path, compress=False):
+    """设置 body blob 目录（如 Path("data/blobs")）；None 表示不保存完整 body，只保留预览"""
+    global _BLOBS
+    _BLOBS = BlobStore(path, compress=compress) if path else None
+
+
+def set_body_limit(limit):
+    """单个 body 保存的最大字节数，0 表示不限（应用启动时按 config.json 的 recorder_body_limit 设置）"""
+    global _body_limit
+    _body_limit = max(0, int(limit or 0))
+
+
+def body_limit():
+    """当前单个 body 的保存上限（0 表示不限）；代理插件在入队前按它截断，避免排队时持有完整的大 body"""
+    return _body_limit
+
+
+def set_retention(max_packets):
+    """最多保留的录包条数（应用启动时按 config.json 的 recorder_max_packets 设置）"""
+    global _max_packets
+    with _LOCK:
+        _max_packets = max(100, int(max_packets))
+        _apply_retention()
+
+
+def add_listener(fn):
+    """注册新录包通知回调；回调在写入线程中、锁外调用，应只做唤醒之类的轻量操作"""
+    if fn not in _LISTENERS:
+        _LISTENERS.append(fn)
+
+
+def _notify():
+    for fn in _LISTENERS:
+        try:
+            fn()
+        except Exception:
+            pass
 
 
 def _truncate(s, max_len=_MAX_BODY_PREVIEW):
@@ -24,85 +330,603 @@ def _truncate(s, max_len=_MAX_BODY_PREVIEW):
     return s[:max_len] + ("…" if len(s) > max_len else "")
 
 
-def add_packet(method: str, url: str, request_headers: dict, request_body, response_status: int, response_headers: dict, response_body):
+def _store_body(body, original_size=None):
+    """返回 (预览, blob 引用)；未启用 blob 存储、body 为空或写入失败时引用为 None。
+    original_size 为入队前已被截断的 body 的原始字节数"""
+    if _BLOBS is None or body is None:
+        return _truncate(body), None
+    data = body if isinstance(body, bytes) else str(body).encode("utf-8")
+    if not data:
+        return "", None
+    original = max(len(data), int(original_size or 0))
+    if _body_limit and original > _body_limit:
+        data = data[:_body_limit]
+    try:
+        ref = _BLOBS.put(data)
+    except OSError:
+        return _truncate(body), None
+    if original > len(data):
+        ref["original_size"] = original  # 超过保存上限被截断
+    preview = data[:_BLOB_PREVIEW].decode("utf-8", errors="replace") + ("…" if len(data) > _BLOB_PREVIEW else "")
+    return preview, ref
+
+
+def _make_entry(method, url, request_headers, request_body, response_status, response_headers, response_body,
+                timestamp=None, request_body_size=None, response_body_size=None):
+    """
+    构造录包（id 在加锁追加时由 _assign_ids 分配）；body 写入 blob 在锁外完成。timestamp 为抓包时间，缺省取当前时间；
+    *_body_size 为入队前截断的 body 的原始字节数
+    """
+    req_preview, req_ref = _store_body(request_body, request_body_size)
+    res_preview, res_ref = _store_body(response_body, response_body_size)
+    return PacketRecord(
+        None, time.time() if timestamp is None else float(timestamp), sys.intern((method or "GET").upper()), url or "",
+        _HEADERS.intern(request_headers), req_preview, response_status,
+        _HEADERS.intern(response_headers), res_preview,
+        _ref_tuple(req_ref), _ref_tuple(res_ref),
+    )
+
+
+def add_packet(method: str, url: str, request_headers: dict, request_body, response_status: int, response_headers: dict, response_body,
+               timestamp=None):
     """记录一条请求/响应。body 可为 str 或 bytes，会做截断预览。"""
-    pid = str(uuid.uuid4())[:8]
-    ts = time.time()
-    req_h = dict(request_headers) if request_headers else {}
-    req_body = _truncate(request_body)
-    res_h = dict(response_headers) if response_headers else {}
-    res_body = _truncate(response_body)
-    entry = {
-        "id": pid,
-        "time": ts,
-        "method": (method or "GET").upper(),
-        "url": url or "",
-        "request_headers": req_h,
-        "request_body_preview": req_body,
-        "response_status": response_status,
-        "response_headers": res_h,
-        "response_body_preview": res_body,
-    }
-    _PACKETS.append(entry)
-    _persist()
-    return pid
-
-
-def list_packets(url_contains: str = None, url_contains_any: list = None, limit: int = 200):
-    """返回录包列表，可选按 URL 过滤（单个或任意多个匹配），按时间倒序，最多 limit 条。"""
-    out = list(_PACKETS)
+    entry = _make_entry(method, url, request_headers, request_body, response_status, response_headers, response_body,
+                        timestamp)
+    with _LOCK:
+        _assign_ids([entry])
+        _PACKETS.append(entry)
+        _INDEX.add(entry.id, entry)
+        _append_segment([entry])
+        _apply_retention()
+    _notify()
+    return entry["id"]
+
+
+def add_packets(items):
+    """批量记录：items 为 add_packet 参数字典的列表（可含 timestamp）；整批一次加锁、一次写入段文件。返回 id 列表。"""
+    entries = [_make_entry(**item) for item in items]
+    if not entries:
+        return []
+    with _LOCK:
+        _assign_ids(entries)
+        _PACKETS.extend(entries)
+        for e in entries:
+            _INDEX.add(e.id, e)
+        _append_segment(entries)
+        _apply_retention()
+    _notify()
+    return [e["id"] for e in entries]
+
+
+def _assign_ids(entries):
+    """按追加顺序分配连续 id（调用方持有 _LOCK）"""
+    global _next_id
+    for e in entries:
+        e.id = _next_id
+        _next_id += 1
+
+
+def _base_id():
+    return _PACKETS[0].id if _PACKETS else _next_id
+
+
+def _id_number(packet_id):
+    """id（含旧版随机 id）转为编号，无法识别返回 None"""
+    if packet_id is None:
+        return None
+    try:
+        return int(packet_id)
+    except (TypeError, ValueError):
+        return _legacy_ids.get(str(packet_id))
+
+
+def _slot(packet_id):
+    """id -> _PACKETS 下标（id 连续，下标 = id - 首条 id）；不存在返回 None（调用方持有 _LOCK）"""
+    n = _id_number(packet_id)
+    if n is None:
+        return None
+    i = n - _base_id()
+    return i if 0 <= i < len(_PACKETS) else None
+
+
+def oldest_id_number():
+    """最旧一条录包的编号；没有录包时为下一个将分配的编号"""
+    with _LOCK:
+        return _base_id()
+
+
+def latest_id():
+    """最新一条录包的 id，没有录包返回 None"""
+    with _LOCK:
+        return _PACKETS[-1]["id"] if _PACKETS else None
+
+
+def _url_predicate(url_contains=None, url_contains_any=None, addresses=None):
+    if addresses:
+        pred = address_predicate(addresses)
+        if pred is not None:
+            return pred
     if url_contains_any and len(url_contains_any) > 0:
         patterns = [str(s).strip().lower() for s in url_contains_any if s and str(s).strip()]
         if patterns:
-            def match_any(url):
-                u = (url or "").lower()
-                return any(q in u for q in patterns)
-            out = [p for p in out if match_any(p.get("url") or "")]
+            return lambda p: any(q in p.url.lower() for q in patterns)
     elif url_contains and url_contains.strip():
         q = url_contains.strip().lower()
-        out = [p for p in out if q in (p.get("url") or "").lower()]
-    out.reverse()
-    return out[: max(1, min(1000, int(limit) if limit else 200))]
+        return lambda p: q in p.url.lower()
+    return None
+
+
+def _candidate_slots(driver, base, n, after, before):
+    """按游标方向产出待检查的 _PACKETS 下标：有驱动倒排列表时只走列表中的编号，否则顺序扫描（调用方持有 _LOCK）"""
+    if driver is None:
+        if after is not None:
+            return range(min(max(after - base + 1, 0), n), n)
+        return range((n if before is None else min(max(before - base, 0), n)) - 1, -1, -1)
+    if after is not None:
+        start = bisect.bisect_right(driver, max(after, base - 1))
+        return (num - base for num in driver[start:])
+    end = len(driver) if before is None else bisect.bisect_left(driver, before)
+    start = bisect.bisect_left(driver, base, 0, end)  # 跳过已被保留上限裁掉、尚未惰性清理的编号
+    return (driver[j] - base for j in range(end - 1, start - 1, -1))
+
+
+def _query(url_contains, url_contains_any, host, path_prefix, method, status, content_type, since, until, filter_expr,
+           addresses=None):
+    """过滤参数 -> (URL 判定, 过滤表达式判定, packet_index.plan 的条件)"""
+    pred = _url_predicate(url_contains, url_contains_any, addresses)
+    compiled = compile_filter(filter_expr.strip()) if filter_expr and filter_expr.strip() else None
+    conditions = {"host": host, "path_prefix": path_prefix, "method": method, "status": status,
+                  "content_type": content_type, "since": since, "until": until}
+    if compiled is not None:
+        for k, v in compiled.hints.items():
+            if conditions.get(k) is None:
+                conditions[k] = v
+    return pred, (compiled.match if compiled is not None else None), conditions
+
+
+def list_packets(url_contains: str = None, url_contains_any: list = None, limit: int = 200, after_id=None, before_id=None,
+                 host=None, path_prefix=None, method=None, status=None, content_type=None, since=None, until=None,
+                 filter_expr=None, fields=None, addresses=None):
+    """
+    返回录包列表（按时间倒序，最多 limit 条），可选按 URL 过滤（单个或任意多个匹配）。
+    游标：before_id 取比它更旧的一页；after_id 取比它更新的录包中最旧的 limit 条（用于增量拉取新录包）。
+    结构化条件（可组合）：host 精确匹配；path_prefix 路径前缀；method；status 为具体状态码或 "4xx"/"4"；
+    content_type 为完整类型（application/json）或其中一段（json）；since/until 为 Unix 时间戳（含端点）。
+    addresses 为录制过滤器的地址列表，按录制时相同的规则匹配（域名按主机名后缀，其余按 URL 子串，见 recorder_filter），
+    优先于 url_contains/url_contains_any。
+    filter_expr 为过滤表达式（见 packet_filter），语法错误抛出 ValueError；其中顶层 && 的可索引条件参与选驱动列表。
+    无过滤条件时每页只访问 limit 个下标；有结构化条件时只遍历命中条数最少的那个索引列表。
+    fields 为投影字段（见 parse_fields），只返回这些字段；为空时返回完整录包。
+    """
+    limit = max(1, min(1000, int(limit) if limit else 200))
+    fields = parse_fields(fields)
+    pred, match, conditions = _query(url_contains, url_contains_any, host, path_prefix, method, status, content_type,
+                                     since, until, filter_expr, addresses)
+    out = []
+    with _LOCK:
+        n = len(_PACKETS)
+        base = _base_id()
+        after = _id_number(after_id)
+        before = _id_number(before_id) if after is None else None
+        driver, check = _INDEX.plan(**conditions)
+        keys = _INDEX.keys_at
+        for i in _candidate_slots(driver, base, n, after, before):
+            if i >= n:
+                break
+            k = keys(base + i) if check is not None or match is not None else None
+            if check is not None and not check(k):
+                continue
+            p = _PACKETS[i]
+            if (pred is None or pred(p)) and (match is None or match(p, k)):
+                out.append(p)
+                if len(out) >= limit:
+                    break
+    if after is not None:
+        out.reverse()
+    if fields is not None:
+        return [p.project(fields) for p in out]
+    return [p.to_dict() for p in out]
+
+
+def count_packets(url_contains: str = None, url_contains_any: list = None, host=None, path_prefix=None, method=None,
+                  status=None, content_type=None, since=None, until=None, filter_expr=None, addresses=None):
+    """
+    满足条件（参数同 list_packets）的录包总数；无条件时 O(1)，只有结构化条件时遍历最短的倒排列表。
+    结果按条件缓存：之后只有新录包追加时只检查新录包，清空或保留上限裁掉旧录包后才整体重算
+    """
+    pred, match, conditions = _query(url_contains, url_contains_any, host, path_prefix, method, status, content_type,
+                                     since, until, filter_expr, addresses)
+    key = (url_contains, tuple(url_contains_any or ()), tuple(addresses or ()), host, path_prefix, method, status,
+           content_type, since, until, filter_expr)
+    with _LOCK:
+        n = len(_PACKETS)
+        driver, check = _INDEX.plan(**conditions)
+        if check is None and pred is None and match is None:
+            return n
+        base = _base_id()
+        upto = base + n - 1
+        cached = _COUNT_CACHE.get(key)
+        if cached is not None and cached[:2] == (_clear_count, base) and cached[2] <= upto:
+            after, total = cached[2], cached[3]
+        else:
+            after, total = None, 0
+        keys = _INDEX.keys_at
+        for i in _candidate_slots(driver, base, n, after, None):
+            k = keys(base + i) if check is not None or match is not None else None
+            if check is not None and not check(k):
+                continue
+            p = _PACKETS[i]
+            if (pred is None or pred(p)) and (match is None or match(p, k)):
+                total += 1
+        if key not in _COUNT_CACHE and len(_COUNT_CACHE) >= _COUNT_CACHE_SIZE:
+            _COUNT_CACHE.pop(next(iter(_COUNT_CACHE)))
+        _COUNT_CACHE[key] = (_clear_count, base, upto, total)
+        return total
 
 
 def get_packet(packet_id: str):
-    """按 id 返回一条录包，不存在返回 None。"""
-    for p in _PACKETS:
-        if p.get("id") == packet_id:
-            return p
-    return None
+    """按 id 返回一条录包（下标运算），不存在返回 None。"""
+    with _LOCK:
+        i = _slot(packet_id)
+        return _PACKETS[i].to_dict() if i is not None else None
+
+
+def get_record(packet_id):
+    """内部读取用：按 id 返回 PacketRecord 本身（共享，只读），不存在返回 None"""
+    with _LOCK:
+        i = _slot(packet_id)
+        return _PACKETS[i] if i is not None else None
+
+
+def records_after(after_id, limit):
+    """内部读取用：id 大于 after_id 的最旧 limit 条 PacketRecord（共享，只读），按 id 升序"""
+    with _LOCK:
+        n = len(_PACKETS)
+        start = min(max(int(after_id) - _base_id() + 1, 0), n)
+        return _PACKETS[start:start + max(0, int(limit))]
+
+
+def _body_ref(p, which):
+    return p.get("request_body" if which == "request" else "response_body")
+
+
+def body_info(p, which):
+    """录包（get_packet 的结果）body 的 (总字节数, Content-Type)；which 为 request 或 response"""
+    headers = p.get("request_headers" if which == "request" else "response_headers") or {}
+    ctype = next((str(v) for k, v in headers.items() if str(k).lower() == "content-type"), "")
+    ref = _body_ref(p, which)
+    if ref is not None:
+        return int(ref.get("size") or 0), ctype
+    return len((p.get(which + "_body_preview") or "").encode("utf-8")), ctype
+
+
+def read_body(p, which, start=0, end=None):
+    """
+    按字节区间 [start, end) 读取录包（get_packet 的结果）的 body：有 blob 引用时从 blob（mmap）读取，否则取内存中的预览。
+    有 blob 引用但 blob 已丢失（被回收、blob 存储未启用）时返回 None
+    """
+    ref = _body_ref(p, which)
+    if ref is not None:
+        return _BLOBS.read(ref, start, end) if _BLOBS is not None else None
+    data = (p.get(which + "_body_preview") or "").encode("utf-8")
+    return data[start:end]
+
+
+def body_text(p, which):
+    """录包 body 的完整文本（blob 不可用时退回预览）"""
+    ref = _body_ref(p, which)
+    if ref is not None and _BLOBS is not None:
+        data = _BLOBS.read(ref)
+        if data is not None:
+            return data.decode("utf-8", errors="replace")
+    return p.get(which + "_body_preview") or ""
+
+
+def _live_blobs():
+    with _LOCK:
+        live = set()
+        for p in _PACKETS:
+            if p.req_ref is not None:
+                live.add(p.req_ref[0])
+            if p.res_ref is not None:
+                live.add(p.res_ref[0])
+        return live
+
+
+def _gc_worker():
+    """唯一的回收线程：每轮重新取一次仍被引用的 blob，期间又有回收请求时再来一轮"""
+    global _gc_pending, _gc_running
+    while True:
+        with _GC_LOCK:
+            if not _gc_pending or _BLOBS is None:
+                _gc_running = False
+                return
+            _gc_pending = False
+        try:
+            _BLOBS.gc(_live_blobs())
+        except Exception:
+            pass
+
+
+def _collect_blobs():
+    """删段或清空后请求在后台回收不再被引用的 blob；回收进行中时只做标记，合并为下一轮"""
+    global _gc_pending, _gc_running
+    if _BLOBS is None:
+        return
+    with _GC_LOCK:
+        _gc_pending = True
+        if _gc_running:
+            return
+        _gc_running = True
+    threading.Thread(target=_gc_worker, name="blob-gc", daemon=True).start()
 
 
 def clear_packets():
-    """清空所有录包。"""
-    global _PACKETS
-    _PACKETS = []
-    _persist()
+    """清空所有录包并删除全部段文件。"""
+    global _PACKETS, _dropped_in_head, _clear_count
+    with _LOCK:
+        _PACKETS = []
+        _clear_count += 1
+        _INDEX.clear(_next_id)
+        _HEADERS.compact(_PACKETS)
+        _close_segment()
+        for name, _ in _segments:
+            _unlink_segment(name)
+        _segments.clear()
+        _dropped_in_head = 0
+        _legacy_ids.clear()
+        _save_meta()
+        _collect_blobs()
+    _notify()
 
 
-def _persist():
+def clear_count():
+    return _clear_count
+
+
+def _save_meta():
+    """记录下一个 id，清空后重启编号也不回退（调用方持有 _LOCK）"""
+    d = _segment_dir()
+    if d is None:
+        return
+    try:
+        d.mkdir(parents=True, exist_ok=True)
+        tmp = d / (_META_FILE + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"next_id": _next_id}, f)
+        os.replace(tmp, d / _META_FILE)
+    except OSError:
+        pass
+
+
+def _load_meta():
+    d = _segment_dir()
+    try:
+        with open(d / _META_FILE, "r", encoding="utf-8") as f:
+            return int(json.load(f).get("next_id") or 1)
+    except (OSError, ValueError, TypeError, AttributeError):
+        return 1
+
+
+def _renumber_and_rewrite():
+    """旧版随机 id 或编号不连续时：按现有顺序重新编号并整体重写段文件（一次性迁移，调用方持有 _LOCK）"""
+    global _next_id, _dropped_in_head
+    _close_segment()
+    for name, _ in _segments:
+        _unlink_segment(name)
+    _segments.clear()
+    _dropped_in_head = 0
+    for e in _PACKETS:
+        if e.id is not None and not isinstance(e.id, int):
+            e.legacy_id = str(e.id)
+    _assign_ids(_PACKETS)
+    for i in range(0, len(_PACKETS), 1000):
+        _append_segment(_PACKETS[i:i + 1000])
+    _save_meta()
+
+
+def _segment_dir():
+    return Path(_PERSIST_PATH) if _PERSIST_PATH else None
+
+
+def _legacy_path():
+    d = _segment_dir()
+    return d.with_name(d.name + ".json") if d else None
+
+
+def _unlink_segment(name):
+    try:
+        (_segment_dir() / name).unlink()
+    except (OSError, TypeError):
+        pass
+
+
+def _close_segment():
+    global _seg_fp
+    if _seg_fp is not None:
+        try:
+            _seg_fp.flush()
+            os.fsync(_seg_fp.fileno())
+            _seg_fp.close()
+        except OSError:
+            pass
+        _seg_fp = None
+
+
+def _open_new_segment():
+    global _seg_fp, _seg_bytes
+    _close_segment()
+    d = _segment_dir()
+    d.mkdir(parents=True, exist_ok=True)
+    seq = int(_segments[-1][0][4:10]) + 1 if _segments else 1
+    name = "seg-%06d.ndjson" % seq
+    _seg_fp = open(d / name, "a", encoding="utf-8")
+    _seg_bytes = 0
+    _segments.append([name, 0])
+
+
+def _append_segment(entries):
+    """把一批录包各写成一行追加到当前段（调用方持有 _LOCK）"""
+    global _seg_bytes, _last_fsync
     if not _PERSIST_PATH:
         return
     try:
-        p = Path(_PERSIST_PATH)
-        p.parent.mkdir(parents=True, exist_ok=True)
-        with open(p, "w", encoding="utf-8") as f:
-            json.dump(_PACKETS, f, ensure_ascii=False, indent=0)
+        if _seg_fp is None or _seg_bytes >= SEGMENT_BYTES:
+            _open_new_segment()
+        data = "".join(json.dumps(e.to_dict(), ensure_ascii=False, separators=(",", ":")) + "\n" for e in entries)
+        _seg_fp.write(data)
+        _seg_fp.flush()
+        _seg_bytes += len(data.encode("utf-8"))
+        _segments[-1][1] += len(entries)
+        now = time.monotonic()
+        if now - _last_fsync >= FSYNC_INTERVAL:
+            os.fsync(_seg_fp.fileno())
+            _last_fsync = now
     except Exception:
         pass
 
 
-def load_packets():
-    """从文件加载录包（应用启动时调用）。"""
-    global _PACKETS
-    if not _PERSIST_PATH:
+def _apply_retention(slack=True):
+    """超过保留上限 10% 时一次裁到上限（摊销列表移动开销），并删除已全部过期的最旧段（调用方持有 _LOCK）"""
+    global _dropped_in_head
+    excess = len(_PACKETS) - _max_packets
+    if excess <= 0 or (slack and excess < max(1, _max_packets // 10)):
         return
+    del _PACKETS[:excess]
+    _INDEX.trim(excess)
+    _HEADERS.maybe_compact(_PACKETS)
+    _dropped_in_head += excess
+    dropped_segment = False
+    while len(_segments) > 1 and _dropped_in_head >= _segments[0][1]:
+        name, count = _segments.pop(0)
+        _dropped_in_head -= count
+        _unlink_segment(name)
+        dropped_segment = True
+    if dropped_segment:
+        _collect_blobs()
+
+
+def flush():
+    """把当前段 fsync 到磁盘（应用退出或需要确保落盘时调用）"""
+    with _LOCK:
+        if _seg_fp is not None:
+            try:
+                _seg_fp.flush()
+                os.fsync(_seg_fp.fileno())
+            except OSError:
+                pass
+
+
+def _read_legacy():
+    """读取旧版整体 JSON 文件中的录包；没有或损坏返回 []"""
+    legacy = _legacy_path()
+    if legacy is None or not legacy.exists():
+        return []
     try:
-        p = Path(_PERSIST_PATH)
-        if p.exists():
-            with open(p, "r", encoding="utf-8") as f:
-                _PACKETS = json.load(f)
-            if not isinstance(_PACKETS, list):
-                _PACKETS = []
+        with open(legacy, "r", encoding="utf-8") as f:
+            items = json.load(f)
     except Exception:
+        return []
+    return [e for e in items if isinstance(e, dict)] if isinstance(items, list) else []
+
+
+def _ids_contiguous():
+    prev = None
+    for e in _PACKETS:
+        if not isinstance(e.id, int) or (prev is not None and e.id != prev + 1):
+            return False
+        prev = e.id
+    return True
+
+
+def _truncate_torn_tail(path):
+    """把段文件截断到最后一个换行之后（没有换行时截为空）；返回截断后的大小"""
+    with open(path, "rb+") as f:
+        end = f.seek(0, os.SEEK_END)
+        pos = end
+        while pos > 0:
+            step = min(4096, pos)
+            f.seek(pos - step)
+            block = f.read(step)
+            i = block.rfind(b"\n")
+            if i >= 0:
+                pos = pos - step + i + 1
+                break
+            pos -= step
+        if pos < end:
+            f.truncate(pos)
+        return pos
+
+
+def load_packets():
+    """按顺序重放段文件重建内存中的录包（应用启动时调用）。"""
+    global _PACKETS, _dropped_in_head, _seg_fp, _seg_bytes, _next_id
+    d = _segment_dir()
+    if d is None:
+        return
+    with _LOCK:
+        _close_segment()
         _PACKETS = []
+        _segments.clear()
+        _COUNT_CACHE.clear()
+        _dropped_in_head = 0
+        names = sorted(p.name for p in d.glob("seg-*.ndjson")) if d.exists() else []
+        for name in names:
+            count = 0
+            try:
+                with open(d / name, "r", encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            entry = PacketRecord.from_dict(json.loads(line))
+                        except (ValueError, AttributeError):
+                            continue  # 崩溃时最后一行可能只写了一半
+                        _PACKETS.append(entry)
+                        count += 1
+            except OSError:
+                continue
+            _segments.append([name, count])
+        legacy = [] if names else _read_legacy()
+        _PACKETS.extend(PacketRecord.from_dict(e) for e in legacy)
+        _next_id = _load_meta()
+        if legacy or not _ids_contiguous():
+            _renumber_and_rewrite()
+            flush()
+            if legacy:
+                try:
+                    _legacy_path().replace(_legacy_path().with_name(_legacy_path().name + ".bak"))
+                except OSError:
+                    pass
+        elif _PACKETS:
+            _next_id = max(_next_id, _PACKETS[-1].id + 1)
+        _legacy_ids.clear()
+        _legacy_ids.update((e.legacy_id, e.id) for e in _PACKETS if e.legacy_id)
+        _apply_retention(slack=False)
+        _INDEX.rebuild(_PACKETS)
+        _HEADERS.compact(_PACKETS)
+        _collect_blobs()
+        # 继续追加到最后一段（未满时）；先截掉崩溃留下的半行，否则下一条会接在它后面，重启后一起丢失
+        if _segments and _seg_fp is None:
+            last = d / _segments[-1][0]
+            try:
+                size = _truncate_torn_tail(last)
+            except OSError:
+                size = SEGMENT_BYTES
+            if size < SEGMENT_BYTES:
+                _seg_fp = open(last, "a", encoding="utf-8")
+                _seg_bytes = size
+
+
+def get_store_stats():
+    with _LOCK:
+        return {
+            "packets": len(_PACKETS),
+            "max_packets": _max_packets,
+            "segments": len(_segments),
+            "segment_bytes_current": _seg_bytes,
+            "next_id": _next_id,
+            "index_values": _INDEX.stats(),
+            "headers": _HEADERS.stats(),
+            "body_limit": _body_limit,
+            "blob_writes": _BLOBS.writes if _BLOBS is not None else None,
+            "blob_dedup_hits": _BLOBS.dedup_hits if _BLOBS is not None else None,
+        }
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+对话冷归档：长期未更新的对话整体压缩写入 data/archive/ 下的只追加段文件，热存储只留元数据存根。
+- 段文件 segment-*.seg：逐条写入压缩后的对话 JSON，写完 fsync；已写入的字节不再改动
+- 索引 index.ndjson：每行一条 add/del 记录（对话 id -> 段文件、偏移、长度、编码），启动时重放，
+  compact_index() 时重写为只含有效记录并删除已无有效记录的段文件
+- 压缩：安装了 zstandard 时用 zstd，否则用标准库 zlib；每条记录自带编码，两者可混存
+"""
+import json
+import os
+import threading
+import time
+import uuid
+import zlib
+from pathlib import Path
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DEFAULT_CODEC = "zstd" if zstandard is not None else "zlib"
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 10
+
+
+def _compress(raw, codec):
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(raw)
+    return zlib.compress(raw, ZLIB_LEVEL)
+
+
+def _decompress(data, codec):
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("归档记录使用 zstd 压缩，但未安装 zstandard：pip install zstandard")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+class ConversationArchive:
+    """归档段文件与索引；索引常驻内存，is_archived 为字典查找。"""
+
+    def __init__(self, root, codec=DEFAULT_CODEC):
+        self.root = Path(root)
+        self.codec = codec
+        self.index_path = self.root / "index.ndjson"
+        self._lock = threading.Lock()
+        self._index = {}
+        self._index_fp = None
+        self._load_index()
+
+    def _load_index(self):
+        if not self.index_path.exists():
+            return
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue  # 崩溃时最后一行可能只写了一半
+                    if rec.get("op") == "add" and rec.get("id"):
+                        self._index[rec["id"]] = rec["entry"]
+                    elif rec.get("op") == "del":
+                        self._index.pop(rec.get("id"), None)
+        except OSError:
+            pass
+
+    def _append_index(self, records):
+        if self._index_fp is None:
+            self.root.mkdir(parents=True, exist_ok=True)
+            self._index_fp = open(self.index_path, "a", encoding="utf-8")
+        for rec in records:
+            self._index_fp.write(json.dumps(rec, ensure_ascii=False, separators=(",", ":")) + "\n")
+        self._index_fp.flush()
+        os.fsync(self._index_fp.fileno())
+
+    def is_archived(self, cid):
+        return cid in self._index
+
+    def entry(self, cid):
+        e = self._index.get(cid)
+        return dict(e) if e else None
+
+    def write_segment(self, convs):
+        """把一批完整对话写入新的段文件并 fsync；返回 {cid: entry}，此时尚未登记到索引（见 commit）"""
+        if not convs:
+            return {}
+        self.root.mkdir(parents=True, exist_ok=True)
+        name = "segment-%s-%s.seg" % (time.strftime("%Y%m%d%H%M%S"), uuid.uuid4().hex[:6])
+        entries = {}
+        offset = 0
+        now = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        with open(self.root / name, "wb") as f:
+            for conv in convs:
+                raw = json.dumps(conv, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+                data = _compress(raw, self.codec)
+                f.write(data)
+                entries[conv["id"]] = {
+                    "segment": name, "offset": offset, "length": len(data), "codec": self.codec,
+                    "raw_bytes": len(raw), "version": conv.get("version"), "archived_at": now,
+                }
+                offset += len(data)
+            f.flush()
+            os.fsync(f.fileno())
+        return entries
+
+    def commit(self, entries):
+        """登记一批已写入段文件的记录（索引追加并 fsync 后才返回，调用方随后再替换热存储）"""
+        if not entries:
+            return
+        with self._lock:
+            self._append_index([{"op": "add", "id": cid, "entry": e} for cid, e in entries.items()])
+            self._index.update(entries)
+
+    def forget(self, cid):
+        """对话已恢复到热存储或被删除：从索引移除（段文件中的字节留待 compact_index 回收）"""
+        with self._lock:
+            if cid not in self._index:
+                return
+            self._append_index([{"op": "del", "id": cid}])
+            self._index.pop(cid, None)
+
+    def load(self, cid):
+        """读取并解压归档中的完整对话；不存在返回 None"""
+        e = self._index.get(cid)
+        if e is None:
+            return None
+        with open(self.root / e["segment"], "rb") as f:
+            f.seek(e["offset"])
+            data = f.read(e["length"])
+        return json.loads(_decompress(data, e["codec"]).decode("utf-8"))
+
+    def compact_index(self):
+        """索引重写为只含有效记录，删除不再被引用的段文件；返回回收的字节数"""
+        with self._lock:
+            live = {e["segment"] for e in self._index.values()}
+            if self._index_fp is not None:
+                self._index_fp.close()
+                self._index_fp = None
+            tmp = self.index_path.with_name(self.index_path.name + ".tmp")
+            self.root.mkdir(parents=True, exist_ok=True)
+            with open(tmp, "w", encoding="utf-8") as f:
+                for cid, e in self._index.items():
+                    f.write(json.dumps({"op": "add", "id": cid, "entry": e}, ensure_ascii=False, separators=(",", ":")) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.index_path)
+            freed = 0
+            for p in self.root.glob("segment-*.seg"):
+                if p.name not in live:
+                    try:
+                        freed += p.stat().st_size
+                        p.unlink()
+                    except OSError:
+                        pass
+            return freed
+
+    def stats(self):
+        with self._lock:
+            entries = list(self._index.values())
+        segments = list(self.root.glob("segment-*.seg")) if self.root.exists() else []
+        return {
+            "codec": self.codec,
+            "conversations": len(entries),
+            "segments": len(segments),
+            "segment_bytes": sum(p.stat().st_size for p in segments),
+            "stored_bytes": sum(e["length"] for e in entries),
+            "raw_bytes": sum(e["raw_bytes"] for e in entries),
+        }
+
+    def close(self):
+        with self._lock:
+            if self._index_fp is not None:
+                self._index_fp.close()
+                self._index_fp = None
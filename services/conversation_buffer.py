@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+流式对话的写回缓冲（write-behind）：合并进行中的助手回复，按时间/事件数预算写入对话存储。
+- 内容片段只累积在内存，满 FLUSH_EVENTS 个事件或距上次写入超过 FLUSH_INTERVAL 秒才写一次
+- 计划、工具调用、工具结果等结构性事件立即写入，便于刷新页面后恢复任务栏
+- 每个事件同时以增量形式记入 data/conversation_journal.ndjson：先在内存中排队，与写入存储同一时机一次写出，
+  结构性事件随之立即落盘；进程崩溃后启动时重放未结束的流
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from . import conversation_store
+
+JOURNAL_FILE = conversation_store.DATA_DIR / "conversation_journal.ndjson"
+FLUSH_INTERVAL = 2.0  # 秒
+FLUSH_EVENTS = 64
+
+_journal_lock = threading.Lock()
+_journal_fp = None
+_open_streams = set()
+_stats = {
+    "streams": 0,
+    "events": 0,
+    "flushes": 0,
+    "journal_records": 0,
+    "replayed_streams": 0,
+}
+_stats_lock = threading.Lock()
+
+
+def _count(key, n=1):
+    with _stats_lock:
+        _stats[key] += n
+
+
+def get_stats():
+    """返回计数器：events 为收到的流式事件数，flushes 为实际写入存储的次数。"""
+    with _stats_lock:
+        out = dict(_stats)
+    out["open_streams"] = len(_open_streams)
+    out["events_per_flush"] = round(out["events"] / out["flushes"], 2) if out["flushes"] else None
+    return out
+
+
+def build_assistant_message(content_parts, tool_steps, plan_content, model_label):
+    """由累积状态拼出助手消息（含计划阶段前缀与工具步骤）"""
+    raw = "".join(content_parts)
+    content = ("【当前情况与计划】\n\n" + plan_content + "\n\n---\n\n" + raw) if plan_content else raw
+    msg = {"role": "assistant", "content": content, "model_label": model_label}
+    if tool_steps:
+        msg["tool_steps"] = [dict(s) for s in tool_steps]
+    return msg
+
+
+def _journal_line(record):
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+def _journal_write(lines, sync=False):
+    """把若干条已序列化的日志行一次写出并 flush"""
+    global _journal_fp
+    if not lines:
+        return
+    with _journal_lock:
+        try:
+            if _journal_fp is None:
+                JOURNAL_FILE.parent.mkdir(parents=True, exist_ok=True)
+                _journal_fp = open(JOURNAL_FILE, "a", encoding="utf-8")
+            _journal_fp.write("".join(lines))
+            _journal_fp.flush()
+            if sync:
+                os.fsync(_journal_fp.fileno())
+        except OSError:
+            return
+    _count("journal_records", len(lines))
+
+
+def _journal_release(sid):
+    """流结束后登记；没有进行中的流时截断日志，保持日志很小"""
+    global _journal_fp
+    with _journal_lock:
+        _open_streams.discard(sid)
+        if _open_streams:
+            return
+        try:
+            if _journal_fp is not None:
+                _journal_fp.close()
+            _journal_fp = None
+            with open(JOURNAL_FILE, "w", encoding="utf-8"):
+                pass
+        except OSError:
+            pass
+
+
+class StreamSaver:
+    """单次流式回复的写回缓冲；由 api_chat_stream 在每个 SSE 事件后调用。"""
+
+    def __init__(self, cid, model_label, flush_interval=FLUSH_INTERVAL, flush_events=FLUSH_EVENTS):
+        self.sid = uuid.uuid4().hex[:12]
+        self.cid = cid
+        self.model_label = model_label
+        self.flush_interval = flush_interval
+        self.flush_events = flush_events
+        self.content_parts = []
+        self.tool_steps = []
+        self.plan_content = ""
+        self._pending = 0
+        self._journal = []  # 尚未写出的日志行，与存储写入同一时机写出
+        self._last_flush = time.monotonic()
+        self._closed = False
+        with _journal_lock:
+            _open_streams.add(self.sid)
+        _count("streams")
+        _journal_write([_journal_line({"sid": self.sid, "op": "begin", "cid": cid, "model_label": model_label})])
+
+    def message(self):
+        return build_assistant_message(self.content_parts, self.tool_steps, self.plan_content, self.model_label)
+
+    def _event(self, record, force=False):
+        _count("events")
+        record["sid"] = self.sid
+        self._journal.append(_journal_line(record))  # 立即序列化：调用方之后可能修改 step 等对象
+        self._pending += 1
+        if force or self._pending >= self.flush_events or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def add_content(self, chunk):
+        chunk = chunk or ""
+        self.content_parts.append(chunk)
+        self._event({"op": "content", "s": chunk})
+
+    def set_plan(self, plan_content):
+        self.plan_content = plan_content or ""
+        self._event({"op": "plan", "s": self.plan_content}, force=True)
+
+    def add_tool_step(self, step):
+        self.tool_steps.append(dict(step))
+        self._event({"op": "step", "step": step}, force=True)
+
+    def set_tool_result(self, summary, full_result, success, elapsed_seconds=None):
+        """把结果写入第一条尚无结果的工具步骤"""
+        for st in self.tool_steps:
+            if not st.get("result_summary") and not st.get("result_full"):
+                st["result_summary"] = summary
+                st["result_full"] = full_result
+                st["success"] = success
+                if elapsed_seconds is not None:
+                    st["elapsed_seconds"] = elapsed_seconds
+                break
+        self._event({
+            "op": "result", "summary": summary, "full": full_result,
+            "success": success, "elapsed_seconds": elapsed_seconds,
+        }, force=True)
+
+    def flush(self):
+        """写出排队的日志行，再把当前累积的助手回复写入存储（替换末尾的助手消息或追加）"""
+        lines, self._journal = self._journal, []
+        _journal_write(lines)
+        self._pending = 0
+        self._last_flush = time.monotonic()
+        if not self.cid:
+            return None
+        _count("flushes")
+        return conversation_store.upsert_last_message(self.cid, self.message())
+
+    def close(self):
+        """流结束或出错时调用：最终写入一次并在日志中标记结束。返回对话消息条数。"""
+        if self._closed:
+            return None
+        self._closed = True
+        n = self.flush()
+        _journal_write([_journal_line({"sid": self.sid, "op": "end"})], sync=True)
+        _journal_release(self.sid)
+        return n
+
+
+def replay_journal():
+    """应用启动时调用：把日志中未正常结束的流重建并写入存储，然后清空日志。返回重放的流数量。"""
+    path = Path(JOURNAL_FILE)
+    if not path.exists():
+        return 0
+    streams = {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue  # 崩溃时最后一行可能只写了一半
+                sid = rec.get("sid")
+                op = rec.get("op")
+                if op == "begin":
+                    streams[sid] = {
+                        "cid": rec.get("cid"), "model_label": rec.get("model_label"),
+                        "content_parts": [], "tool_steps": [], "plan_content": "",
+                    }
+                    continue
+                st = streams.get(sid)
+                if st is None:
+                    continue
+                if op == "end":
+                    streams.pop(sid, None)
+                elif op == "content":
+                    st["content_parts"].append(rec.get("s") or "")
+                elif op == "plan":
+                    st["plan_content"] = rec.get("s") or ""
+                elif op == "step":
+                    st["tool_steps"].append(rec.get("step") or {})
+                elif op == "result":
+                    for step in st["tool_steps"]:
+                        if not step.get("result_summary") and not step.get("result_full"):
+                            step["result_summary"] = rec.get("summary")
+                            step["result_full"] = rec.get("full")
+                            step["success"] = rec.get("success")
+                            if rec.get("elapsed_seconds") is not None:
+                                step["elapsed_seconds"] = rec.get("elapsed_seconds")
+                            break
+    except OSError:
+        return 0
+    replayed = 0
+    for st in streams.values():
+        if not st["cid"]:
+            continue
+        msg = build_assistant_message(st["content_parts"], st["tool_steps"], st["plan_content"], st["model_label"])
+        if conversation_store.upsert_last_message(st["cid"], msg) is not None:
+            replayed += 1
+    _count("replayed_streams", replayed)
+    try:
+        with open(path, "w", encoding="utf-8"):
+            pass
+    except OSError:
+        pass
+    return replayed
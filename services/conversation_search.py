@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""
+对话历史全文检索：内存倒排索引，每条消息一个文档（正文 + 工具步骤名称与结果摘要）。
+- 分词：拉丁字母/数字按词切分并转小写；中日韩连续文字切成相邻二字组（单字成段时保留单字）
+- 排序：BM25；索引只保存词项与 (对话, 下标)，不留消息正文，结果的命中片段在取得前 limit 条后再读消息生成
+- 增量维护：对话存储的 create/update/append/upsert/delete 完成后调用本模块更新对应文档；
+  索引在第一次检索时由 build() 从存储全量建立，建立期间到达的更新排队，建完后按顺序重放
+"""
+import heapq
+import math
+import operator
+import re
+import threading
+import time
+from collections import Counter
+
+MAX_DOC_CHARS = 20000  # 单条消息参与索引的最大字符数
+SNIPPET_CHARS = 120
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff"
+_CJK_RE = re.compile(r"[%s]" % _CJK)
+_CJK_BIGRAM_RE = re.compile(r"(?=([%s]{2}))" % _CJK)  # 零宽前瞻，一次 findall 取出所有重叠二字组
+_CJK_SINGLE_RE = re.compile(r"(?<![{0}])[{0}](?![{0}])".format(_CJK))
+_WORD_RE = re.compile(r"[0-9a-z]+")
+
+
+def tokenize(text):
+    """返回词项列表（可重复，顺序不保证）"""
+    text = (text or "").lower()
+    out = _WORD_RE.findall(text)
+    out += _CJK_BIGRAM_RE.findall(text)
+    out += _CJK_SINGLE_RE.findall(text)
+    return out
+
+
+def message_text(message):
+    """消息中参与索引的文本：正文 + 工具名称/参数预览/结果摘要"""
+    parts = [message.get("content") or ""]
+    for step in message.get("tool_steps") or []:
+        if isinstance(step, dict):
+            parts.append(step.get("name") or "")
+            parts.append(step.get("arguments_preview") or "")
+            parts.append(step.get("result_summary") or "")
+    text = "\n".join(p for p in parts if isinstance(p, str) and p)
+    return text[:MAX_DOC_CHARS]
+
+
+class ConversationIndex:
+    """倒排索引：term -> {doc_id: tf}；文档键为 (conversation_id, message_index)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = "empty"  # empty / building / ready
+        self._pending = []
+        self._reset()
+        self.build_seconds = None
+
+    def _reset(self):
+        self._postings = {}
+        self._docs = {}  # doc_id -> (cid, idx, role, length, terms)
+        self._lengths = {}  # doc_id -> length，检索热路径单独取用
+        self._doc_ids = {}  # (cid, idx) -> doc_id
+        self._conv_docs = {}  # cid -> set(idx)
+        self._titles = {}
+        self._next_id = 0
+        self._total_len = 0
+
+    # ---- 写入 ----
+
+    def _remove_doc(self, key):
+        doc_id = self._doc_ids.pop(key, None)
+        if doc_id is None:
+            return
+        _, _, _, length, terms = self._docs.pop(doc_id)
+        del self._lengths[doc_id]
+        self._total_len -= length
+        for term in terms:
+            plist = self._postings.get(term)
+            if plist is not None:
+                plist.pop(doc_id, None)
+                if not plist:
+                    del self._postings[term]
+        idxs = self._conv_docs.get(key[0])
+        if idxs is not None:
+            idxs.discard(key[1])
+
+    def _put_message(self, cid, idx, message):
+        key = (cid, idx)
+        self._remove_doc(key)
+        tokens = tokenize(message_text(message))
+        if not tokens:
+            return
+        tf = Counter(tokens)
+        doc_id = self._next_id
+        self._next_id += 1
+        self._docs[doc_id] = (cid, idx, message.get("role"), len(tokens), tuple(tf))
+        self._lengths[doc_id] = len(tokens)
+        self._doc_ids[key] = doc_id
+        self._conv_docs.setdefault(cid, set()).add(idx)
+        self._total_len += len(tokens)
+        for t, n in tf.items():
+            self._postings.setdefault(t, {})[doc_id] = n
+
+    def _put_conversation(self, conv):
+        cid = conv.get("id")
+        if not cid:
+            return
+        self._drop_conversation(cid)
+        self._titles[cid] = conv.get("title") or "新对话"
+        for i, m in enumerate(conv.get("messages") or []):
+            if isinstance(m, dict):
+                self._put_message(cid, i, m)
+
+    def _drop_conversation(self, cid):
+        for idx in list(self._conv_docs.pop(cid, ())):
+            self._remove_doc((cid, idx))
+        self._titles.pop(cid, None)
+
+    def _apply(self, op, args):
+        if op == "conversation":
+            self._put_conversation(*args)
+        elif op == "title":
+            if args[0] in self._titles:
+                self._titles[args[0]] = args[1]
+        elif op == "message":
+            self._put_message(*args)
+        elif op == "delete":
+            self._drop_conversation(*args)
+
+    def _submit(self, op, *args):
+        with self._lock:
+            if self._state == "ready":
+                self._apply(op, args)
+            elif self._state == "building":
+                self._pending.append((op, args))
+
+    def index_conversation(self, conv):
+        """新建或整体改写对话（含 messages）后调用"""
+        self._submit("conversation", conv)
+
+    def set_title(self, cid, title):
+        self._submit("title", cid, title or "新对话")
+
+    def index_message(self, cid, idx, message):
+        """追加或替换单条消息后调用；流式保存时只重建这一条的文档"""
+        self._submit("message", cid, idx, message)
+
+    def remove_conversation(self, cid):
+        self._submit("delete", cid)
+
+    def build(self, iter_conversations):
+        """全量建立索引；iter_conversations 逐个产出完整对话。已建立时直接返回。"""
+        with self._lock:
+            if self._state != "empty":
+                return
+            self._state = "building"
+        t0 = time.perf_counter()
+        convs = []
+        try:
+            for conv in iter_conversations():
+                if conv:
+                    convs.append(conv)
+        except Exception:
+            with self._lock:
+                self._state = "empty"
+                self._pending = []
+            raise
+        with self._lock:
+            self._reset()
+            for conv in convs:
+                self._put_conversation(conv)
+            for op, args in self._pending:
+                self._apply(op, args)
+            self._pending = []
+            self._state = "ready"
+            self.build_seconds = round(time.perf_counter() - t0, 3)
+
+    def invalidate(self):
+        """切换存储后端时调用：丢弃索引，下次检索重新建立"""
+        with self._lock:
+            self._state = "empty"
+            self._pending = []
+            self._reset()
+
+    @property
+    def ready(self):
+        return self._state == "ready"
+
+    # ---- 检索 ----
+
+    def _query_terms(self, query):
+        terms = []
+        for t in tokenize(query):
+            if t in terms:
+                continue
+            if len(t) == 1 and _CJK_RE.match(t) and t not in self._postings:
+                # 单个汉字查询：展开为包含该字的二字组
+                terms.extend(k for k in self._postings if len(k) == 2 and t in k and k not in terms)
+            else:
+                terms.append(t)
+        return terms
+
+    @staticmethod
+    def _snippet(text, needles):
+        lower = text.lower()
+        pos = -1
+        for n in needles:
+            p = lower.find(n)
+            if p >= 0 and (pos < 0 or p < pos):
+                pos = p
+        if pos < 0:
+            pos = 0
+        start = max(0, pos - SNIPPET_CHARS // 3)
+        end = min(len(text), start + SNIPPET_CHARS)
+        snippet = text[start:end].replace("\n", " ")
+        return ("…" if start > 0 else "") + snippet + ("…" if end < len(text) else "")
+
+    def search(self, query, limit=20, conversation_id=None, fetch_message=None):
+        """
+        BM25 排序；返回 (总命中文档数, 结果列表)。
+        fetch_message(cid, idx) 返回消息（不存在返回 None），在释放索引锁后只对返回的结果调用，用于生成片段
+        """
+        with self._lock:
+            terms = self._query_terms(query)
+            n_docs = len(self._docs)
+            if not terms or not n_docs:
+                return 0, []
+            if conversation_id:
+                allowed = {self._doc_ids[(conversation_id, i)] for i in self._conv_docs.get(conversation_id, ())}
+            else:
+                allowed = None
+            lengths = self._lengths
+            k1 = BM25_K1
+            norm_a = k1 * (1 - BM25_B)
+            norm_b = k1 * BM25_B / (self._total_len / n_docs)
+            scores = {}
+            get = scores.get
+            for t in terms:
+                plist = self._postings.get(t)
+                if not plist:
+                    continue
+                idf = math.log(1 + (n_docs - len(plist) + 0.5) / (len(plist) + 0.5))
+                w = idf * (k1 + 1)
+                for doc_id, tf in plist.items():
+                    if allowed is not None and doc_id not in allowed:
+                        continue
+                    scores[doc_id] = get(doc_id, 0.0) + w * tf / (tf + norm_a + norm_b * lengths[doc_id])
+            total = len(scores)
+            top = heapq.nlargest(max(1, limit), scores.items(), key=operator.itemgetter(1))
+            needles = [q for q in re.split(r"\s+", (query or "").strip().lower()) if q] + terms
+            results = []
+            for doc_id, score in top:
+                cid, idx, role, _, _ = self._docs[doc_id]
+                results.append({
+                    "conversation_id": cid,
+                    "title": self._titles.get(cid, "新对话"),
+                    "message_index": idx,
+                    "role": role,
+                    "score": round(score, 4),
+                    "snippet": "",
+                })
+        if fetch_message is not None:
+            for r in results:
+                message = fetch_message(r["conversation_id"], r["message_index"])
+                if isinstance(message, dict):
+                    r["snippet"] = self._snippet(message_text(message), needles)
+        return total, results
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self._state,
+                "documents": len(self._docs),
+                "conversations": len(self._conv_docs),
+                "terms": len(self._postings),
+                "build_seconds": self.build_seconds,
+            }
+
+
+index = ConversationIndex()
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+对话存储分片后端：data/conversations/ 下每个对话一个 <id>.json，另有 manifest.json 记录
+id、title、updated_at、provider_id/model 锁定信息，list_conversations 只读清单。
+每个对话一把锁，不同对话的流式保存互不阻塞；所有文件写入都是「写临时文件 + os.replace」原子替换。
+清单在内存中更新：新建、删除对话或 title/provider_id/model 变化时立即写盘；只有 updated_at 变化时（流式保存的常态）
+标记为脏，由后台线程在 MANIFEST_FLUSH_DELAY 秒内合并写一次，流式保存不再排队等清单的 fsync。
+进程异常退出时最多丢失这段时间内的 updated_at（只影响列表排序），对话内容以各分片文件为准。
+"""
+import atexit
+import json
+import os
+import threading
+from pathlib import Path
+
+from .conversation_store import _SAFE_ID, _bump_version, WriteTracker
+
+_MANIFEST_FIELDS = ("id", "title", "updated_at", "provider_id", "model")
+MANIFEST_FLUSH_DELAY = 1.0  # 秒
+
+
+def _atomic_write_json(path, data, indent=None):
+    path = Path(path)
+    tmp = path.with_name("%s.%s.%s.tmp" % (path.name, os.getpid(), threading.get_ident()))
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=indent)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _manifest_entry(conv):
+    return {k: conv.get(k) for k in _MANIFEST_FIELDS if conv.get(k) is not None}
+
+
+class ShardedConversationBackend:
+    """一对话一文件 + 元数据清单"""
+
+    name = "sharded"
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.manifest_path = self.root / "manifest.json"
+        self._manifest_lock = threading.Lock()
+        self._locks_guard = threading.Lock()
+        self._locks = {}
+        self._dirty = False
+        self._flush_timer = None
+        self.writes = WriteTracker(self.stat_token)
+        self._manifest = self._load_manifest()
+        atexit.register(self.flush_manifest)
+
+    def _lock_for(self, cid):
+        with self._locks_guard:
+            lock = self._locks.get(cid)
+            if lock is None:
+                lock = self._locks[cid] = threading.Lock()
+            return lock
+
+    def _shard_path(self, cid):
+        if not _SAFE_ID.match(cid or ""):
+            return None
+        return self.root / ("%s.json" % cid)
+
+    def _load_manifest(self):
+        if self.manifest_path.exists():
+            try:
+                with open(self.manifest_path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if isinstance(data, dict):
+                    return data
+            except (OSError, ValueError):
+                pass
+        return self._rebuild_manifest()
+
+    def _rebuild_manifest(self):
+        """清单丢失或损坏时从各分片文件重建"""
+        manifest = {}
+        for p in self.root.glob("*.json"):
+            if p == self.manifest_path:
+                continue
+            try:
+                with open(p, "r", encoding="utf-8") as f:
+                    conv = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if isinstance(conv, dict) and conv.get("id"):
+                manifest[conv["id"]] = _manifest_entry(conv)
+        if manifest:
+            with self.writes.track():
+                _atomic_write_json(self.manifest_path, manifest)
+        return manifest
+
+    def _write_manifest(self):
+        """把内存中的清单写盘（写入之间由 WriteTracker 互斥，不持有 _manifest_lock 做 I/O）"""
+        with self.writes.track():
+            with self._manifest_lock:
+                self._dirty = False
+                snapshot = dict(self._manifest)
+            _atomic_write_json(self.manifest_path, snapshot)
+
+    def flush_manifest(self):
+        """立即写出尚未写盘的清单改动（退出时调用）"""
+        with self._manifest_lock:
+            dirty = self._dirty
+            timer, self._flush_timer = self._flush_timer, None
+        if timer is not None:
+            timer.cancel()
+        if dirty:
+            self._write_manifest()
+
+    def _flush_later(self):
+        with self._manifest_lock:
+            self._flush_timer = None
+        self._write_manifest()
+
+    def _set_manifest(self, cid, entry):
+        """更新清单；只有 updated_at 变化时延迟合并写盘，其余变化立即写盘"""
+        with self._manifest_lock:
+            old = self._manifest.get(cid)
+            if entry is None:
+                if old is None:
+                    return
+                self._manifest.pop(cid, None)
+                sync = True
+            else:
+                self._manifest[cid] = entry
+                sync = old is None or {k: v for k, v in old.items() if k != "updated_at"} != \
+                    {k: v for k, v in entry.items() if k != "updated_at"}
+            if not sync:
+                self._dirty = True
+                if self._flush_timer is None:
+                    self._flush_timer = threading.Timer(MANIFEST_FLUSH_DELAY, self._flush_later)
+                    self._flush_timer.daemon = True
+                    self._flush_timer.start()
+                return
+        self._write_manifest()
+
+    def stat_token(self):
+        try:
+            st = self.manifest_path.stat()
+            return ((st.st_mtime_ns, st.st_size),)
+        except OSError:
+            return (None,)
+
+    def entry_token(self, cid):
+        p = self._shard_path(cid)
+        try:
+            st = p.stat()
+            return (st.st_mtime_ns, st.st_size)
+        except (OSError, AttributeError):
+            return None
+
+    def _read(self, cid):
+        p = self._shard_path(cid)
+        if p is None or not p.exists():
+            return None
+        with open(p, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write(self, conv):
+        _atomic_write_json(self._shard_path(conv["id"]), conv, indent=2)
+        self._set_manifest(conv["id"], _manifest_entry(conv))
+
+    def list_conversations(self):
+        with self._manifest_lock:
+            items = [dict(m) for m in self._manifest.values()]
+        items.sort(key=lambda x: x.get("updated_at") or "", reverse=True)
+        return [{"id": m["id"], "title": m.get("title", "新对话"), "updated_at": m.get("updated_at")} for m in items]
+
+    def get_conversation(self, cid):
+        try:
+            return self._read(cid)
+        except (OSError, ValueError):
+            return None
+
+    def insert_conversation(self, conv):
+        with self._lock_for(conv["id"]):
+            self._write(conv)
+
+    def update_conversation(self, cid, fields):
+        with self._lock_for(cid):
+            conv = self.get_conversation(cid)
+            if conv is None:
+                return None
+            _bump_version(conv, fields)
+            conv.update(fields)
+            self._write(conv)
+            return conv
+
+    def append_message(self, cid, message, updated_at):
+        with self._lock_for(cid):
+            conv = self.get_conversation(cid)
+            if conv is None:
+                return None
+            conv.setdefault("messages", []).append(message)
+            conv["updated_at"] = updated_at
+            _bump_version(conv)
+            self._write(conv)
+            return len(conv["messages"]), conv["version"]
+
+    def upsert_last_message(self, cid, message, updated_at):
+        with self._lock_for(cid):
+            conv = self.get_conversation(cid)
+            if conv is None:
+                return None
+            msgs = conv.setdefault("messages", [])
+            if msgs and msgs[-1].get("role") == message.get("role"):
+                msgs[-1] = message
+            else:
+                msgs.append(message)
+            conv["updated_at"] = updated_at
+            _bump_version(conv)
+            self._write(conv)
+            return len(msgs), conv["version"]
+
+    def delete_conversation(self, cid):
+        with self._lock_for(cid):
+            p = self._shard_path(cid)
+            if p is not None:
+                try:
+                    p.unlink()
+                except FileNotFoundError:
+                    pass
+            self._set_manifest(cid, None)
+        with self._locks_guard:
+            self._locks.pop(cid, None)
+
+    def migrate_from_json(self, json_path):
+        """清单为空时一次性从旧版 conversations.json 拆分导入；原文件保留作备份"""
+        if self._manifest or self.manifest_path.exists():
+            return 0
+        json_path = Path(json_path)
+        if not json_path.exists():
+            return 0
+        try:
+            with open(json_path, "r", encoding="utf-8") as f:
+                conversations = json.load(f)
+        except (OSError, ValueError):
+            return 0
+        count = 0
+        for c in conversations if isinstance(conversations, list) else []:
+            if isinstance(c, dict) and self._shard_path(c.get("id")) is not None:
+                _atomic_write_json(self._shard_path(c["id"]), c, indent=2)
+                self._manifest[c["id"]] = _manifest_entry(c)
+                count += 1
+        self._write_manifest()
+        return count
@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+"""
+对话存储 SQLite 后端：WAL 模式，conversations 表存元数据，messages 表每条消息一行。
+更新 messages 时按行摘要比对，只改写第一处变化之后的行；流式过程中反复改写最后一条助手消息只涉及一行。
+"""
+import hashlib
+import json
+import sqlite3
+import sys
+import threading
+from pathlib import Path
+
+from .conversation_store import WriteTracker
+
+BUSY_TIMEOUT_MS = 30000
+VACUUM_BUSY_MS = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id TEXT PRIMARY KEY,
+    title TEXT NOT NULL DEFAULT '新对话',
+    provider_id TEXT,
+    model TEXT,
+    created_at TEXT,
+    updated_at TEXT,
+    extra TEXT,
+    version INTEGER NOT NULL DEFAULT 0,
+    history_version INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_conversations_updated_at ON conversations(updated_at DESC);
+CREATE TABLE IF NOT EXISTS messages (
+    conversation_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    body TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (conversation_id, idx)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# conversations 表的固定列，其余字段序列化进 extra
+_COLUMNS = ("id", "title", "provider_id", "model", "created_at", "updated_at", "version", "history_version")
+
+
+def _dump_message(message):
+    body = json.dumps(message, ensure_ascii=False, separators=(",", ":"))
+    return body, hashlib.sha1(body.encode("utf-8")).hexdigest()
+
+
+def _split_fields(conv):
+    """拆成固定列与 extra（不含 messages）"""
+    cols = {k: conv.get(k) for k in _COLUMNS if k in conv}
+    extra = {k: v for k, v in conv.items() if k not in _COLUMNS and k != "messages"}
+    return cols, extra
+
+
+class SqliteConversationBackend:
+    """SQLite/WAL 对话存储；每个线程一个连接，写操作使用 BEGIN IMMEDIATE 串行化。"""
+
+    name = "sqlite"
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._conns = []
+        self._conns_lock = threading.Lock()
+        self.writes = WriteTracker(self.stat_token)
+        conn = self._conn()
+        conn.executescript(_SCHEMA)
+        existing = {r["name"] for r in conn.execute("PRAGMA table_info(conversations)")}
+        for col in ("version", "history_version"):
+            if col not in existing:
+                conn.execute("ALTER TABLE conversations ADD COLUMN %s INTEGER NOT NULL DEFAULT 0" % col)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=BUSY_TIMEOUT_MS / 1000.0, isolation_level=None,
+                                   check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=OFF")
+            self._local.conn = conn
+            with self._conns_lock:
+                self._conns.append(conn)
+        return conn
+
+    def close(self):
+        with self._conns_lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
+
+    def stat_token(self):
+        paths = [self.path, self.path.with_name(self.path.name + "-wal")]
+        out = []
+        for p in paths:
+            try:
+                st = p.stat()
+                out.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                out.append(None)
+        return tuple(out)
+
+    def _write(self):
+        return _WriteTxn(self._conn(), self.writes)
+
+    def _row_to_meta(self, row):
+        conv = {k: row[k] for k in _COLUMNS if row[k] is not None or k in ("id", "title")}
+        if row["extra"]:
+            try:
+                conv.update(json.loads(row["extra"]))
+            except ValueError:
+                pass
+        return conv
+
+    def _load_messages(self, conn, cid):
+        rows = conn.execute(
+            "SELECT body FROM messages WHERE conversation_id = ? ORDER BY idx", (cid,)
+        ).fetchall()
+        return [json.loads(r["body"]) for r in rows]
+
+    def list_conversations(self):
+        rows = self._conn().execute(
+            "SELECT id, title, updated_at FROM conversations ORDER BY updated_at DESC"
+        ).fetchall()
+        return [{"id": r["id"], "title": r["title"] or "新对话", "updated_at": r["updated_at"]} for r in rows]
+
+    def get_conversation(self, cid):
+        conn = self._conn()
+        row = conn.execute("SELECT * FROM conversations WHERE id = ?", (cid,)).fetchone()
+        if row is None:
+            return None
+        conv = self._row_to_meta(row)
+        conv["messages"] = self._load_messages(conn, cid)
+        return conv
+
+    def _insert(self, conn, conv):
+        cols, extra = _split_fields(conv)
+        conn.execute(
+            "INSERT OR REPLACE INTO conversations "
+            "(id, title, provider_id, model, created_at, updated_at, extra, version, history_version) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                cols.get("id"), cols.get("title") or "新对话", cols.get("provider_id"), cols.get("model"),
+                cols.get("created_at"), cols.get("updated_at"),
+                json.dumps(extra, ensure_ascii=False) if extra else None,
+                cols.get("version") or 0, cols.get("history_version") or 0,
+            ),
+        )
+        conn.execute("DELETE FROM messages WHERE conversation_id = ?", (conv["id"],))
+        conn.executemany(
+            "INSERT INTO messages (conversation_id, idx, body, digest) VALUES (?, ?, ?, ?)",
+            [(conv["id"], i) + _dump_message(m) for i, m in enumerate(conv.get("messages") or [])],
+        )
+
+    def insert_conversation(self, conv):
+        with self._write() as conn:
+            self._insert(conn, conv)
+
+    def _replace_messages(self, conn, cid, messages):
+        """只改写从第一条摘要不同的消息开始的行"""
+        old = [r["digest"] for r in conn.execute(
+            "SELECT digest FROM messages WHERE conversation_id = ? ORDER BY idx", (cid,)
+        )]
+        dumped = [_dump_message(m) for m in messages]
+        start = 0
+        while start < len(old) and start < len(dumped) and old[start] == dumped[start][1]:
+            start += 1
+        if start < len(old):
+            conn.execute("DELETE FROM messages WHERE conversation_id = ? AND idx >= ?", (cid, start))
+        if start < len(dumped):
+            conn.executemany(
+                "INSERT INTO messages (conversation_id, idx, body, digest) VALUES (?, ?, ?, ?)",
+                [(cid, i) + dumped[i] for i in range(start, len(dumped))],
+            )
+
+    def update_conversation(self, cid, fields):
+        with self._write() as conn:
+            row = conn.execute("SELECT * FROM conversations WHERE id = ?", (cid,)).fetchone()
+            if row is None:
+                return None
+            conv = self._row_to_meta(row)
+            conv.update({k: v for k, v in fields.items() if k != "messages"})
+            conv["version"] = (conv.get("version") or 0) + 1
+            if "messages" in fields:
+                conv["history_version"] = (conv.get("history_version") or 0) + 1
+            cols, extra = _split_fields(conv)
+            conn.execute(
+                "UPDATE conversations SET title = ?, provider_id = ?, model = ?, updated_at = ?, extra = ?, "
+                "version = ?, history_version = ? WHERE id = ?",
+                (
+                    cols.get("title") or "新对话", cols.get("provider_id"), cols.get("model"), cols.get("updated_at"),
+                    json.dumps(extra, ensure_ascii=False) if extra else None,
+                    cols["version"], cols.get("history_version") or 0, cid,
+                ),
+            )
+            if "messages" in fields:
+                self._replace_messages(conn, cid, fields["messages"] or [])
+        if "messages" in fields:
+            conv["messages"] = list(fields["messages"] or [])  # 刚写入的就是全部消息，不必再读回
+            return conv
+        return self.get_conversation(cid)
+
+    def append_message(self, cid, message, updated_at):
+        """只插入一行；返回 (消息条数, 新版本号)，对话不存在返回 None"""
+        with self._write() as conn:
+            cur = conn.execute(
+                "UPDATE conversations SET updated_at = ?, version = version + 1 WHERE id = ?", (updated_at, cid)
+            )
+            if cur.rowcount == 0:
+                return None
+            row = conn.execute(
+                "SELECT COALESCE(MAX(idx) + 1, 0) AS n FROM messages WHERE conversation_id = ?", (cid,)
+            ).fetchone()
+            conn.execute(
+                "INSERT INTO messages (conversation_id, idx, body, digest) VALUES (?, ?, ?, ?)",
+                (cid, row["n"]) + _dump_message(message),
+            )
+            version = conn.execute("SELECT version FROM conversations WHERE id = ?", (cid,)).fetchone()["version"]
+        return row["n"] + 1, version
+
+    def upsert_last_message(self, cid, message, updated_at):
+        with self._write() as conn:
+            cur = conn.execute(
+                "UPDATE conversations SET updated_at = ?, version = version + 1 WHERE id = ?", (updated_at, cid)
+            )
+            if cur.rowcount == 0:
+                return None
+            last = conn.execute(
+                "SELECT idx, body FROM messages WHERE conversation_id = ? ORDER BY idx DESC LIMIT 1", (cid,)
+            ).fetchone()
+            idx = 0
+            if last is not None:
+                idx = last["idx"] + 1
+                if json.loads(last["body"]).get("role") == message.get("role"):
+                    idx = last["idx"]
+            conn.execute(
+                "INSERT OR REPLACE INTO messages (conversation_id, idx, body, digest) VALUES (?, ?, ?, ?)",
+                (cid, idx) + _dump_message(message),
+            )
+            version = conn.execute("SELECT version FROM conversations WHERE id = ?", (cid,)).fetchone()["version"]
+        return idx + 1, version
+
+    def get_message_slice(self, cid, start, end=None):
+        """只读取 [start, end) 范围的消息行；返回 (不含 messages 的对话元数据, 消息总数, 消息列表)"""
+        conn = self._conn()
+        row = conn.execute("SELECT * FROM conversations WHERE id = ?", (cid,)).fetchone()
+        if row is None:
+            return None
+        total = conn.execute(
+            "SELECT COUNT(*) AS n FROM messages WHERE conversation_id = ?", (cid,)
+        ).fetchone()["n"]
+        end = total if end is None else min(end, total)
+        rows = conn.execute(
+            "SELECT body FROM messages WHERE conversation_id = ? AND idx >= ? AND idx < ? ORDER BY idx",
+            (cid, max(0, start), end),
+        ).fetchall()
+        return self._row_to_meta(row), total, [json.loads(r["body"]) for r in rows]
+
+    def delete_conversation(self, cid):
+        with self._write() as conn:
+            conn.execute("DELETE FROM messages WHERE conversation_id = ?", (cid,))
+            conn.execute("DELETE FROM conversations WHERE id = ?", (cid,))
+
+    def vacuum(self):
+        """
+        归档后回收空间：检查点截断 WAL 并 VACUUM。
+        数据库被其他连接占用（database is locked）等无法执行时返回错误信息，成功返回 None
+        """
+        conn = self._conn()
+        with self.writes.track():
+            # 等待占用的时间缩短为 VACUUM_BUSY_MS：期间本进程的其他写入都在排队，回收空间可以留到下次
+            conn.execute("PRAGMA busy_timeout = %d" % VACUUM_BUSY_MS)
+            try:
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                conn.execute("VACUUM")
+            except sqlite3.OperationalError as e:
+                return str(e)
+            finally:
+                conn.execute("PRAGMA busy_timeout = %d" % BUSY_TIMEOUT_MS)
+        return None
+
+    def migrate_from_json(self, json_path):
+        """一次性从旧版 conversations.json 导入；完成后在 meta 表记录，之后不再导入。原文件保留作备份。"""
+        conn = self._conn()
+        done = conn.execute("SELECT value FROM meta WHERE key = 'json_migrated'").fetchone()
+        if done is not None:
+            return 0
+        json_path = Path(json_path)
+        conversations = []
+        if json_path.exists():
+            try:
+                with open(json_path, "r", encoding="utf-8") as f:
+                    conversations = json.load(f)
+            except (OSError, ValueError):
+                return 0
+        if not isinstance(conversations, list):
+            conversations = []
+        count = 0
+        with self._write() as conn:
+            for c in conversations:
+                if isinstance(c, dict) and c.get("id"):
+                    self._insert(conn, c)
+                    count += 1
+            conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', ?)",
+                (json.dumps({"source": str(json_path), "count": count}),),
+            )
+        return count
+
+
+class _WriteTxn:
+    """BEGIN IMMEDIATE ... COMMIT/ROLLBACK 上下文；整个事务包在 WriteTracker.track 中，供缓存区分自己的写入"""
+
+    def __init__(self, conn, writes):
+        self.conn = conn
+        self._track = writes.track()
+
+    def __enter__(self):
+        self._track.__enter__()
+        try:
+            self.conn.execute("BEGIN IMMEDIATE")
+        except BaseException:
+            self._track.__exit__(*sys.exc_info())
+            raise
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.conn.execute("COMMIT")
+            else:
+                self.conn.execute("ROLLBACK")
+        finally:
+            self._track.__exit__(None, None, None)
+        return False
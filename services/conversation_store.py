@@ -1,88 +1,954 @@
 # -*- coding: utf-8 -*-
-"""对话历史持久化存储"""
+"""
+对话历史持久化存储。
+对外函数（create/update/get/list/delete_conversation）保持不变，实际读写由可插拔后端完成：
+- json：单文件 data/conversations.json（旧版格式）
+- sqlite：data/conversations.db，WAL 模式，元数据与消息分表，追加消息不重写历史
+- sharded：data/conversations/ 下一对话一文件 + manifest.json 清单，按对话加锁
+读路径经过进程内缓存：元数据列表常驻，完整对话按 LRU 在内存预算内缓存；存储文件的 mtime/size 变化时整体失效。
+写入完成后同步更新全文检索索引（conversation_search），search_conversations 提供排序检索。
+长期未更新的对话可由 compact_conversations 移入压缩冷归档（conversation_archive），热存储只留存根；
+读取时透明解压，写入前先恢复到热存储。
+"""
 import json
+import logging
+import re
+import threading
+import time
 import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta
+
+from . import conversation_search
+from .conversation_archive import ConversationArchive
+
+_log = logging.getLogger(__name__)
 
 DATA_DIR = Path(__file__).resolve().parent.parent / "data"
 CONVERSATIONS_FILE = DATA_DIR / "conversations.json"
+CONVERSATIONS_DB = DATA_DIR / "conversations.db"
+CONVERSATIONS_SHARD_DIR = DATA_DIR / "conversations"
+ARCHIVE_DIR = DATA_DIR / "archive"
+_SAFE_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+DEFAULT_BACKEND = "sqlite"
+BACKENDS = ("json", "sqlite", "sharded")
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+
+_backend = None
+_backend_lock = threading.Lock()
+_archive = None
+# 按对话 id 分条带的写锁：归档任务替换存根与普通写入互斥，不同对话的写入基本不互相阻塞
+_conv_locks = [threading.Lock() for _ in range(32)]
+_compact_lock = threading.Lock()
+_ARCHIVE_BATCH = 100
 
 
 def _ensure_data_dir():
     DATA_DIR.mkdir(parents=True, exist_ok=True)
 
 
-def _load_all():
-    _ensure_data_dir()
-    if not CONVERSATIONS_FILE.exists():
-        return []
-    with open(CONVERSATIONS_FILE, "r", encoding="utf-8") as f:
-        return json.load(f)
+def _now():
+    return datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _meta(c):
+    """列表展示用的轻量元数据"""
+    return {"id": c["id"], "title": c.get("title", "新对话"), "updated_at": c.get("updated_at")}
+
+
+def _bump_version(conv, fields=None):
+    """version 每次写入加一；history_version 仅在整体替换 messages 时加一（前端据此判断能否增量同步）"""
+    conv["version"] = (conv.get("version") or 0) + 1
+    if fields is not None and "messages" in fields:
+        conv["history_version"] = (conv.get("history_version") or 0) + 1
+
+
+def _stat_token(*paths):
+    """文件 (mtime_ns, size) 组合，用于判断存储是否被外部改动"""
+    out = []
+    for p in paths:
+        try:
+            st = Path(p).stat()
+            out.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            out.append(None)
+    return tuple(out)
+
+
+class WriteTracker:
+    """
+    记录后端自己写入前后的存储状态（stat_token）：写入前的状态与上次写入后记录的不同，说明期间存储被外部改动，
+    external 加一。ConversationCache 据此区分本进程的写入（沿用缓存）与外部改动（整体失效）。
+    """
+
+    def __init__(self, stat):
+        self._stat = stat
+        self._lock = threading.Lock()
+        self.token = stat()
+        self.external = 0
+
+    @contextmanager
+    def track(self):
+        """包住一次写入（写入之间互斥）"""
+        with self._lock:
+            if self._stat() != self.token:
+                self.external += 1
+            try:
+                yield
+            finally:
+                self.token = self._stat()
+
+    def state(self):
+        """(上次写入后的状态, 外部改动次数, 是否正在写入)"""
+        return self.token, self.external, self._lock.locked()
+
+
+def _approx_size(obj):
+    """粗略估算对象占用（按字符串长度累加），用于缓存内存预算"""
+    if isinstance(obj, str):
+        return len(obj) + 50
+    if isinstance(obj, dict):
+        return 64 + sum(_approx_size(k) + _approx_size(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return 56 + sum(_approx_size(v) for v in obj)
+    return 28
+
+
+def _copy_json(obj):
+    """复制 JSON 值（dict/list 逐层复制，其余不可变）；比 copy.deepcopy 快数倍"""
+    if isinstance(obj, dict):
+        return {k: _copy_json(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_copy_json(v) for v in obj]
+    return obj
+
+
+def _copy_conv(conv):
+    """缓存进出都复制到消息内部，调用方修改返回值不会改到缓存"""
+    out = dict(conv)
+    out["messages"] = _copy_json(conv.get("messages") or [])
+    return out
+
+
+def _version(conv):
+    try:
+        return int(conv.get("version") or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+class ConversationCache:
+    """
+    进程内对话缓存：以对话 id 为键。
+    - 元数据列表（id/title/updated_at）常驻内存，list_conversations 不再读存储
+    - 完整对话（含 messages）按 LRU 缓存，总估算大小超过 max_bytes 时淘汰最久未用的
+    - 每次访问比对存储文件的 mtime/size，外部改动（手工编辑、其他进程）后整体失效；
+      后端提供 entry_token(cid) 时（分片后端），命中前再比对该对话自身文件
+    - 本进程写入期间不校验；之后的校验通过后端的 WriteTracker 区分自己的写入与外部改动：
+      存储状态等于后端最近一次写入后的状态且期间没有检测到外部改动时沿用缓存，否则整体失效
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.RLock()
+        self._token = None
+        self._external = None
+        self._meta = None  # cid -> 元数据
+        self._bodies = OrderedDict()  # cid -> (conv, size, entry_token)
+        self._bytes = 0
+        self._writes_in_flight = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _validate(self, backend):
+        if self._writes_in_flight:
+            return
+        tracker = getattr(backend, "writes", None)
+        own, external, busy = tracker.state() if tracker is not None else (None, None, False)
+        if busy:
+            return  # 后端正在写入（如分片清单的后台刷新），等写完再比对
+        token = backend.stat_token()
+        if token == self._token and external == self._external:
+            return
+        if self._token is not None and external == self._external and token == own:
+            self._token = token  # 本进程自己的写入
+            return
+        if self._token is not None:
+            self.invalidations += 1
+        self._token = token
+        self._external = external
+        self._meta = None
+        self._bodies.clear()
+        self._bytes = 0
+
+    def _drop(self, cid):
+        old = self._bodies.pop(cid, None)
+        if old is not None:
+            self._bytes -= old[1]
+
+    def _put(self, backend, conv):
+        """放入缓存；已缓存的同一对话版本更新时保留已缓存的（读取与写入交错时不会用旧版本覆盖新版本）"""
+        cid = conv["id"]
+        old = self._bodies.get(cid)
+        if old is not None and old[0] is not conv and _version(old[0]) > _version(conv):
+            return
+        self._drop(cid)
+        size = _approx_size(conv)
+        if size > self.max_bytes:
+            return
+        etok = backend.entry_token(cid) if hasattr(backend, "entry_token") else None
+        self._bodies[cid] = (conv, size, etok)
+        self._bytes += size
+        while self._bytes > self.max_bytes and self._bodies:
+            _, (_, old_size, _) = self._bodies.popitem(last=False)
+            self._bytes -= old_size
+            self.evictions += 1
+
+    def list(self, backend):
+        with self._lock:
+            self._validate(backend)
+            if self._meta is None:
+                self.misses += 1
+                self._meta = OrderedDict((m["id"], m) for m in backend.list_conversations())
+            else:
+                self.hits += 1
+            items = [dict(m) for m in self._meta.values()]
+        items.sort(key=lambda x: x.get("updated_at") or "", reverse=True)
+        return items
+
+    def _hit(self, backend, cid):
+        """命中返回缓存中的对话本身（调用方持有 _lock，只读不改）"""
+        self._validate(backend)
+        hit = self._bodies.get(cid)
+        if hit is not None and hasattr(backend, "entry_token") and backend.entry_token(cid) != hit[2]:
+            self._drop(cid)
+            self.invalidations += 1
+            hit = None
+        if hit is None:
+            self.misses += 1
+            return None
+        self._bodies.move_to_end(cid)
+        self.hits += 1
+        return hit[0]
+
+    def _load(self, backend, cid):
+        conv = backend.get_conversation(cid)
+        if conv is not None:
+            with self._lock:
+                self._put(backend, _copy_conv(conv))
+        return conv
+
+    def get(self, backend, cid, load=True):
+        """命中返回副本；未命中时 load=False 直接返回 None（调用方自行按范围读取）"""
+        with self._lock:
+            cached = self._hit(backend, cid)
+            if cached is not None:
+                return _copy_conv(cached)
+        return self._load(backend, cid) if load else None
+
+    def get_slice(self, backend, cid, start, end=None, load=True):
+        """
+        返回 (不含 messages 的对话副本, 消息总数, [start, end) 的消息)；命中时只复制这一段消息。
+        未命中时 load=False 或对话不存在返回 None
+        """
+        with self._lock:
+            conv = self._hit(backend, cid)
+            if conv is not None:
+                conv = dict(conv)
+        if conv is None and load:
+            conv = self._load(backend, cid)
+        if conv is None:
+            return None
+        msgs = conv.pop("messages", None) or []
+        total = len(msgs)
+        end = total if end is None else min(end, total)
+        return conv, total, _copy_json(msgs[max(0, start):end])
+
+    def begin_write(self):
+        with self._lock:
+            self._writes_in_flight += 1
+
+    def end_write(self, backend):
+        """写入全部结束后校验一次：只有自己的写入时沿用缓存，期间有外部改动则失效"""
+        with self._lock:
+            self._writes_in_flight -= 1
+            if not self._writes_in_flight:
+                self._validate(backend)
+
+    def wrote(self, backend, cid, conv=None, deleted=False, message=None, upsert=False, updated_at=None, version=None):
+        """本进程写入后同步缓存"""
+        with self._lock:
+            if deleted:
+                self._drop(cid)
+                if self._meta is not None:
+                    self._meta.pop(cid, None)
+            elif conv is not None:
+                self._put(backend, _copy_conv(conv))
+                if self._meta is not None:
+                    self._meta[cid] = _meta(conv)
+            elif message is not None:
+                hit = self._bodies.get(cid)
+                if hit is not None and version is not None and _version(hit[0]) >= version:
+                    hit = None  # 缓存已是写入后的内容（读取在写入提交后、同步缓存前放入），不再重复追加
+                if hit is not None:
+                    cached = hit[0]
+                    msgs = cached["messages"]
+                    message = _copy_json(message)
+                    if upsert and msgs and msgs[-1].get("role") == message.get("role"):
+                        msgs[-1] = message
+                    else:
+                        msgs.append(message)
+                    cached["updated_at"] = updated_at
+                    if version is not None:
+                        cached["version"] = version
+                    self._put(backend, cached)
+                if self._meta is not None and cid in self._meta:
+                    self._meta[cid] = dict(self._meta[cid], updated_at=updated_at)
+
+    def clear(self):
+        with self._lock:
+            self._token = None
+            self._external = None
+            self._meta = None
+            self._bodies.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "cached_conversations": len(self._bodies),
+                "cached_bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "metadata_entries": len(self._meta) if self._meta is not None else 0,
+            }
+
+
+_cache = ConversationCache()
+
+
+class JsonConversationBackend:
+    """旧版单文件后端：每次读写都解析/重写整个 JSON 文件。"""
+
+    name = "json"
+
+    def __init__(self, path=CONVERSATIONS_FILE):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self.writes = WriteTracker(self.stat_token)
+
+    def stat_token(self):
+        return _stat_token(self.path)
+
+    def _load_all(self):
+        _ensure_data_dir()
+        if not self.path.exists():
+            return []
+        with open(self.path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save_all(self, conversations):
+        _ensure_data_dir()
+        with self.writes.track(), open(self.path, "w", encoding="utf-8") as f:
+            json.dump(conversations, f, ensure_ascii=False, indent=2)
+
+    def list_conversations(self):
+        items = self._load_all()
+        items.sort(key=lambda x: x.get("updated_at", ""), reverse=True)
+        return [_meta(c) for c in items]
+
+    def get_conversation(self, cid):
+        for c in self._load_all():
+            if c.get("id") == cid:
+                return c
+        return None
+
+    def insert_conversation(self, conv):
+        with self._lock:
+            conversations = self._load_all()
+            conversations.append(conv)
+            self._save_all(conversations)
+
+    def update_conversation(self, cid, fields):
+        with self._lock:
+            conversations = self._load_all()
+            for c in conversations:
+                if c.get("id") == cid:
+                    _bump_version(c, fields)
+                    c.update(fields)
+                    self._save_all(conversations)
+                    return c
+        return None
+
+    def append_message(self, cid, message, updated_at):
+        with self._lock:
+            conversations = self._load_all()
+            for c in conversations:
+                if c.get("id") == cid:
+                    c.setdefault("messages", []).append(message)
+                    c["updated_at"] = updated_at
+                    _bump_version(c)
+                    self._save_all(conversations)
+                    return len(c["messages"]), c["version"]
+        return None
+
+    def upsert_last_message(self, cid, message, updated_at):
+        with self._lock:
+            conversations = self._load_all()
+            for c in conversations:
+                if c.get("id") == cid:
+                    msgs = c.setdefault("messages", [])
+                    if msgs and msgs[-1].get("role") == message.get("role"):
+                        msgs[-1] = message
+                    else:
+                        msgs.append(message)
+                    c["updated_at"] = updated_at
+                    _bump_version(c)
+                    self._save_all(conversations)
+                    return len(msgs), c["version"]
+        return None
+
+    def iter_conversations(self):
+        """单文件格式本身须整体解析，这里只避免逐条重复读文件"""
+        items = self._load_all()
+        items.sort(key=lambda x: x.get("updated_at", ""), reverse=True)
+        return iter(items)
+
+    def replace_conversations(self, convs):
+        """整体替换（不存在则追加）一批对话，只重写一次文件"""
+        by_id = {c["id"]: c for c in convs}
+        with self._lock:
+            conversations = self._load_all()
+            for i, c in enumerate(conversations):
+                if c.get("id") in by_id:
+                    conversations[i] = by_id.pop(c["id"])
+            conversations.extend(by_id.values())
+            self._save_all(conversations)
+
+    def delete_conversation(self, cid):
+        with self._lock:
+            conversations = [c for c in self._load_all() if c.get("id") != cid]
+            self._save_all(conversations)
+
+
+def _make_backend(name):
+    if name == "json":
+        return JsonConversationBackend(CONVERSATIONS_FILE)
+    if name == "sqlite":
+        from .conversation_sqlite import SqliteConversationBackend
+        backend = SqliteConversationBackend(CONVERSATIONS_DB)
+        backend.migrate_from_json(CONVERSATIONS_FILE)
+        return backend
+    if name == "sharded":
+        from .conversation_shards import ShardedConversationBackend
+        backend = ShardedConversationBackend(CONVERSATIONS_SHARD_DIR)
+        backend.migrate_from_json(CONVERSATIONS_FILE)
+        return backend
+    raise ValueError("未知的对话存储后端: %s" % name)
+
 
+def set_backend(name):
+    """切换存储后端（应用启动时按 config.json 的 conversation_backend 调用）。"""
+    global _backend
+    name = (name or DEFAULT_BACKEND).strip().lower()
+    if name not in BACKENDS:
+        name = DEFAULT_BACKEND
+    with _backend_lock:
+        old, _backend = _backend, _make_backend(name)
+        _cache.clear()
+        conversation_search.index.invalidate()
+    if old is not None and hasattr(old, "close"):
+        old.close()
+    return _backend
 
-def _save_all(conversations):
-    _ensure_data_dir()
-    with open(CONVERSATIONS_FILE, "w", encoding="utf-8") as f:
-        json.dump(conversations, f, ensure_ascii=False, indent=2)
+
+def set_cache_budget(max_bytes):
+    """设置完整对话缓存的内存预算（字节）；0 表示不缓存对话正文，元数据列表仍常驻。"""
+    with _cache._lock:
+        _cache.max_bytes = max(0, int(max_bytes))
+        _cache._bodies.clear()
+        _cache._bytes = 0
+
+
+def get_cache_stats():
+    return _cache.stats()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = _make_backend(DEFAULT_BACKEND)
+    return _backend
+
+
+def get_archive():
+    global _archive
+    if _archive is None:
+        with _backend_lock:
+            if _archive is None:
+                _archive = ConversationArchive(ARCHIVE_DIR)
+    return _archive
+
+
+def _conv_lock(cid):
+    return _conv_locks[hash(cid) % len(_conv_locks)]
+
+
+def _replace_hot(backend, convs):
+    """用给定对话整体替换热存储中的同 id 对话（归档存根写入 / 从归档恢复）"""
+    _cache.begin_write()
+    try:
+        if hasattr(backend, "replace_conversations"):
+            backend.replace_conversations(convs)
+        else:
+            for conv in convs:
+                backend.insert_conversation(conv)
+        for conv in convs:
+            _cache.wrote(backend, conv["id"], conv=conv)
+    finally:
+        _cache.end_write(backend)
+
+
+def _ensure_hot(backend, cid):
+    """写入前调用（须持有该对话的条带锁）：已归档的对话先完整恢复到热存储再从归档索引移除"""
+    archive = get_archive()
+    if not archive.is_archived(cid):
+        return
+    conv = archive.load(cid)
+    if conv is not None:
+        _replace_hot(backend, [conv])
+    archive.forget(cid)
+
+
+def _archived_copy(cid):
+    archive = get_archive()
+    if not archive.is_archived(cid):
+        return None
+    return archive.load(cid)
 
 
 def list_conversations():
     """按更新时间倒序返回对话列表"""
-    items = _load_all()
-    items.sort(key=lambda x: x.get("updated_at", ""), reverse=True)
-    return [{"id": c["id"], "title": c.get("title", "新对话"), "updated_at": c.get("updated_at")} for c in items]
+    return _cache.list(get_backend())
 
 
 def get_conversation(cid):
-    """获取单条对话（含完整 messages）"""
-    for c in _load_all():
-        if c.get("id") == cid:
-            return c
-    return None
+    """获取单条对话（含完整 messages）；已归档的对话从归档段解压返回"""
+    archived = _archived_copy(cid)
+    if archived is not None:
+        return archived
+    return _cache.get(get_backend(), cid)
 
 
 def create_conversation(title="新对话", messages=None, provider_id=None, model=None):
     """创建新对话，返回完整对象。可选 provider_id、model 以锁定该对话仅由此模型维护。"""
-    conversations = _load_all()
-    now = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+    now = _now()
     conv = {
         "id": str(uuid.uuid4()),
         "title": title or "新对话",
         "messages": list(messages or []),
         "created_at": now,
         "updated_at": now,
+        "version": 1,
+        "history_version": 1,
     }
     if provider_id is not None:
         conv["provider_id"] = provider_id
     if model is not None:
         conv["model"] = model
-    conversations.append(conv)
-    _save_all(conversations)
+    backend = get_backend()
+    _cache.begin_write()
+    try:
+        backend.insert_conversation(conv)
+        _cache.wrote(backend, conv["id"], conv=conv)
+    finally:
+        _cache.end_write(backend)
+    conversation_search.index.index_conversation(conv)
     return conv
 
 
 def update_conversation(cid, title=None, messages=None, provider_id=None, model=None):
     """更新对话的 title、messages 和/或 provider_id、model"""
-    conversations = _load_all()
-    for c in conversations:
-        if c.get("id") == cid:
-            if title is not None:
-                c["title"] = title
-            if messages is not None:
-                c["messages"] = list(messages)
-            if provider_id is not None:
-                c["provider_id"] = provider_id
-            if model is not None:
-                c["model"] = model
-            c["updated_at"] = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
-            _save_all(conversations)
-            return c
-    return None
+    fields = {}
+    if title is not None:
+        fields["title"] = title
+    if messages is not None:
+        fields["messages"] = list(messages)
+    if provider_id is not None:
+        fields["provider_id"] = provider_id
+    if model is not None:
+        fields["model"] = model
+    fields["updated_at"] = _now()
+    backend = get_backend()
+    with _conv_lock(cid):
+        _ensure_hot(backend, cid)
+        _cache.begin_write()
+        try:
+            conv = backend.update_conversation(cid, fields)
+            if conv is not None:
+                _cache.wrote(backend, cid, conv=conv)
+        finally:
+            _cache.end_write(backend)
+    if conv is not None:
+        if "messages" in fields:
+            conversation_search.index.index_conversation(conv)
+        elif "title" in fields:
+            conversation_search.index.set_title(cid, fields["title"])
+    return conv
+
+
+def append_message(cid, message):
+    """在对话末尾追加一条消息（sqlite 后端只写入一行，不重写历史）；返回消息条数，对话不存在返回 None"""
+    backend = get_backend()
+    message = dict(message)
+    now = _now()
+    with _conv_lock(cid):
+        _ensure_hot(backend, cid)
+        _cache.begin_write()
+        try:
+            result = backend.append_message(cid, message, now)
+            if result is not None:
+                _cache.wrote(backend, cid, message=message, updated_at=now, version=result[1])
+        finally:
+            _cache.end_write(backend)
+    if result is None:
+        return None
+    conversation_search.index.index_message(cid, result[0] - 1, message)
+    return result[0]
+
+
+def upsert_last_message(cid, message):
+    """若最后一条消息与 message 同角色则替换，否则追加；返回消息条数，对话不存在返回 None。
+    用于流式过程中反复保存进行中的助手回复，无需先读出完整对话。"""
+    backend = get_backend()
+    message = dict(message)
+    now = _now()
+    with _conv_lock(cid):
+        _ensure_hot(backend, cid)
+        _cache.begin_write()
+        try:
+            result = backend.upsert_last_message(cid, message, now)
+            if result is not None:
+                _cache.wrote(backend, cid, message=message, upsert=True, updated_at=now, version=result[1])
+        finally:
+            _cache.end_write(backend)
+    if result is None:
+        return None
+    conversation_search.index.index_message(cid, result[0] - 1, message)
+    return result[0]
+
+
+def _message_slice(cid, start, end=None):
+    """读取 [start, end) 范围的消息：缓存命中时切片；sqlite 后端只读该范围的行；其余后端读完整对话"""
+    backend = get_backend()
+    conv = _archived_copy(cid)
+    if conv is None:
+        got = _cache.get_slice(backend, cid, start, end, load=not hasattr(backend, "get_message_slice"))
+        if got is None and hasattr(backend, "get_message_slice"):
+            return backend.get_message_slice(cid, start, end)
+        return got
+    msgs = conv.pop("messages")
+    total = len(msgs)
+    end = total if end is None else min(end, total)
+    return conv, total, msgs[max(0, start):end]
+
+
+def get_conversation_meta(cid):
+    """对话元数据（不含 messages）加消息总数 total；对话不存在返回 None"""
+    got = _message_slice(cid, 0, 0)
+    if got is None:
+        return None
+    meta = dict(got[0])
+    meta["total"] = got[1]
+    return meta
+
+
+def get_messages_page(cid, before=None, limit=50):
+    """
+    分页读取消息：返回 before 之前（不含）最新的 limit 条，before 为空表示从最新开始。
+    返回 {对话元数据..., "total", "start", "messages"}；对话不存在返回 None。
+    """
+    limit = max(1, int(limit))
+    if before is None:
+        meta = get_conversation_meta(cid)
+        if meta is None:
+            return None
+        before = meta["total"]
+    before = max(0, int(before))
+    start = max(0, before - limit)
+    got = _message_slice(cid, start, before)
+    if got is None:
+        return None
+    meta, total, msgs = got
+    page = dict(meta)
+    page.update({"total": total, "start": start, "messages": msgs})
+    return page
+
+
+def get_messages_since(cid, since):
+    """增量读取：返回下标 >= since 的消息（结构同 get_messages_page）"""
+    since = max(0, int(since))
+    got = _message_slice(cid, since)
+    if got is None:
+        return None
+    meta, total, msgs = got
+    page = dict(meta)
+    page.update({"total": total, "start": min(since, total), "messages": msgs})
+    return page
+
+
+def get_message(cid, index):
+    """读取单条消息，越界或对话不存在返回 None"""
+    got = _message_slice(cid, index, index + 1)
+    if not got or not got[2]:
+        return None
+    return got[2][0]
 
 
 def delete_conversation(cid):
     """删除一条对话"""
-    conversations = [c for c in _load_all() if c.get("id") != cid]
-    _save_all(conversations)
+    backend = get_backend()
+    with _conv_lock(cid):
+        _cache.begin_write()
+        try:
+            backend.delete_conversation(cid)
+            _cache.wrote(backend, cid, deleted=True)
+        finally:
+            _cache.end_write(backend)
+        get_archive().forget(cid)
+    conversation_search.index.remove_conversation(cid)
     return True
+
+
+def search_conversations(query, limit=20, conversation_id=None):
+    """
+    全文检索历史消息，按 BM25 相关度排序。
+    返回 {"total": 命中消息数, "results": [{conversation_id, title, message_index, role, score, snippet}]}。
+    首次调用时从存储全量建立索引（直接读后端，不占用对话缓存）。
+    """
+    idx = conversation_search.index
+    if not idx.ready:
+        backend = get_backend()
+
+        def _iter():
+            for m in backend.list_conversations():
+                yield _archived_copy(m["id"]) or backend.get_conversation(m["id"])
+
+        idx.build(_iter)
+    total, results = idx.search(query, limit=limit, conversation_id=conversation_id, fetch_message=get_message)
+    return {"total": total, "results": results}
+
+
+def get_search_stats():
+    return conversation_search.index.stats()
+
+
+def _current_meta(backend, cid):
+    """热存储中对话的元数据（不含 messages 的字段），不存在返回 None"""
+    if hasattr(backend, "get_message_slice"):
+        got = backend.get_message_slice(cid, 0, 0)
+        return got[0] if got else None
+    return backend.get_conversation(cid)
+
+
+def _measure_hot(backend):
+    """遍历热存储加载每条对话：返回 (序列化总字节数, 加载耗时秒)"""
+    t0 = time.perf_counter()
+    total = 0
+    for m in backend.list_conversations():
+        conv = backend.get_conversation(m["id"])
+        if conv is not None:
+            total += len(json.dumps(conv, ensure_ascii=False))
+    return total, time.perf_counter() - t0
+
+
+def _archive_stub(conv, entry):
+    stub = {k: v for k, v in conv.items() if k != "messages"}
+    stub.update({
+        "messages": [],
+        "archived": True,
+        "archived_at": entry["archived_at"],
+        "message_count": len(conv.get("messages") or []),
+    })
+    return stub
+
+
+def compact_conversations(days):
+    """
+    保留与压缩任务：把 updated_at 早于 days 天前的对话写入压缩归档段，热存储替换为元数据存根。
+    逐批处理：先写段文件并 fsync，再在条带锁内确认对话未被改动（version 不变）、登记索引，最后写入存根；
+    期间被写入的对话跳过，留待下次。返回热存储字节数与加载耗时的前后对比。
+    """
+    days = max(0, float(days))
+    backend = get_backend()
+    archive = get_archive()
+    with _compact_lock:
+        cutoff = (datetime.utcnow() - timedelta(days=days)).strftime("%Y-%m-%dT%H:%M:%SZ")
+        hot_before, load_before = _measure_hot(backend)
+        candidates = [
+            m["id"] for m in backend.list_conversations()
+            if (m.get("updated_at") or "") < cutoff and not archive.is_archived(m["id"])
+        ]
+        archived = skipped = 0
+        raw_bytes = stored_bytes = 0
+        for i in range(0, len(candidates), _ARCHIVE_BATCH):
+            convs = [c for c in (backend.get_conversation(cid) for cid in candidates[i:i + _ARCHIVE_BATCH]) if c]
+            convs = [c for c in convs if not c.get("archived")]
+            entries = archive.write_segment(convs)
+            locks = sorted({id(_conv_lock(c["id"])): _conv_lock(c["id"]) for c in convs}.items())
+            for _, lock in locks:
+                lock.acquire()
+            try:
+                ok = [c for c in convs if (_current_meta(backend, c["id"]) or {}).get("version") == c.get("version")]
+                skipped += len(convs) - len(ok)
+                archive.commit({c["id"]: entries[c["id"]] for c in ok})
+                if ok:
+                    _replace_hot(backend, [_archive_stub(c, entries[c["id"]]) for c in ok])
+            finally:
+                for _, lock in reversed(locks):
+                    lock.release()
+            archived += len(ok)
+            raw_bytes += sum(entries[c["id"]]["raw_bytes"] for c in ok)
+            stored_bytes += sum(entries[c["id"]]["length"] for c in ok)
+        freed = archive.compact_index()
+        vacuum = vacuum_error = None
+        if archived and hasattr(backend, "vacuum"):
+            vacuum_error = backend.vacuum()
+            vacuum = "skipped" if vacuum_error else "done"
+        hot_after, load_after = _measure_hot(backend)
+    return {
+        "days": days,
+        "cutoff": cutoff,
+        "archived": archived,
+        "skipped_modified": skipped,
+        "archived_raw_bytes": raw_bytes,
+        "archived_stored_bytes": stored_bytes,
+        "hot_bytes_before": hot_before,
+        "hot_bytes_after": hot_after,
+        "hot_bytes_saved": hot_before - hot_after,
+        "load_seconds_before": round(load_before, 4),
+        "load_seconds_after": round(load_after, 4),
+        "load_seconds_saved": round(load_before - load_after, 4),
+        "segment_bytes_freed": freed,
+        "vacuum": vacuum,  # done / skipped（如数据库被占用，原因见 vacuum_error，下次压缩时再回收）/ None（无需回收）
+        "vacuum_error": vacuum_error,
+    }
+
+
+def get_archive_stats():
+    return get_archive().stats()
+
+
+def start_compaction_schedule(days, interval=24 * 3600, initial_delay=300):
+    """days > 0 时启动后台线程：启动 initial_delay 秒后执行一次，之后每 interval 秒执行一次"""
+    if not days or days <= 0:
+        return None
+
+    def _loop():
+        time.sleep(initial_delay)
+        while True:
+            try:
+                result = compact_conversations(days)
+                if result.get("vacuum_error"):
+                    _log.warning("对话压缩：跳过 VACUUM（%s）", result["vacuum_error"])
+            except Exception:
+                _log.exception("对话定时压缩失败")
+            time.sleep(interval)
+
+    t = threading.Thread(target=_loop, name="conversation-compaction", daemon=True)
+    t.start()
+    return t
+
+
+def iter_conversations(since=None, until=None, provider_id=None, model=None):
+    """
+    逐条产出完整对话（导出用）：直接读后端与归档，不经过也不填充对话缓存。
+    since/until 与 updated_at 按 ISO 字符串比较（含端点）；provider_id/model 为空表示不过滤。
+    """
+    backend = get_backend()
+    if hasattr(backend, "iter_conversations"):
+        source = ((c, c) for c in backend.iter_conversations())
+    else:
+        source = ((m, None) for m in backend.list_conversations())
+    for m, conv in source:
+        updated = m.get("updated_at") or ""
+        if (since and updated < since) or (until and updated > until):
+            continue
+        conv = _archived_copy(m["id"]) or conv or backend.get_conversation(m["id"])
+        if conv is None:
+            continue
+        if provider_id is not None and str(conv.get("provider_id")) != str(provider_id):
+            continue
+        if model is not None and conv.get("model") != model:
+            continue
+        yield conv
+
+
+def _import_version(value, name):
+    """导入记录中的版本号：缺省为 1，须为正整数（允许数字字符串）"""
+    if value is None:
+        return 1
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError("%s 须为整数" % name)
+    try:
+        return max(int(value), 1)
+    except ValueError:
+        raise ValueError("%s 须为整数" % name)
+
+
+def import_conversation(conv, on_conflict="skip"):
+    """
+    导入一条完整对话（导入用）；返回 "imported" / "replaced" / "skipped"。
+    id 缺失或含非法字符时分配新 id；on_conflict 见 conversation_transfer.import_ndjson。
+    字段类型不对（时间、标题不是字符串，版本号不是整数等）时抛出 ValueError，该条不导入。
+    """
+    conv = {k: v for k, v in conv.items() if k not in ("archived", "archived_at", "message_count")}
+    messages = conv.get("messages") or []
+    if not isinstance(messages, list) or not all(isinstance(m, dict) for m in messages):
+        raise ValueError("messages 须为对象数组")
+    for key in ("title", "created_at", "updated_at", "model"):
+        if conv.get(key) is not None and not isinstance(conv[key], str):
+            raise ValueError("%s 须为字符串" % key)
+    if conv.get("provider_id") is not None and not isinstance(conv["provider_id"], (str, int)):
+        raise ValueError("provider_id 须为字符串")
+    version = _import_version(conv.get("version"), "version")
+    history_version = _import_version(conv.get("history_version"), "history_version")
+    now = _now()
+    conv["messages"] = messages
+    conv["title"] = conv.get("title") or "新对话"
+    conv["created_at"] = conv.get("created_at") or now
+    conv["updated_at"] = conv.get("updated_at") or conv["created_at"]
+    cid = conv.get("id")
+    if not isinstance(cid, str) or not _SAFE_ID.match(cid):
+        cid = str(uuid.uuid4())
+    backend = get_backend()
+    archive = get_archive()
+    with _conv_lock(cid):
+        existing = archive.load(cid) if archive.is_archived(cid) else _current_meta(backend, cid)
+        if existing is not None and on_conflict == "skip":
+            return "skipped"
+        if existing is not None and on_conflict == "new":
+            cid = str(uuid.uuid4())
+            existing = None
+        conv["id"] = cid
+        conv["version"] = version
+        conv["history_version"] = history_version
+        if existing is not None:
+            # 覆盖时两个版本号都必须前进，否则前端增量同步会把整体替换误判为追加
+            conv["version"] = max(conv["version"], int(existing.get("version") or 0) + 1)
+            conv["history_version"] = max(conv["history_version"], int(existing.get("history_version") or 0) + 1)
+            archive.forget(cid)
+        _replace_hot(backend, [conv])
+    conversation_search.index.index_conversation(conv)
+    return "replaced" if existing is not None else "imported"
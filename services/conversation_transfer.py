@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+对话导出/导入：NDJSON，每行一个完整对话；全程流式处理，内存占用与单个对话大小相当，与总量无关。
+导出可选 gzip（逐块 compressobj）；导入自动识别 gzip（逐块 decompressobj）。
+导入时单行不超过 MAX_LINE_BYTES，解压后总量不超过 MAX_IMPORT_BYTES。
+"""
+import json
+import zlib
+
+from . import conversation_store
+
+CHUNK_SIZE = 64 * 1024
+CONFLICT_MODES = ("skip", "replace", "new")
+MAX_ERRORS = 20
+MAX_LINE_BYTES = 256 * 1024 * 1024  # 单个对话（一行）的上限
+MAX_IMPORT_BYTES = 64 * 1024 * 1024 * 1024  # 一次导入解压后的总量上限；0 表示不限
+
+
+def _normalize_until(until):
+    """只给日期时视为当天结束"""
+    if until and len(until) == 10:
+        return until + "T23:59:59Z"
+    return until
+
+
+def export_ndjson(since=None, until=None, provider_id=None, model=None, gzip=False):
+    """生成器：逐块产出导出内容（bytes）；since/until 按 updated_at 过滤（ISO 日期或时间，含端点）"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None
+    buf = []
+    size = 0
+    for conv in conversation_store.iter_conversations(
+        since=since or None, until=_normalize_until(until) or None, provider_id=provider_id, model=model,
+    ):
+        line = (json.dumps(conv, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+        buf.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            data = b"".join(buf)
+            buf, size = [], 0
+            if compressor is not None:
+                data = compressor.compress(data)
+            if data:
+                yield data
+    data = b"".join(buf)
+    if compressor is not None:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
+
+
+class LineTooLong(ValueError):
+    """单行超过 MAX_LINE_BYTES；该行被丢弃，其余行照常导入"""
+
+
+class ImportTooLarge(ValueError):
+    """解压后的总大小超过 max_bytes，导入中止"""
+
+
+def _iter_lines(stream, gzip=None, max_line=None, max_bytes=None):
+    """
+    从类文件对象逐块读取并按行切分；gzip 为 None 时按首两个字节自动识别。
+    每块只在新数据里找换行，未结束的行按块暂存，长行的代价与其长度成正比；解压每次最多产出 CHUNK_SIZE 字节。
+    超过 max_line 的行产出 LineTooLong 实例（并跳到下一个换行）；解压后总量超过 max_bytes 时抛出 ImportTooLarge
+    """
+    max_line = MAX_LINE_BYTES if max_line is None else max_line
+    max_bytes = MAX_IMPORT_BYTES if max_bytes is None else max_bytes
+    decompressor = None
+    parts = []  # 当前未结束的行
+    size = 0  # parts 总长度
+    total = 0
+    too_long = False
+    first = True
+
+    def _chunks():
+        nonlocal decompressor, first
+        while True:
+            raw = stream.read(CHUNK_SIZE)
+            if not raw:
+                break
+            if first:
+                first = False
+                if gzip or (gzip is None and raw[:2] == b"\x1f\x8b"):
+                    decompressor = zlib.decompressobj(47)
+            if decompressor is None:
+                yield raw
+                continue
+            data = raw
+            while data:
+                out = decompressor.decompress(data, CHUNK_SIZE)
+                data = decompressor.unconsumed_tail
+                if out:
+                    yield out
+        if decompressor is not None:
+            out = decompressor.flush()
+            if out:
+                yield out
+
+    for chunk in _chunks():
+        total += len(chunk)
+        if max_bytes and total > max_bytes:
+            raise ImportTooLarge("导入内容解压后超过 %d 字节" % max_bytes)
+        start = 0
+        while True:
+            end = chunk.find(b"\n", start)
+            if end < 0:
+                if not too_long and start < len(chunk):
+                    parts.append(chunk[start:])
+                    size += len(chunk) - start
+                    if size > max_line:
+                        too_long, parts, size = True, [], 0
+                break
+            if too_long:
+                too_long = False
+                yield LineTooLong("单行超过 %d 字节" % max_line)
+            elif size + end - start > max_line:
+                parts, size = [], 0
+                yield LineTooLong("单行超过 %d 字节" % max_line)
+            else:
+                parts.append(chunk[start:end])
+                yield b"".join(parts)
+                parts, size = [], 0
+            start = end + 1
+    if too_long:
+        yield LineTooLong("单行超过 %d 字节" % max_line)
+    elif size:
+        yield b"".join(parts)
+
+
+def import_ndjson(stream, on_conflict="skip", gzip=None, max_line=None, max_bytes=None):
+    """
+    逐行导入；on_conflict 决定 id 已存在时的处理：skip 跳过、replace 覆盖、new 以新 id 导入。
+    返回 {"imported", "replaced", "skipped", "failed", "errors"}；单行错误（含超长行）不影响其余行。
+    解压后总量超过 max_bytes（默认 MAX_IMPORT_BYTES）时抛出 ImportTooLarge，此前的行已导入。
+    """
+    if on_conflict not in CONFLICT_MODES:
+        raise ValueError("on_conflict 须为 %s 之一" % "/".join(CONFLICT_MODES))
+    result = {"imported": 0, "replaced": 0, "skipped": 0, "failed": 0, "errors": []}
+    lineno = 0
+    for raw in _iter_lines(stream, gzip=gzip, max_line=max_line, max_bytes=max_bytes):
+        lineno += 1
+        if isinstance(raw, LineTooLong):
+            result["failed"] += 1
+            if len(result["errors"]) < MAX_ERRORS:
+                result["errors"].append({"line": lineno, "error": str(raw)})
+            continue
+        raw = raw.strip()
+        if not raw:
+            continue
+        try:
+            conv = json.loads(raw.decode("utf-8"))
+            if not isinstance(conv, dict):
+                raise ValueError("每行须为一个对话 JSON 对象")
+            outcome = conversation_store.import_conversation(conv, on_conflict=on_conflict)
+        except (ValueError, UnicodeDecodeError) as e:
+            result["failed"] += 1
+            if len(result["errors"]) < MAX_ERRORS:
+                result["errors"].append({"line": lineno, "error": str(e)})
+            continue
+        result[outcome] += 1
+    return result
@@ -7,9 +7,15 @@ import asyncio
 import threading
 import logging
 import re
-
-# 导入数据包存储和规则管理器
-from .browser_packets import add_packet
+import time
+
+# 导入录包写入队列和规则管理器
+from . import browser_packets
+from .body_rewrite import rewriter as body_rewriter
+from .packet_writer import writer as packet_writer
+from .proxy_metrics import hooks as hook_latency
+from .recorder_filter import capture as capture_filter
+from .tls_passthrough import AI_API_WHITELIST, policy as passthrough_policy
 from .traffic_rules import traffic_rules
 
 # 禁用 mitmproxy 的所有日志，避免与 Flask 的 Werkzeug 日志冲突
@@ -27,19 +33,25 @@ _disable_mitmproxy_logging()
 _log = logging.getLogger(__name__)
 
 # 在禁用日志后再导入 mitmproxy
-from mitmproxy import options, http
+from mitmproxy import options, http, tls
 from mitmproxy.tools.dump import DumpMaster
 
 
 class AIInterceptorAddon:
     """Mitmproxy 插件：负责流量录制和执行拦截规则"""
     
-    # AI API 地址白名单：这些地址不会被拦截，始终放行
-    AI_API_WHITELIST = [
-        r'dashscope\.aliyuncs\.com',      # 阿里云百炼
-        r'api\.deepseek\.com',            # 深度求索
-        r'api\.siliconflow\.cn',          # 硅基流动
-    ]
+    # AI API 地址白名单：这些地址不会被拦截，始终放行（HTTPS 连接直接直通，见 tls_passthrough）
+    AI_API_WHITELIST = AI_API_WHITELIST
+    
+    def tls_clienthello(self, data: tls.ClientHelloData):
+        """
+        TLS 握手阶段：直通列表中的主机（及关闭解密时的全部连接）不做中间人，原样转发
+        """
+        host = data.client_hello.sni
+        if not host and data.context.server.address:
+            host = data.context.server.address[0]
+        if passthrough_policy.decide(host):
+            data.ignore_connection = True
     
     def _is_ai_api_request(self, url: str) -> bool:
         """
@@ -57,6 +69,22 @@ class AIInterceptorAddon:
         return False
     
     def request(self, flow: http.HTTPFlow):
+        """请求阶段处理（计入 request 耗时直方图）"""
+        t0 = time.perf_counter()
+        try:
+            self._handle_request(flow)
+        finally:
+            hook_latency["request"].observe(time.perf_counter() - t0)
+
+    def response(self, flow: http.HTTPFlow):
+        """响应阶段处理（计入 response 耗时直方图）"""
+        t0 = time.perf_counter()
+        try:
+            self._handle_response(flow)
+        finally:
+            hook_latency["response"].observe(time.perf_counter() - t0)
+
+    def _handle_request(self, flow: http.HTTPFlow):
         """
         请求阶段处理
         执行请求阶段的拦截规则（如修改请求头、阻断请求等）
@@ -74,49 +102,58 @@ class AIInterceptorAddon:
                 value = rule['data'].get('value')
                 if key and value:
                     flow.request.headers[key] = value
+                    traffic_rules.record_applied(rule)
             elif rule['type'] == 'block_request':
                 # 阻断请求
                 flow.kill()
+                traffic_rules.record_applied(rule)
 
-    def response(self, flow: http.HTTPFlow):
+    def _handle_response(self, flow: http.HTTPFlow):
         """
         响应阶段处理
         执行响应阶段的拦截规则（如修改响应体）并录制数据包
         """
-        # 1. 执行拦截规则（响应阶段）
+        # 1. 执行拦截规则（响应阶段）：命中的 modify_response_body 规则合并为一次扫描，响应体只解码、写回一次
         matched_rules = traffic_rules.match_rules(flow, 'response')
-        for rule in matched_rules:
-            if rule['type'] == 'modify_response_body':
-                # 修改响应体
-                old_text = rule['data'].get('old_text')
-                new_text = rule['data'].get('new_text')
-                if old_text and new_text and flow.response.text:
-                    flow.response.text = flow.response.text.replace(old_text, new_text)
-
-        # 2. 录制数据包到现有的存储系统 (browser_packets)
+        body_rules = [rule for rule in matched_rules if rule['type'] == 'modify_response_body']
+        if body_rules and flow.response is not None:
+            body, applied, content_type = body_rewriter.rewrite(
+                flow.response.content, flow.response.headers.get("content-type", ""), body_rules)
+            if content_type is not None:
+                flow.response.headers["content-type"] = content_type
+            if body is not None:
+                flow.response.content = body
+            for rule in applied:
+                traffic_rules.record_applied(rule)
+
+        # 2. 录制数据包：只在事件循环上取出所需字段放入队列，序列化与落盘由后台写入线程完成
+        # 记录器过滤器启用时，不匹配的流量直接跳过，不进入队列
+        if not capture_filter.should_record(flow.request.pretty_host, flow.request.pretty_url):
+            return
         # 将 mitmproxy 的对象转换为现有 UI 需要的格式
         try:
             req_headers = dict(flow.request.headers) if flow.request.headers else {}
             resp_headers = dict(flow.response.headers) if flow.response and flow.response.headers else {}
             
-            # 简单处理 body 预览（限制为前 1024 字节）
-            req_body = ""
-            resp_body = ""
-            
-            if flow.request.content:
-                req_body = flow.request.content[:1024].decode('utf-8', 'ignore')
-                
-            if flow.response and flow.response.content:
-                resp_body = flow.response.content[:1024].decode('utf-8', 'ignore')
-
-            add_packet(
+            # body 先按 recorder_body_limit 截断再入队（队列积压时不持有完整的大 body），原始大小随录包保存；
+            # 存入 blob 由写入线程完成，内存中只留预览
+            limit = browser_packets.body_limit()
+            req_body = flow.request.content or b""
+            resp_body = (flow.response.content or b"") if flow.response else b""
+            req_size, resp_size = len(req_body), len(resp_body)
+            if limit:
+                req_body, resp_body = req_body[:limit], resp_body[:limit]
+
+            packet_writer.submit(
                 method=flow.request.method,
                 url=flow.request.pretty_url,
                 request_headers=req_headers,
                 request_body=req_body,
                 response_status=flow.response.status_code if flow.response else 0,
                 response_headers=resp_headers,
-                response_body=resp_body
+                response_body=resp_body,
+                request_body_size=req_size,
+                response_body_size=resp_size,
             )
         except Exception as e:
             _log.debug("Error recording packet: %s", e)
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+录包实时推送（Server-Sent Events）：记录器页订阅新录包摘要，不再反复拉取完整录包列表。
+- 每个连接只持有一个游标（已推送的最大录包编号）；新录包写入后由 browser_packets 的监听回调唤醒，
+  再等 BATCH_INTERVAL 秒凑批，按游标取至多 MAX_BATCH 条摘要（不含头与 body，详情与 body 由详情接口按需获取）
+- 背压：不为连接排队缓存，每批都从存储按游标现取；客户端读得慢时生成器阻塞在写出上，不会越积越多。
+  游标落后超过 MAX_BACKLOG 条（或已被保留上限裁掉）时跳到最新并发送 gap 事件，由页面重新加载首页
+- 空闲时每 HEARTBEAT 秒发送注释行保活；录包被清空时发送 reset 事件
+- 事件 id 为游标，浏览器断线重连时经 Last-Event-ID 带回，从断点继续
+"""
+import json
+import threading
+import time
+
+from . import browser_packets
+
+BATCH_INTERVAL = 0.25  # 秒
+MAX_BATCH = 200
+MAX_BACKLOG = 2000
+HEARTBEAT = 15.0  # 秒
+MAX_CLIENTS = 16
+RETRY_MS = 3000
+
+
+def _latest():
+    """最新录包编号；没有录包时为最后分配过的编号（清空后编号不复用）"""
+    return max(int(browser_packets.latest_id() or 0), browser_packets.oldest_id_number() - 1)
+
+
+def _event(name, data, event_id=None):
+    head = "event: %s\n" % name
+    if event_id is not None:
+        head += "id: %s\n" % event_id
+    return head + "data: %s\n\n" % json.dumps(data, ensure_ascii=False)
+
+
+class PacketFeed:
+    """新录包通知（Condition）+ 按连接游标生成 SSE 文本"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._seq = 0  # 每次通知加一
+        self._subscribed = False
+        self._clients = 0
+        self._stats = {"connections": 0, "rejected": 0, "events": 0, "packets": 0, "gaps": 0, "bytes": 0}
+
+    def _subscribe(self):
+        with self._cond:
+            if self._subscribed:
+                return
+            self._subscribed = True
+        browser_packets.add_listener(self.notify)
+
+    def notify(self):
+        with self._cond:
+            self._seq += 1
+            self._cond.notify_all()
+
+    def _wait(self, seq, timeout):
+        """等到有新通知或超时；返回当前通知序号"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq != seq, timeout)
+            return self._seq
+
+    def acquire(self):
+        """占用一个连接名额；已满返回 False"""
+        self._subscribe()
+        with self._cond:
+            if self._clients >= MAX_CLIENTS:
+                self._stats["rejected"] += 1
+                return False
+            self._clients += 1
+            self._stats["connections"] += 1
+            return True
+
+    def release(self):
+        with self._cond:
+            self._clients = max(0, self._clients - 1)
+
+    def _count(self, text, packets=0, gap=False):
+        with self._cond:
+            self._stats["events"] += 1
+            self._stats["packets"] += packets
+            self._stats["bytes"] += len(text)
+            if gap:
+                self._stats["gaps"] += 1
+        return text
+
+    def stream(self, after_id=None, filters=None):
+        """
+        生成 SSE 文本（调用方须先 acquire 成功，并在响应关闭时 release）。
+        after_id 为起始游标（不含），为空时从当前最新录包之后开始；filters 为 list_packets 的过滤参数。
+        事件：packets {"packets": [摘要，按时间倒序], "latest_id"}；gap {"skipped"}；reset {}。
+        """
+        filters = dict(filters or {})
+        latest = _latest()
+        try:
+            cursor = int(after_id) if after_id not in (None, "") else latest
+        except (TypeError, ValueError):
+            cursor = latest
+        cursor = min(cursor, latest)
+        cleared = browser_packets.clear_count()
+        yield "retry: %d\n\n" % RETRY_MS
+        while True:
+            seq = self._seq
+            latest = _latest()
+            if browser_packets.clear_count() != cleared:
+                cleared = browser_packets.clear_count()
+                cursor = latest
+                yield self._count(_event("reset", {}, cursor))
+                continue
+            if latest > cursor:
+                time.sleep(BATCH_INTERVAL)
+                latest = _latest()
+                oldest = browser_packets.oldest_id_number()
+                if latest - cursor > MAX_BACKLOG or cursor < oldest - 1:
+                    skipped = latest - cursor
+                    cursor = latest
+                    yield self._count(_event("gap", {"skipped": skipped, "latest_id": str(latest)}, cursor), gap=True)
+                    continue
+                items = browser_packets.list_packets(after_id=str(cursor), limit=MAX_BATCH,
+                                                     fields=browser_packets.SUMMARY_FIELDS, **filters)
+                # 结果是游标之后最旧的一批（按时间倒序）；不满一批说明已取到 latest 为止
+                newest = int(items[0]["id"]) if items else cursor
+                cursor = newest if len(items) >= MAX_BATCH else max(latest, newest)
+                if items:
+                    yield self._count(_event("packets", {"packets": items, "latest_id": str(latest)}, cursor),
+                                      packets=len(items))
+                continue
+            if self._wait(seq, HEARTBEAT) == seq:
+                yield self._count(": ping\n\n")
+
+    def stats(self):
+        with self._cond:
+            return dict(self._stats, clients=self._clients)
+
+
+feed = PacketFeed()
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+录包过滤表达式（类 Wireshark 显示过滤器），编译一次得到判定闭包，编译结果按表达式文本缓存。
+语法示例：host == "a.test" && status >= 400 && resp.body ~ "token"
+- 字段：host、path、url、method、status、content_type（别名 ctype）、time、id、req.body、resp.body、
+  req.header.<名称>、resp.header.<名称>（头名不区分大小写）
+- 比较：== != > >= < <=；~ 或 matches 为正则搜索；contains 为子串包含；单独写字段表示“非空”
+- 组合：&& / and、|| / or、! / not、括号；值可为带引号字符串、数字或不含空格的单词（POST、4xx、application/json）
+- status 与 "4xx" 比较时按状态码类别匹配；host 与 content_type 比较不区分大小写
+- req.body / resp.body 取内存中的 body 预览：未启用 blob 存储时为前 64KB，启用时只有前 4KB（见 browser_packets._BLOB_PREVIEW），
+  之后的内容不参与匹配
+顶层 && 连接的 host/method/status/content_type/time 条件会提取为索引提示，交给 packet_index 选驱动列表；
+含 || 或 ! 的其余部分在候选录包上逐条判定，没有可用提示时顺序扫描。
+"""
+import re
+from functools import lru_cache
+
+_TOKEN_RE = re.compile(r"""
+    \s*(?:
+      (?P<str>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+    | (?P<op>==|!=|>=|<=|&&|\|\||[<>~!()])
+    | (?P<word>[\w.\-/:*+]+)
+    )""", re.VERBOSE)
+_NUM_RE = re.compile(r"-?\d+(?:\.\d+)?$")
+_STATUS_CLASS_RE = re.compile(r"[1-5]xx$", re.IGNORECASE)
+_KEYWORDS = {"and": "&&", "or": "||", "not": "!", "matches": "~", "contains": "contains"}
+_COMPARE_OPS = ("==", "!=", ">", ">=", "<", "<=", "~", "contains")
+_NUMERIC_FIELDS = ("status", "time", "id")
+_FIELD_ALIASES = {"ctype": "content_type", "request.body": "req.body", "response.body": "resp.body"}
+_SIMPLE_FIELDS = ("host", "path", "url", "method", "status", "content_type", "time", "id", "req.body", "resp.body")
+
+
+def _header(headers, name):
+    """在 PacketRecord 的 ((名, 值), ...) 头元组中按小写名称取值"""
+    for k, v in headers:
+        if k.lower() == name:
+            return v
+    return ""
+
+
+def _getter(field):
+    """字段 -> 取值函数 (packet, keys) -> 值；keys 为 packet_index.packet_keys 的派生键"""
+    if field == "host":
+        return lambda p, k: k[0]
+    if field == "path":
+        return lambda p, k: k[1]
+    if field == "method":
+        return lambda p, k: k[2]
+    if field == "status":
+        return lambda p, k: k[3]
+    if field == "content_type":
+        return lambda p, k: k[5]
+    if field == "time":
+        return lambda p, k: k[6]
+    if field == "id":
+        return lambda p, k: int(p.get("id") or 0)
+    if field == "url":
+        return lambda p, k: p.get("url") or ""
+    if field == "req.body":
+        return lambda p, k: p.get("request_body_preview") or ""
+    if field == "resp.body":
+        return lambda p, k: p.get("response_body_preview") or ""
+    if field.startswith("req.header."):
+        name = field[len("req.header."):]
+        return lambda p, k: _header(p.req_headers, name)
+    if field.startswith("resp.header."):
+        name = field[len("resp.header."):]
+        return lambda p, k: _header(p.res_headers, name)
+    return None
+
+
+def _tokenize(text):
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        m = _TOKEN_RE.match(text, pos)
+        if not m or m.end() == pos:
+            raise ValueError("过滤表达式第 %d 个字符处无法识别：%s" % (pos + 1, text[pos:pos + 10]))
+        if m.group("str") is not None:
+            raw = m.group("str")[1:-1]
+            tokens.append(("value", re.sub(r"\\(.)", r"\1", raw), m.start("str")))
+        elif m.group("op") is not None:
+            tokens.append(("op", m.group("op"), m.start("op")))
+        else:
+            word = m.group("word")
+            kw = _KEYWORDS.get(word.lower())
+            tokens.append(("op", kw, m.start("word")) if kw else ("word", word, m.start("word")))
+        pos = m.end()
+    return tokens
+
+
+class _Parser:
+    """递归下降：or -> and ( '||' and )*；and -> unary ( '&&' unary )*；unary -> '!' unary | '(' or ')' | 比较"""
+
+    def __init__(self, text):
+        self.text = text
+        self.tokens = _tokenize(text)
+        self.i = 0
+
+    def _peek(self):
+        return self.tokens[self.i] if self.i < len(self.tokens) else (None, None, len(self.text))
+
+    def _take_op(self, op):
+        kind, val, _ = self._peek()
+        if kind == "op" and val == op:
+            self.i += 1
+            return True
+        return False
+
+    def _error(self, msg):
+        raise ValueError("过滤表达式第 %d 个字符处%s" % (self._peek()[2] + 1, msg))
+
+    def parse(self):
+        if not self.tokens:
+            raise ValueError("过滤表达式为空")
+        node = self._or()
+        if self.i < len(self.tokens):
+            self._error("有多余内容：%s" % self._peek()[1])
+        return node
+
+    def _or(self):
+        parts = [self._and()]
+        while self._take_op("||"):
+            parts.append(self._and())
+        return parts[0] if len(parts) == 1 else ("or", parts)
+
+    def _and(self):
+        parts = [self._unary()]
+        while self._take_op("&&"):
+            parts.append(self._unary())
+        return parts[0] if len(parts) == 1 else ("and", parts)
+
+    def _unary(self):
+        if self._take_op("!"):
+            return ("not", self._unary())
+        if self._take_op("("):
+            node = self._or()
+            if not self._take_op(")"):
+                self._error("缺少右括号")
+            return node
+        return self._comparison()
+
+    def _comparison(self):
+        kind, field, _ = self._peek()
+        if kind != "word":
+            self._error("应为字段名")
+        self.i += 1
+        field = _FIELD_ALIASES.get(field.lower(), field.lower())
+        if field not in _SIMPLE_FIELDS and not field.startswith(("req.header.", "resp.header.")):
+            self.i -= 1
+            self._error("未知字段：%s" % field)
+        kind, op, _ = self._peek()
+        if kind != "op" or op not in _COMPARE_OPS:
+            return ("exists", field)
+        self.i += 1
+        kind, value, _ = self._peek()
+        if kind not in ("value", "word"):
+            self._error("应为比较值")
+        self.i += 1
+        return ("cmp", field, op, value)
+
+
+def _compile_cmp(field, op, value):
+    get = _getter(field)
+    if op == "~":
+        try:
+            rx = re.compile(value)
+        except re.error as e:
+            raise ValueError("正则表达式无效（%s）：%s" % (value, e))
+        return lambda p, k: rx.search(str(get(p, k))) is not None
+    if op == "contains":
+        return lambda p, k: value in str(get(p, k))
+    if field == "status" and _STATUS_CLASS_RE.match(value):
+        if op not in ("==", "!="):
+            raise ValueError("状态码类别只能用 == 或 != 比较")
+        sclass = value.lower()
+        if op == "==":
+            return lambda p, k: k[4] == sclass
+        return lambda p, k: k[4] != sclass
+    if field in _NUMERIC_FIELDS:
+        if not _NUM_RE.match(value):
+            raise ValueError("%s 须与数值比较：%s" % (field, value))
+        value = float(value)
+    elif op in (">", ">=", "<", "<="):
+        raise ValueError("%s 不是数值字段，不能用 %s 比较" % (field, op))
+    elif field in ("host", "content_type"):
+        value = value.lower()
+    elif field == "method":
+        value = value.upper()
+    if op == "==":
+        return lambda p, k: get(p, k) == value
+    if op == "!=":
+        return lambda p, k: get(p, k) != value
+    if op == ">":
+        return lambda p, k: get(p, k) > value
+    if op == ">=":
+        return lambda p, k: get(p, k) >= value
+    if op == "<":
+        return lambda p, k: get(p, k) < value
+    return lambda p, k: get(p, k) <= value
+
+
+def _compile(node):
+    kind = node[0]
+    if kind == "cmp":
+        return _compile_cmp(*node[1:])
+    if kind == "exists":
+        get = _getter(node[1])
+        return lambda p, k: bool(get(p, k))
+    if kind == "not":
+        inner = _compile(node[1])
+        return lambda p, k: not inner(p, k)
+    parts = tuple(_compile(n) for n in node[1])
+    if kind == "and":
+        return lambda p, k: all(f(p, k) for f in parts)
+    return lambda p, k: any(f(p, k) for f in parts)
+
+
+def _hints(node):
+    """顶层 && 中可走索引的条件 -> packet_index.plan 的参数"""
+    conjuncts = node[1] if node[0] == "and" else [node]
+    hints = {}
+    lo, hi = 0, 999  # status 数值范围；没有响应的录包 status 为 0（类别 "0xx"）
+    has_range = False
+    for n in conjuncts:
+        if n[0] != "cmp":
+            continue
+        field, op, value = n[1:]
+        if op == "==" and field == "host":
+            hints["host"] = value
+        elif op == "==" and field == "method":
+            hints["method"] = value
+        elif op == "==" and field == "content_type":
+            hints["content_type"] = value if "/" in value else None
+        elif field == "status" and op == "==":
+            hints["status"] = value
+        elif field == "status" and op in (">", ">=", "<", "<=") and _NUM_RE.match(value):
+            v = float(value)
+            has_range = True
+            if op in (">", ">="):
+                lo = max(lo, v + (1 if op == ">" else 0))
+            else:
+                hi = min(hi, v - (1 if op == "<" else 0))
+        elif field == "time" and op in (">", ">=") and _NUM_RE.match(value):
+            hints["since"] = max(hints.get("since", float(value)), float(value))
+        elif field == "time" and op in ("<", "<=") and _NUM_RE.match(value):
+            hints["until"] = min(hints.get("until", float(value)), float(value))
+    if has_range and "status" not in hints:
+        hints["status_classes"] = ["%dxx" % c for c in range(max(0, int(lo)) // 100, int(hi) // 100 + 1)]
+    return {k: v for k, v in hints.items() if v is not None}
+
+
+class CompiledFilter:
+    """编译后的过滤器：match(packet, keys) 判定；hints 为索引提示"""
+
+    __slots__ = ("text", "match", "hints")
+
+    def __init__(self, text, match, hints):
+        self.text = text
+        self.match = match
+        self.hints = hints
+
+
+@lru_cache(maxsize=256)
+def compile_filter(text):
+    """编译过滤表达式；语法或字段错误抛出 ValueError（消息含出错位置）"""
+    node = _Parser(text).parse()
+    return CompiledFilter(text, _compile(node), _hints(node))
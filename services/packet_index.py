@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+录包二级索引：host、路径前缀（前两级）、方法、状态码类别、响应 Content-Type、时间桶（每分钟）。
+每个取值对应一个按录包编号升序的倒排列表（录包按编号顺序追加，列表天然有序，追加即维护）。
+多条件查询时选估计最短的倒排列表作为驱动，其余条件用与 _PACKETS 对齐的派生键逐条校验，
+代价与最短列表成正比而不是录包总量；保留上限裁掉的旧编号在列表中惰性清理。
+"""
+import bisect
+import sys
+from urllib.parse import urlsplit
+
+TIME_BUCKET_SECONDS = 60
+PATH_PREFIX_DEPTH = 2
+_FIELDS = ("host", "path", "method", "status", "ctype", "bucket")
+
+
+def _header(headers, name):
+    """在 PacketRecord 的 ((名, 值), ...) 头元组中按小写名称取值"""
+    for k, v in headers:
+        if k.lower() == name:
+            return v
+    return ""
+
+
+def _path_prefixes(path):
+    parts = [x for x in (path or "/").split("/") if x]
+    return tuple("/" + "/".join(parts[:i]) for i in range(1, min(len(parts), PATH_PREFIX_DEPTH) + 1))
+
+
+def status_class(status):
+    try:
+        return sys.intern("%dxx" % (int(status) // 100))
+    except (TypeError, ValueError):
+        return "0xx"
+
+
+def packet_keys(p):
+    """录包的派生键：(host, path, method, status, status_class, content_type, time)"""
+    try:
+        parts = urlsplit(p.get("url") or "")
+        host = (parts.hostname or "").lower()
+        path = parts.path or "/"
+    except ValueError:
+        host, path = "", "/"
+    if (p.get("method") or "").upper() == "CONNECT" and not host:
+        host = (p.get("url") or "").split(":")[0].lower()
+    ctype = _header(p.res_headers, "content-type").split(";")[0].strip().lower()
+    try:
+        status = int(p.get("response_status") or 0)
+    except (TypeError, ValueError):
+        status = 0
+    # host/方法/类型取值很少，驻留后各录包的派生键共享同一字符串
+    return (sys.intern(host), path, sys.intern((p.get("method") or "GET").upper()), status, status_class(status),
+            sys.intern(ctype), float(p.get("time") or 0))
+
+
+def _merge(lists):
+    """合并若干升序编号列表；时间桶等按编号首尾相接时直接拼接，否则整体排序"""
+    if len(lists) == 1:
+        return lists[0]
+    lists = sorted((x for x in lists if x), key=lambda x: x[0])
+    out = []
+    for x in lists:
+        if out and x[0] <= out[-1]:
+            return sorted(n for x in lists for n in x)
+        out.extend(x)
+    return out
+
+
+class PacketIndex:
+    """与 browser_packets._PACKETS 同步维护；所有方法由调用方持有存储锁"""
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self, base=1):
+        self._postings = {f: {} for f in _FIELDS}
+        self._keys = []  # 与 _PACKETS 下标对齐
+        self._base = base
+        self._stale = 0  # 各列表中已过期编号的大致数量
+
+    def _post(self, field, value, num):
+        plist = self._postings[field].get(value)
+        if plist is None:
+            self._postings[field][value] = [num]
+        else:
+            plist.append(num)
+
+    def add(self, num, packet):
+        keys = packet_keys(packet)
+        if not self._keys:
+            self._base = num
+        self._keys.append(keys)
+        host, path, method, _, sclass, ctype, ts = keys
+        self._post("host", host, num)
+        for prefix in _path_prefixes(path):
+            self._post("path", prefix, num)
+        self._post("method", method, num)
+        self._post("status", sclass, num)
+        self._post("ctype", ctype, num)
+        self._post("bucket", int(ts // TIME_BUCKET_SECONDS), num)
+
+    def trim(self, count):
+        """丢弃最旧的 count 条（与 _PACKETS 的保留裁剪同步）"""
+        if count <= 0:
+            return
+        del self._keys[:count]
+        self._base += count
+        self._stale += count
+        if self._stale > max(1000, len(self._keys) // 4):
+            self._prune()
+
+    def _prune(self):
+        base = self._base
+        for field in _FIELDS:
+            postings = self._postings[field]
+            for value in list(postings):
+                plist = postings[value]
+                i = bisect.bisect_left(plist, base)
+                if i >= len(plist):
+                    del postings[value]
+                elif i:
+                    del plist[:i]
+        self._stale = 0
+
+    def rebuild(self, packets):
+        self.clear()
+        for p in packets:
+            self.add(int(p["id"]), p)
+
+    def keys_at(self, num):
+        i = num - self._base
+        return self._keys[i] if 0 <= i < len(self._keys) else None
+
+    # ---- 查询 ----
+
+    def plan(self, host=None, path_prefix=None, method=None, status=None, content_type=None, since=None, until=None,
+             status_classes=None):
+        """
+        把条件拆成候选倒排列表与逐条校验函数；status_classes 为允许的状态码类别列表（如 ["4xx", "5xx"]）。
+        返回 (driver, check)：driver 为升序编号列表或 None（无可用索引，需顺序扫描）；check(keys) -> bool
+        """
+        choices = []  # (估计长度, 取列表的函数)
+        checks = []
+        postings = self._postings
+
+        def exact(field, value):
+            plist = postings[field].get(value, [])
+            choices.append((len(plist), lambda: plist))
+
+        def union(field, values):
+            lists = [postings[field][v] for v in values if v in postings[field]]
+            choices.append((sum(len(x) for x in lists), lambda: _merge(lists)))
+
+        if host:
+            host = host.strip().lower()
+            exact("host", host)
+            checks.append(lambda k: k[0] == host)
+        if path_prefix:
+            prefix = "/" + path_prefix.strip().lstrip("/")
+            # 按字符串前缀匹配；只有后面跟着 "/" 的完整路径段才能确定所属的倒排列表（该列表是结果的超集）
+            complete = [x for x in prefix.split("/")[1:-1] if x][:PATH_PREFIX_DEPTH]
+            if complete:
+                exact("path", "/" + "/".join(complete))
+            checks.append(lambda k: k[1].startswith(prefix))
+        if method:
+            method = method.strip().upper()
+            exact("method", method)
+            checks.append(lambda k: k[2] == method)
+        if status:
+            s = str(status).strip().lower()
+            if s.endswith("xx"):
+                exact("status", s)
+                checks.append(lambda k: k[4] == s)
+            elif s.isdigit() and len(s) == 1:
+                exact("status", s + "xx")
+                checks.append(lambda k: k[4] == s + "xx")
+            elif s.isdigit():
+                code = int(s)
+                exact("status", status_class(code))
+                checks.append(lambda k: k[3] == code)
+        if status_classes is not None:
+            classes = frozenset(status_classes)
+            union("status", sorted(classes))
+            checks.append(lambda k: k[4] in classes)
+        if content_type:
+            ct = content_type.strip().lower()
+            if "/" in ct:
+                exact("ctype", ct)
+                checks.append(lambda k: k[5] == ct)
+            else:
+                union("ctype", [v for v in postings["ctype"] if ct in v])
+                checks.append(lambda k: ct in k[5])
+        if since is not None or until is not None:
+            lo = float(since) if since is not None else None
+            hi = float(until) if until is not None else None
+            buckets = postings["bucket"]
+            first = int(lo // TIME_BUCKET_SECONDS) if lo is not None else None
+            last = int(hi // TIME_BUCKET_SECONDS) if hi is not None else None
+            union("bucket", [b for b in buckets if (first is None or b >= first) and (last is None or b <= last)])
+            checks.append(lambda k: (lo is None or k[6] >= lo) and (hi is None or k[6] <= hi))
+
+        if not checks:
+            return None, None
+        driver = min(choices, key=lambda c: c[0])[1]() if choices else None
+
+        def check(keys):
+            for c in checks:
+                if not c(keys):
+                    return False
+            return True
+
+        return driver, check
+
+    def stats(self):
+        return {f: len(self._postings[f]) for f in _FIELDS}
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""
+录包全文检索：URL、请求/响应头与 body（有 blob 时为完整 body，否则为预览）上的 n-gram 倒排索引（n = GRAM_SIZE = 4）。
+- 粒度：每 BLOCK_SIZE 个连续编号的录包为一块，倒排列表记录块号（升序 array('I')），条目数与追加次数远小于按录包记录
+- n-gram 只取自文本中的单词（\w 连续段），且同一块内已出现过的单词不再切分；网页/JSON 中大量重复的词只处理一次
+- 取 4 而不是 3：十六进制/base64 的 token、cookie 在一块内几乎覆盖全部三字组，三字组对这类查询没有区分度
+- 增量建立：后台线程按编号顺序读取新录包，在锁外切分后合并到倒排列表；录制路径只多一次事件通知
+- 检索：取查询串（不区分大小写）各单词段的 n-gram，全部出现的块为候选；取最短列表从新到旧逐块用其余列表二分确认，
+  再读取块内录包逐字段定位，返回命中字段与偏移。尚未建索引的最新录包直接逐条比对，结果始终完整
+- 查询中没有长度 ≥4 的单词段时（如 "a=123"、"ab"）无法用索引，退化为从新到旧顺序比对（最多 MAX_SCAN 条）
+"""
+import bisect
+import re
+import threading
+import time
+from array import array
+from collections import deque
+from itertools import repeat
+
+from . import browser_packets
+
+BATCH_SIZE = 500
+BLOCK_SIZE = 64
+GRAM_SIZE = 4
+IDLE_WAIT = 1.0  # 秒；没有通知时也定期检查一次，防止漏掉
+MAX_OFFSETS = 20  # 每个字段最多返回的命中位置数
+SNIPPET_CHARS = 80
+MAX_SCAN = 50000  # 查询没有可用 n-gram 时最多顺序比对的录包数
+
+_WORD_RE = re.compile(r"\w{%d,}" % GRAM_SIZE)
+_GRAM_RE = re.compile(r"(?=(\w{%d}))" % GRAM_SIZE)  # 零宽前瞻，一次 findall 取出单词内所有重叠的 n-gram
+
+
+def _headers_text(headers):
+    """PacketRecord 的 ((名, 值), ...) 头元组 -> 每行一个头的文本"""
+    return "\n".join("%s: %s" % (k, v) for k, v in headers)
+
+
+def packet_fields(p):
+    """参与检索的字段 -> 文本；p 为 PacketRecord"""
+    return (
+        ("url", p.get("url") or ""),
+        ("request_headers", _headers_text(p.req_headers)),
+        ("request_body", browser_packets.body_text(p, "request")),
+        ("response_headers", _headers_text(p.res_headers)),
+        ("response_body", browser_packets.body_text(p, "response")),
+    )
+
+
+def ngrams(text):
+    """文本（已转小写）中单词内出现过的 n-gram 集合"""
+    return set(_GRAM_RE.findall(text))
+
+
+def _find_all(text, needle, limit):
+    out = []
+    i = text.find(needle)
+    while i >= 0 and len(out) < limit:
+        out.append(i)
+        i = text.find(needle, i + 1)
+    return out
+
+
+def _contains(arr, num, hi):
+    i = bisect.bisect_left(arr, num, 0, hi)
+    return i < hi and arr[i] == num
+
+
+class PacketTextIndex:
+    """n-gram -> 块号升序数组（块号 = 录包编号 // BLOCK_SIZE）；由后台线程维护"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._postings = {}
+        self._indexed_upto = 0  # 已建索引的最大录包编号
+        self._block = -1  # 正在填充的块及其已出现的单词与 n-gram（只由后台线程访问）
+        self._block_words = set()
+        self._block_grams = set()
+        self._pruned_base = 0
+        self._docs = 0
+        self._entries = 0
+        self._index_seconds = 0.0
+        self._indexed_chars = 0
+
+    # ---- 后台建立 ----
+
+    def start(self):
+        """启动后台索引线程并订阅新录包通知（重复调用无副作用）"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="packet-search-index", daemon=True)
+        browser_packets.add_listener(self.notify)
+        self._thread.start()
+
+    def notify(self):
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(IDLE_WAIT)
+            self._wake.clear()
+            try:
+                while self.index_pending():
+                    pass
+            except Exception:
+                time.sleep(IDLE_WAIT)
+
+    def index_pending(self, batch_size=BATCH_SIZE):
+        """为尚未建索引的录包建一批索引；有进展返回 True"""
+        packets = browser_packets.records_after(self._indexed_upto, batch_size)
+        if not packets:
+            return False
+        t0 = time.perf_counter()
+        adds = []  # (块号, 该块新出现的 n-gram)
+        chars = 0
+        upto = self._indexed_upto
+        docs = 0
+        for p in packets:
+            num = p.id
+            if num <= upto:
+                continue
+            text = "\n".join(v for _, v in packet_fields(p)).lower()
+            chars += len(text)
+            docs += 1
+            upto = num
+            block = num // BLOCK_SIZE
+            if block != self._block:
+                self._block = block
+                self._block_words = set()
+                self._block_grams = set()
+            words = set(_WORD_RE.findall(text))
+            words -= self._block_words
+            if not words:
+                continue
+            self._block_words |= words
+            grams = ngrams(" ".join(words))
+            grams -= self._block_grams
+            if grams:
+                self._block_grams |= grams
+                adds.append((block, grams))
+        with self._lock:
+            postings = self._postings
+            for block, grams in adds:
+                for g in grams.difference(postings):
+                    postings[g] = array("I")
+                # 逐个追加块号；map + deque 让循环在 C 层完成
+                deque(map(array.append, map(postings.__getitem__, grams), repeat(block)), maxlen=0)
+                self._entries += len(grams)
+            self._docs += docs
+            self._indexed_upto = upto
+            self._indexed_chars += chars
+            self._index_seconds += time.perf_counter() - t0
+            self._maybe_prune()
+        return True
+
+    def _maybe_prune(self):
+        """已被保留上限裁掉的编号超过一定比例时清理倒排列表（持有 _lock）"""
+        base = browser_packets.oldest_id_number()
+        if base - self._pruned_base < max(1000, self._docs // 4):
+            return
+        entries = 0
+        first_block = base // BLOCK_SIZE
+        for g in list(self._postings):
+            arr = self._postings[g]
+            i = bisect.bisect_left(arr, first_block)
+            if i >= len(arr):
+                del self._postings[g]
+                continue
+            if i:
+                arr = self._postings[g] = arr[i:]
+            entries += len(arr)
+        self._entries = entries
+        self._docs = max(0, self._indexed_upto - base + 1) if self._docs else 0
+        self._pruned_base = base
+
+    # ---- 检索 ----
+
+    def _match(self, p, needle, pattern, max_offsets):
+        """
+        逐字段定位命中，偏移是原文中的字符下标。lower() 后长度不变时逐字一一对应，直接在小写文本上查找；
+        含 İ 这类小写后变长的字符时改用 pattern（原查询串的 IGNORECASE 正则）在原文上查找，避免偏移错位
+        """
+        matches = []
+        for field, text in packet_fields(p):
+            if not text:
+                continue
+            lower = text.lower()
+            if len(lower) == len(text):
+                offsets = _find_all(lower, needle, max_offsets)
+            else:
+                offsets = [m.start() for _, m in zip(range(max_offsets), pattern.finditer(text))]
+            if not offsets:
+                continue
+            start = max(0, offsets[0] - SNIPPET_CHARS // 2)
+            matches.append({
+                "field": field,
+                "offsets": offsets,
+                "snippet": text[start:start + SNIPPET_CHARS + len(needle)].replace("\n", " "),
+            })
+        return matches
+
+    def search(self, query, limit=20, max_offsets=MAX_OFFSETS):
+        """
+        返回 {"results": [{id, method, url, response_status, time, matches: [{field, offsets, snippet}]}],
+        "count", "indexed_upto", "pending", "elapsed_ms"}；结果按录包从新到旧。
+        """
+        needle = (query or "").lower()
+        if not needle:
+            raise ValueError("缺少检索内容")
+        pattern = re.compile(re.escape(query), re.IGNORECASE)
+        limit = max(1, min(200, int(limit or 20)))
+        t0 = time.perf_counter()
+        results = []
+
+        def take(num):
+            p = browser_packets.get_record(num)
+            if p is None:
+                return False
+            matches = self._match(p, needle, pattern, max_offsets)
+            if matches:
+                results.append({
+                    "id": str(p.id), "method": p.method, "url": p.url,
+                    "response_status": p.status, "time": p.time, "matches": matches,
+                })
+            return len(results) >= limit
+
+        grams = ngrams(needle)
+        with self._lock:
+            upto = self._indexed_upto
+            lists = [self._postings.get(g) for g in grams]
+            lists = None if None in lists else sorted(((arr, len(arr)) for arr in lists), key=lambda x: x[1])
+        latest = int(browser_packets.latest_id() or 0)
+        base = browser_packets.oldest_id_number()
+        done = False
+        # 尚未建索引的最新录包：直接比对
+        num = latest
+        while num > upto and num >= base and not done:
+            done = take(num)
+            num -= 1
+        if not done and not grams:
+            # 查询中没有可用的 n-gram：顺序比对
+            num = min(upto, latest)
+            stop = max(base, num - MAX_SCAN)
+            while num >= stop and not done:
+                done = take(num)
+                num -= 1
+        elif not done and lists:
+            (driver, hi), rest = lists[0], lists[1:]
+            for j in range(hi - 1, -1, -1):
+                block = driver[j]
+                if block < base // BLOCK_SIZE:
+                    break
+                if not all(_contains(arr, block, n) for arr, n in rest):
+                    continue
+                num = min(block * BLOCK_SIZE + BLOCK_SIZE - 1, upto)
+                stop = max(block * BLOCK_SIZE, base)
+                while num >= stop and not done:
+                    done = take(num)
+                    num -= 1
+                if done:
+                    break
+        return {
+            "results": results,
+            "count": len(results),
+            "indexed_upto": upto,
+            "pending": max(0, latest - max(upto, base - 1)),
+            "elapsed_ms": round((time.perf_counter() - t0) * 1000, 2),
+        }
+
+    def stats(self):
+        with self._lock:
+            return {
+                "documents": self._docs,
+                "grams": len(self._postings),
+                "postings": self._entries,
+                "indexed_upto": self._indexed_upto,
+                "indexed_chars": self._indexed_chars,
+                "index_seconds": round(self._index_seconds, 3),
+                "running": self._thread is not None,
+            }
+
+
+index = PacketTextIndex()
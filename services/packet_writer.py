@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+录包后台写入线程：代理事件循环只把原始数据放入有界队列，由独立线程成批写入 browser_packets，
+代理延迟不再受序列化与磁盘写入速度影响。
+队列满时的策略（overflow_policy）：
+- drop：直接丢弃新录包
+- sample：队列超过一半后按 1/sample_every 抽样保留，满时丢弃
+- block：队列满时等待最多 block_timeout 秒，仍满则丢弃。生产者在 asyncio 事件循环上（代理插件）时不在循环里等，
+  而是交给默认线程池等待（同时等待的最多 MAX_DEFERRED 条，再多直接丢弃），事件循环上的其他连接不受影响
+录包时间在 submit 时取（timestamp），不受队列积压影响。
+"""
+import asyncio
+import queue
+import threading
+import time
+
+from . import browser_packets
+
+OVERFLOW_POLICIES = ("drop", "sample", "block")
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_POLICY = "drop"
+BATCH_SIZE = 256
+BATCH_WAIT = 0.05  # 秒：取到第一条后最多再等这么久凑批
+MAX_DEFERRED = 64
+
+
+class PacketWriter:
+    """有界队列 + 单个写入线程"""
+
+    def __init__(self, max_queue=DEFAULT_QUEUE_SIZE, policy=DEFAULT_POLICY, sample_every=10, block_timeout=1.0):
+        self._queue = queue.Queue(maxsize=max(1, int(max_queue)))
+        self.policy = policy if policy in OVERFLOW_POLICIES else DEFAULT_POLICY
+        self.sample_every = max(1, int(sample_every))
+        self.block_timeout = block_timeout
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._sample_counter = 0
+        self._deferred = 0
+        self._stats = {
+            "enqueued": 0,
+            "written": 0,
+            "dropped": 0,
+            "sampled_out": 0,
+            "blocked": 0,
+            "deferred": 0,
+            "batches": 0,
+            "write_errors": 0,
+            "max_depth": 0,
+        }
+        self._write_seconds = 0.0
+
+    def configure(self, max_queue=None, policy=None):
+        """调整策略与队列容量；容量只在队列为空、写入线程未启动时生效"""
+        if policy is not None:
+            self.policy = policy if policy in OVERFLOW_POLICIES else DEFAULT_POLICY
+        if max_queue is not None and self._thread is None and self._queue.empty():
+            self._queue = queue.Queue(maxsize=max(1, int(max_queue)))
+
+    def _count(self, key, n=1):
+        with self._stats_lock:
+            self._stats[key] += n
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                t = threading.Thread(target=self._run, name="packet-writer", daemon=True)
+                t.start()
+                self._thread = t
+
+    def _enqueued(self, q):
+        with self._stats_lock:
+            self._stats["enqueued"] += 1
+            depth = q.qsize()
+            if depth > self._stats["max_depth"]:
+                self._stats["max_depth"] = depth
+
+    def _put_waiting(self, q, packet):
+        """在线程池中等待队列空位（block 策略、生产者在事件循环上时）"""
+        try:
+            q.put(packet, timeout=self.block_timeout)
+        except queue.Full:
+            self._count("dropped")
+        else:
+            self._enqueued(q)
+        finally:
+            with self._stats_lock:
+                self._deferred -= 1
+
+    def _defer(self, q, packet):
+        """当前线程在运行事件循环时交给线程池等待并返回 True；不在事件循环上返回 False"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+        with self._stats_lock:
+            if self._deferred >= MAX_DEFERRED:
+                self._stats["dropped"] += 1
+                return True
+            self._deferred += 1
+            self._stats["deferred"] += 1
+        loop.run_in_executor(None, self._put_waiting, q, packet)
+        return True
+
+    def submit(self, **packet):
+        """放入一条录包（参数同 browser_packets.add_packet）；被策略丢弃时返回 False"""
+        self._ensure_started()
+        packet.setdefault("timestamp", time.time())
+        q = self._queue
+        if self.policy == "sample" and q.qsize() >= q.maxsize // 2:
+            with self._stats_lock:
+                self._sample_counter += 1
+                keep = self._sample_counter % self.sample_every == 0
+            if not keep:
+                self._count("sampled_out")
+                return False
+        try:
+            if self.policy == "block":
+                try:
+                    q.put_nowait(packet)
+                except queue.Full:
+                    self._count("blocked")
+                    if self._defer(q, packet):
+                        return True
+                    q.put(packet, timeout=self.block_timeout)
+            else:
+                q.put_nowait(packet)
+        except queue.Full:
+            self._count("dropped")
+            return False
+        self._enqueued(q)
+        return True
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + BATCH_WAIT
+            while len(batch) < BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            t0 = time.perf_counter()
+            try:
+                browser_packets.add_packets(batch)
+                ok = True
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - t0
+            with self._stats_lock:
+                self._write_seconds += elapsed
+                self._stats["batches"] += 1
+                if ok:
+                    self._stats["written"] += len(batch)
+                else:
+                    self._stats["write_errors"] += len(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    def drain(self, timeout=5.0):
+        """等待队列中已有的录包写完（测试、导出或退出前调用）；超时返回 False"""
+        if self._thread is None:
+            return True
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def stats(self):
+        with self._stats_lock:
+            out = dict(self._stats)
+            write_seconds = self._write_seconds
+        out.update({
+            "policy": self.policy,
+            "queue_depth": self._queue.qsize(),
+            "queue_capacity": self._queue.maxsize,
+            "avg_batch": round(out["written"] / out["batches"], 2) if out["batches"] else None,
+            "write_seconds": round(write_seconds, 4),
+            "running": self._thread is not None and self._thread.is_alive(),
+        })
+        return out
+
+
+writer = PacketWriter()
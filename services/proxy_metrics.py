@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+代理插件耗时直方图：AIInterceptorAddon.request / response 每次调用的耗时按固定区间计数，
+用于判断拦截规则、录制等插件逻辑是否拖慢了代理吞吐。
+区间上界（毫秒）见 BOUNDS_MS；分位数取所在区间的上界（落在最后一个区间时取观测到的最大值），是保守估计。
+"""
+import bisect
+import threading
+
+BOUNDS_MS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 1000)
+_BOUNDS_S = tuple(b / 1000.0 for b in BOUNDS_MS)
+
+
+def _quantile(counts, count, max_s, q):
+    rank = q * count
+    seen = 0
+    for i, n in enumerate(counts):
+        seen += n
+        if seen >= rank and i < len(BOUNDS_MS):
+            return BOUNDS_MS[i]
+        if seen >= rank:
+            break
+    return round(max_s * 1000, 3)
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counts = [0] * (len(_BOUNDS_S) + 1)
+            self._count = 0
+            self._total = 0.0
+            self._max = 0.0
+
+    def observe(self, seconds):
+        i = bisect.bisect_left(_BOUNDS_S, seconds)
+        with self._lock:
+            self._counts[i] += 1
+            self._count += 1
+            self._total += seconds
+            if seconds > self._max:
+                self._max = seconds
+
+    def snapshot(self):
+        with self._lock:
+            counts = list(self._counts)
+            count, total, mx = self._count, self._total, self._max
+        buckets = {"<=%gms" % b: n for b, n in zip(BOUNDS_MS, counts)}
+        buckets[">%gms" % BOUNDS_MS[-1]] = counts[-1]
+        out = {
+            "count": count,
+            "avg_ms": round(total / count * 1000, 3) if count else None,
+            "max_ms": round(mx * 1000, 3),
+            "buckets": buckets,
+        }
+        for name, q in (("p50_ms", 0.5), ("p90_ms", 0.9), ("p99_ms", 0.99)):
+            out[name] = _quantile(counts, count, mx, q) if count else None
+        return out
+
+
+# 插件阶段 -> 耗时直方图
+hooks = {"request": LatencyHistogram(), "response": LatencyHistogram()}
+
+
+def hook_stats():
+    return {phase: h.snapshot() for phase, h in hooks.items()}
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+录制时的地址过滤：data/recorder_filter.json 启用时，只有匹配其中任一地址的流量才会被录制，
+其余流量在代理插件中直接跳过，不进入写入队列、不落盘、不建索引。
+地址编译为匹配器：
+- 域名形式（如 example.com、api.example.com:8443，端口忽略）按主机名后缀匹配：主机名等于它或以 ".它" 结尾，
+  查找时对主机名逐级去掉最左一段查集合，代价与域名段数成正比而与地址条数无关
+- 其他形式（含路径、通配或不完整的关键词，如 /api/、examp）合并为一个正则，对小写 URL 做子串搜索
+配置由记录器页修改时立即重新编译；文件被外部修改时按修改时间在 RELOAD_INTERVAL 秒内生效。
+启用但地址列表为空时视为不过滤（全部录制），与记录器页“启用且至少有一个地址才过滤”的显示一致。
+记录器页按地址过滤已录制的列表时也用同一个匹配器（address_predicate），录制与显示的判定一致。
+统计：每个地址放行的条数、未匹配而跳过的总条数与按主机名的跳过条数（最多 MAX_DROP_HOSTS 个主机）。
+"""
+import json
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+
+RELOAD_INTERVAL = 1.0  # 秒
+MAX_DROP_HOSTS = 200
+
+_DOMAIN_RE = re.compile(r"^[a-z0-9-]+(\.[a-z0-9-]+)+(:\d+)?$")
+
+
+def _normalize_host(host):
+    return (host or "").strip().lower().rstrip(".")
+
+
+class _Matcher:
+    """编译后的地址列表：match(host, url) -> 命中的地址（原文）或 None"""
+
+    def __init__(self, addresses):
+        self.suffixes = {}  # 主机名后缀 -> 地址原文
+        substrings = []
+        for addr in addresses:
+            a = addr.strip().lower()
+            if not a:
+                continue
+            if _DOMAIN_RE.match(a):
+                self.suffixes.setdefault(a.split(":")[0], addr)
+            else:
+                substrings.append((a, addr))
+        self.substrings = {a: addr for a, addr in substrings}
+        self.regex = re.compile("|".join(re.escape(a) for a, _ in substrings)) if substrings else None
+
+    @property
+    def empty(self):
+        return not self.suffixes and self.regex is None
+
+    def match(self, host, url):
+        if self.suffixes:
+            h = _normalize_host(host)
+            while h:
+                addr = self.suffixes.get(h)
+                if addr is not None:
+                    return addr
+                dot = h.find(".")
+                if dot < 0:
+                    break
+                h = h[dot + 1:]
+        if self.regex is not None:
+            m = self.regex.search((url or "").lower())
+            if m is not None:
+                return self.substrings.get(m.group(0), m.group(0))
+        return None
+
+
+def _url_host(url):
+    try:
+        return urlsplit(url or "").hostname or ""
+    except ValueError:
+        return ""
+
+
+def address_predicate(addresses):
+    """地址列表 -> 录包判定 pred(p)（与录制时的匹配规则相同）；列表为空返回 None"""
+    matcher = _Matcher([str(x) for x in (addresses or []) if x])
+    if matcher.empty:
+        return None
+    return lambda p: matcher.match(_url_host(p.url), p.url) is not None
+
+
+class RecorderFilter:
+    """代理插件在录制前调用 should_record；配置来自 recorder_filter.json"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._path = None
+        self._mtime = None
+        self._checked = 0.0
+        self.enabled = False
+        self._matcher = _Matcher([])
+        self._matched = {}  # 地址 -> 放行条数
+        self._dropped = 0
+        self._dropped_hosts = {}
+        self.reloads = 0
+
+    def set_path(self, path):
+        """设置配置文件路径并立即加载"""
+        with self._lock:
+            self._path = path
+            self._mtime = None
+        self._reload_if_changed(force=True)
+
+    def update(self, data):
+        """按配置 dict（enabled, addresses）重新编译；记录器页保存过滤器后调用"""
+        matcher = _Matcher([str(x) for x in (data.get("addresses") or []) if x])
+        with self._lock:
+            self.enabled = bool(data.get("enabled"))
+            self._matcher = matcher
+            self._matched = {a: self._matched.get(a, 0) for a in (data.get("addresses") or [])}
+            self.reloads += 1
+            self._checked = time.monotonic()
+            try:
+                self._mtime = self._path.stat().st_mtime if self._path is not None else None
+            except OSError:
+                self._mtime = None
+
+    def _reload_if_changed(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._checked < RELOAD_INTERVAL:
+            return
+        self._checked = now
+        path = self._path
+        if path is None:
+            return
+        try:
+            mtime = path.stat().st_mtime
+        except OSError:
+            mtime = None
+        if mtime == self._mtime and not force:
+            return
+        data = {"enabled": False, "addresses": []}
+        if mtime is not None:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                return
+        self.update(data)
+
+    def should_record(self, host, url):
+        """未启用、地址列表为空或匹配任一地址时返回 True；否则计入跳过统计并返回 False"""
+        self._reload_if_changed()
+        matcher = self._matcher
+        if not self.enabled or matcher.empty:
+            return True
+        addr = matcher.match(host, url)
+        with self._lock:
+            if addr is not None:
+                self._matched[addr] = self._matched.get(addr, 0) + 1
+                return True
+            self._dropped += 1
+            h = _normalize_host(host)
+            if h in self._dropped_hosts or len(self._dropped_hosts) < MAX_DROP_HOSTS:
+                self._dropped_hosts[h] = self._dropped_hosts.get(h, 0) + 1
+        return False
+
+    def stats(self):
+        with self._lock:
+            top = sorted(self._dropped_hosts.items(), key=lambda x: -x[1])[:20]
+            return {
+                "enabled": self.enabled,
+                "suffixes": len(self._matcher.suffixes),
+                "substrings": len(self._matcher.substrings),
+                "matched": dict(self._matched),
+                "dropped": self._dropped,
+                "dropped_by_host": dict(top),
+                "reloads": self.reloads,
+            }
+
+
+capture = RecorderFilter()
@@ -9,8 +9,16 @@ import threading
 import select
 # 延迟导入，避免循环依赖；运行时代理线程内调用
 def _get_add_packet():
+    from urllib.parse import urlsplit
     from services import browser_packets
-    return browser_packets.add_packet
+    from services.recorder_filter import capture
+
+    def add_packet(**kwargs):
+        # 记录器过滤器启用时只录制匹配的流量
+        url = kwargs.get("url") or ""
+        if capture.should_record(urlsplit(url).hostname, url):
+            browser_packets.add_packet(**kwargs)
+    return add_packet
 
 
 def _parse_request_line(line):
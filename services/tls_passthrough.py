@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+HTTPS 直通：匹配直通列表的连接在 TLS 握手阶段交给 mitmproxy 原样转发（ignore_connection），
+不伪造证书、不解密，省去两次 TLS 握手与录制开销；这类连接也不会出现在录包中。
+- 直通列表：用户配置的主机名模式（data/recorder_passthrough.json），加上始终直通的 AI_API_WHITELIST
+  （这些地址本就不执行拦截规则，解密没有意义；同样按主机名后缀匹配整个主机名）
+- 模式：不含 * 的按主机名后缀匹配（example.com 匹配自身及其子域名）；含 * 的按通配匹配整个主机名（*.cdn-*.net）
+- intercept 为 False 时关闭解密，所有 HTTPS 连接都直通（运行时在记录器页切换，立即生效）
+- 每个主机名的判定结果缓存到配置变更为止；统计直通/解密的连接数与直通原因
+"""
+import json
+import re
+import threading
+
+# AI API 地址白名单：这些地址不执行拦截规则，HTTPS 连接直接直通
+AI_API_WHITELIST = [
+    r'dashscope\.aliyuncs\.com',      # 阿里云百炼
+    r'api\.deepseek\.com',            # 深度求索
+    r'api\.siliconflow\.cn',          # 硅基流动
+]
+# 与主机名模式相同的后缀语义：整个主机名是白名单地址本身或其子域名（api.deepseek.com.attacker.net 不算）
+_AI_RE = re.compile(r"(?:.*\.)?(?:%s)" % "|".join(AI_API_WHITELIST), re.IGNORECASE)
+
+MAX_CACHED_HOSTS = 4096
+MAX_STAT_HOSTS = 200
+
+
+def _compile_patterns(patterns):
+    """主机名模式列表 -> 对小写主机名做 fullmatch 的正则；没有模式返回 None"""
+    parts = []
+    for p in patterns:
+        p = p.strip().lower().rstrip(".")
+        if not p:
+            continue
+        if "*" in p or "?" in p:
+            parts.append(re.escape(p).replace(r"\*", ".*").replace(r"\?", "."))
+        else:
+            parts.append(r"(?:.*\.)?" + re.escape(p))
+    return re.compile("(?:%s)" % "|".join(parts)) if parts else None
+
+
+class PassthroughPolicy:
+    """mitm 插件在 tls_clienthello 中调用 decide；配置来自 recorder_passthrough.json"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._update_lock = threading.Lock()  # 串行化配置的读-改-写与保存；decide 只用 _lock，不被文件写入阻塞
+        self._path = None
+        self.intercept = True
+        self.hosts = []
+        self._regex = None
+        self._cache = {}  # 主机名 -> 直通原因（None 表示解密）
+        self._stats = {"intercepted": 0, "passthrough": 0, "ai_whitelist": 0, "pattern": 0, "intercept_off": 0}
+        self._passed_hosts = {}
+
+    def set_path(self, path):
+        """设置配置文件路径并加载"""
+        data = {}
+        try:
+            if path is not None and path.exists():
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        with self._update_lock:
+            self._path = path
+            self._apply(bool(data.get("intercept", True)), [str(x) for x in data.get("hosts", []) if x])
+
+    def _apply(self, intercept, hosts):
+        regex = _compile_patterns(hosts)
+        with self._lock:
+            self.intercept = intercept
+            self.hosts = hosts
+            self._regex = regex
+            self._cache = {}
+
+    def _save(self):
+        """写入配置文件（持有 _update_lock）"""
+        if self._path is None:
+            return
+        try:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self._path, "w", encoding="utf-8") as f:
+                json.dump(self.config(), f, ensure_ascii=False, indent=2)
+        except OSError:
+            pass
+
+    def update(self, intercept=None, add=None, remove=None):
+        """修改配置并保存；add/remove 为主机名模式。返回新配置；并发调用依次生效，不会丢失修改"""
+        with self._update_lock:
+            hosts = list(self.hosts)
+            if add:
+                add = str(add).strip()
+                if add and add not in hosts:
+                    hosts.append(add)
+            if remove:
+                remove = str(remove).strip()
+                if remove in hosts:
+                    hosts.remove(remove)
+            self._apply(self.intercept if intercept is None else bool(intercept), hosts)
+            self._save()
+            return self.config()
+
+    def _reason(self, host):
+        """直通原因：intercept_off / ai_whitelist / pattern；需要解密返回 None（持有 _lock）"""
+        if not self.intercept:
+            return "intercept_off"
+        if _AI_RE.fullmatch(host):
+            return "ai_whitelist"
+        if self._regex is not None and self._regex.fullmatch(host):
+            return "pattern"
+        return None
+
+    def decide(self, host):
+        """返回 True 表示该连接直通（不解密），并计入统计"""
+        host = (host or "").strip().lower().rstrip(".")
+        with self._lock:
+            if host in self._cache:
+                reason = self._cache[host]
+            else:
+                reason = self._reason(host)
+                if len(self._cache) >= MAX_CACHED_HOSTS:
+                    self._cache.clear()
+                self._cache[host] = reason
+            if reason is None:
+                self._stats["intercepted"] += 1
+                return False
+            self._stats["passthrough"] += 1
+            self._stats[reason] += 1
+            if host in self._passed_hosts or len(self._passed_hosts) < MAX_STAT_HOSTS:
+                self._passed_hosts[host] = self._passed_hosts.get(host, 0) + 1
+            return True
+
+    def config(self):
+        with self._lock:
+            return {"intercept": self.intercept, "hosts": list(self.hosts), "builtin": list(AI_API_WHITELIST)}
+
+    def stats(self):
+        with self._lock:
+            top = sorted(self._passed_hosts.items(), key=lambda x: -x[1])[:20]
+            return dict(self._stats, intercept=self.intercept, patterns=len(self.hosts), passthrough_by_host=dict(top))
+
+
+policy = PassthroughPolicy()
@@ -2,86 +2,472 @@
 """
 流量规则管理器：单例模式，用于存储和管理 AI 下发的流量拦截规则。
 规则类型包括：修改请求头、修改响应体、阻断请求等。
+匹配引擎：
+- add_rule 时编译并校验正则（无效时抛出 ValueError），按规则类型归入 request / response 阶段
+- 从正则中提取任何匹配都必然包含的最长字面量（通常是主机名，如 api\\.example\\.com 中的 "api.example.com"），
+  以其中一个三字组为键登记到该阶段的预筛字典；没有可用字面量（短于 3 个字符、忽略大小写等）的规则每次都检查
+- 匹配时取 URL 的全部三字组查字典得到候选规则，先做字面量子串判断再执行正则，
+  代价与 URL 长度和候选数成正比，而不是规则总数；结果仍按规则添加顺序返回
+- 决策缓存：(阶段, URL) -> 匹配的规则，LRU，最多 DECISION_CACHE_SIZE 条；规则集每次变更（添加、清空、启用/禁用）
+  版本号加一并换一个空缓存，失效是 O(1)；同一资源/接口 URL 反复出现时不再执行正则
+并发：规则集以不可变快照（_Snapshot）发布，写入方（Flask 请求线程）在写锁内复制、修改后整体替换引用，
+代理线程只读当前快照，匹配路径不加锁。每次变更后规则集原子写入 set_persist_path 指定的文件，启动时重新加载；
+规则 ID 单调递增并随文件保存，清空后也不复用。
+统计：每条规则的正则执行次数与累计耗时、命中次数（含决策缓存命中）、动作实际执行次数与最近命中时间，
+用于找出热点、长期不命中或代价高的规则；计数不加锁（代理线程是唯一写入方），跨线程读取为近似值。
 """
+import json
+import os
 import re
-from typing import List, Dict, Optional
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Dict
+
+try:
+    from re import _parser as _sre_parse  # Python 3.11+
+except ImportError:  # pragma: no cover
+    import sre_parse as _sre_parse
+
+GRAM = 3
+DECISION_CACHE_SIZE = 10000
+
+# 规则类型 -> 生效阶段；未登记的类型按名称中是否含 request/response 判断，都不含时两个阶段都生效
+RULE_PHASES = {
+    "modify_request_header": ("request",),
+    "block_request": ("request",),
+    "modify_response_body": ("response",),
+}
+PHASES = ("request", "response")
+
+
+def rule_phases(rule_type: str) -> tuple:
+    if rule_type in RULE_PHASES:
+        return RULE_PHASES[rule_type]
+    if "response" in rule_type:
+        return ("response",)
+    if "request" in rule_type:
+        return ("request",)
+    return PHASES
+
+
+def _longest_literal(items) -> str:
+    """解析后的正则序列中必然出现的最长连续字面量；分支、可选部分与字符类都会打断"""
+    best = ""
+    run = []
+    for op, av in items:
+        if op is _sre_parse.LITERAL:
+            run.append(chr(av))
+            continue
+        if op is _sre_parse.AT:
+            continue  # ^ $ \b 等零宽断言不占字符
+        if len("".join(run)) > len(best):
+            best = "".join(run)
+        run = []
+        if op is _sre_parse.SUBPATTERN:
+            _, add_flags, _, sub = av
+            if not add_flags & re.IGNORECASE:
+                inner = _longest_literal(sub)
+                if len(inner) > len(best):
+                    best = inner
+        elif op in (_sre_parse.MAX_REPEAT, _sre_parse.MIN_REPEAT) and av[0] >= 1:
+            inner = _longest_literal(av[2])
+            if len(inner) > len(best):
+                best = inner
+    if len("".join(run)) > len(best):
+        best = "".join(run)
+    return best
+
+
+def required_literal(pattern: str) -> str:
+    """正则的任何匹配都必然包含的字面量；无法确定（或忽略大小写）时返回空字符串"""
+    try:
+        parsed = _sre_parse.parse(pattern)
+    except Exception:
+        return ""
+    if parsed.state.flags & re.IGNORECASE:
+        return ""
+    return _longest_literal(list(parsed))
+
+
+class _RuleStats:
+    __slots__ = ("evaluations", "matches", "applied", "match_seconds", "last_matched")
+
+    def __init__(self):
+        self.evaluations = 0  # 正则实际执行次数（未通过预筛与字面量判断的不计）
+        self.matches = 0
+        self.applied = 0
+        self.match_seconds = 0.0
+        self.last_matched = None
+
+    def as_dict(self):
+        return {
+            "evaluations": self.evaluations,
+            "matches": self.matches,
+            "applied": self.applied,
+            "match_ms": round(self.match_seconds * 1000, 3),
+            "avg_match_us": round(self.match_seconds / self.evaluations * 1e6, 2) if self.evaluations else None,
+            "last_matched": self.last_matched,
+        }
+
+
+class _CompiledRule:
+    __slots__ = ("seq", "rule", "regex", "literal", "stats")
+
+    def __init__(self, seq, rule, regex, literal, stats=None):
+        self.seq = seq
+        self.rule = rule
+        self.regex = regex
+        self.literal = literal
+        self.stats = stats if stats is not None else _RuleStats()
+
+
+class _PhaseBucket:
+    """
+    一个阶段的规则：三字组 -> 规则列表，以及没有可用字面量、每次都要检查的规则。
+    copy() 只浅复制字典，各列表与原快照共享；登记新规则时只复制被改到的那个列表（写时复制）
+    """
+
+    __slots__ = ("by_gram", "always", "_owned")
+
+    def __init__(self):
+        self.by_gram = {}
+        self.always = []
+        self._owned = None  # None 表示所有列表都归本对象所有；否则为已复制过的三字组集合
+
+    def add(self, cr):
+        lit = cr.literal
+        if len(lit) < GRAM:
+            if self._owned is not None and None not in self._owned:
+                self.always = list(self.always)
+                self._owned.add(None)
+            self.always.append(cr)
+            return
+        # 选当前登记规则最少的三字组，避免大量规则挤在 "com"、"api" 之类的常见三字组上
+        grams = {lit[i:i + GRAM] for i in range(len(lit) - GRAM + 1)}
+        key = min(sorted(grams), key=lambda g: len(self.by_gram.get(g, ())))
+        lst = self.by_gram.get(key)
+        if lst is None:
+            self.by_gram[key] = [cr]
+            if self._owned is not None:
+                self._owned.add(key)
+            return
+        if self._owned is not None and key not in self._owned:
+            lst = self.by_gram[key] = list(lst)
+            self._owned.add(key)
+        lst.append(cr)
+
+    def copy(self):
+        b = _PhaseBucket()
+        b.by_gram = dict(self.by_gram)
+        b.always = self.always
+        b._owned = set()
+        return b
+
+    def candidates(self, url):
+        by_gram = self.by_gram
+        out = list(self.always)
+        if by_gram:
+            for g in {url[i:i + GRAM] for i in range(len(url) - GRAM + 1)}:
+                lst = by_gram.get(g)
+                if lst:
+                    out.extend(lst)
+        return out
+
+
+class _Snapshot:
+    """某一版本的规则集；发布后不再修改（决策缓存除外），读者无需加锁"""
+
+    __slots__ = ("version", "compiled", "rules", "by_id", "buckets", "cache")
+
+    def __init__(self, version, compiled, base=None):
+        """base 为上一快照且 compiled 只是在其末尾追加时，复制它的预筛字典再登记新规则，避免逐条重建"""
+        self.version = version
+        self.compiled = tuple(compiled)  # 按添加顺序
+        self.rules = tuple(cr.rule for cr in self.compiled)
+        self.by_id = {cr.rule["id"]: cr for cr in self.compiled}
+        if base is not None and self.compiled[:len(base.compiled)] == base.compiled:
+            self.buckets = {p: b.copy() for p, b in base.buckets.items()}
+            added = self.compiled[len(base.compiled):]
+        else:
+            self.buckets = {p: _PhaseBucket() for p in PHASES}
+            added = self.compiled
+        for cr in added:
+            if cr.rule["enabled"]:
+                for phase in rule_phases(cr.rule["type"]):
+                    self.buckets[phase].add(cr)
+        self.cache = OrderedDict()
 
 
 class TrafficRuleManager:
     """流量规则管理器单例类"""
-    
+
     _instance = None
-    
+
     def __new__(cls):
         """实现单例模式"""
         if cls._instance is None:
             cls._instance = super(TrafficRuleManager, cls).__new__(cls)
-            cls._instance.rules = []
+            cls._instance._write_lock = threading.Lock()
+            cls._instance._snapshot = _Snapshot(0, [])
+            cls._instance._next_id = 1
+            cls._instance._persist_path = None
+            cls._instance._cache_hits = 0
+            cls._instance._cache_misses = 0
         return cls._instance
 
+    @property
+    def rules(self) -> List[Dict]:
+        return list(self._snapshot.rules)
+
+    @property
+    def version(self) -> int:
+        return self._snapshot.version
+
+    def _publish(self, compiled, appended=False):
+        """发布新快照并持久化（持有 _write_lock）；引用赋值是原子的，读者看到的要么是旧快照要么是新快照"""
+        old = self._snapshot
+        self._snapshot = _Snapshot(old.version + 1, compiled, old if appended else None)
+        self._save()
+
+    # ---- 持久化 ----
+
+    def set_persist_path(self, path):
+        """设置规则文件路径（如 data/traffic_rules.json）并加载其中的规则"""
+        self._persist_path = path
+        self.load()
+
+    def load(self) -> int:
+        """从规则文件重新加载；返回加载的规则条数。正则已失效的规则跳过"""
+        path = self._persist_path
+        if path is None or not path.exists():
+            return 0
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return 0
+        if not isinstance(data, dict):
+            data = {}
+        rules = data.get("rules")
+        compiled = []
+        seen = set()
+        for r in rules if isinstance(rules, list) else []:
+            if not isinstance(r, dict) or not isinstance(r.get("regex"), str):
+                continue
+            rule_id = str(r.get("id"))
+            if rule_id in seen:
+                continue
+            try:
+                regex = re.compile(r["regex"])
+            except re.error:
+                continue
+            action_data = r.get("data")
+            rule = {
+                "id": rule_id,
+                "type": r.get("type") if isinstance(r.get("type"), str) else "",
+                "regex": r["regex"],
+                "data": action_data if isinstance(action_data, dict) else {},
+                "enabled": bool(r.get("enabled", True)),
+            }
+            seen.add(rule_id)
+            compiled.append(_CompiledRule(len(compiled), rule, regex, required_literal(rule["regex"])))
+        next_id = data.get("next_id")
+        if not isinstance(next_id, int) or isinstance(next_id, bool):
+            next_id = 1
+        with self._write_lock:
+            max_id = max((int(cr.rule["id"]) for cr in compiled if cr.rule["id"].isdigit()), default=0)
+            self._next_id = max(next_id, max_id + 1)
+            self._snapshot = _Snapshot(self._snapshot.version + 1, compiled)
+        return len(compiled)
+
+    def _save(self):
+        """原子写入规则文件（持有 _write_lock）"""
+        path = self._persist_path
+        if path is None:
+            return
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(path.name + ".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"next_id": self._next_id, "rules": list(self._snapshot.rules)}, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, path)
+        except OSError:
+            pass
+
+    # ---- 修改（复制后整体替换快照） ----
+
     def add_rule(self, rule_type: str, url_regex: str, action_data: dict) -> str:
         """
-        添加新的流量拦截规则
-        
+        添加新的流量拦截规则。每次添加都会复制一次规则元组并重写规则文件，代价与已有规则数成正比；
+        批量导入请用 add_rules
+
         Args:
             rule_type: 规则类型，如 'modify_request_header', 'modify_response_body', 'block_request' 等
             url_regex: 匹配 URL 的正则表达式
             action_data: 规则执行所需的具体数据
-            
+
         Returns:
-            新规则的 ID
+            新规则的 ID（单调递增，清空后也不复用）
+
+        Raises:
+            ValueError: 正则表达式无效
         """
-        rule = {
-            "id": str(len(self.rules) + 1),
-            "type": rule_type,
-            "regex": url_regex,
-            "data": action_data,
-            "enabled": True
-        }
-        self.rules.append(rule)
-        return rule["id"]
+        return self.add_rules([(rule_type, url_regex, action_data)])[0]
+
+    def add_rules(self, items) -> List[str]:
+        """
+        批量添加规则：全部校验通过后只发布一个快照、写一次规则文件
+
+        Args:
+            items: (rule_type, url_regex, action_data) 序列
+
+        Returns:
+            新规则的 ID 列表，与 items 顺序一致
+
+        Raises:
+            ValueError: 任一正则表达式无效（此时一条都不添加）
+        """
+        prepared = []
+        for rule_type, url_regex, action_data in items:
+            try:
+                regex = re.compile(url_regex)
+            except re.error as e:
+                raise ValueError("正则表达式无效（%s）：%s" % (url_regex, e))
+            prepared.append((rule_type, url_regex, action_data, regex, required_literal(url_regex)))
+        if not prepared:
+            return []
+        with self._write_lock:
+            compiled = list(self._snapshot.compiled)
+            for rule_type, url_regex, action_data, regex, literal in prepared:
+                rule = {
+                    "id": str(self._next_id),
+                    "type": rule_type,
+                    "regex": url_regex,
+                    "data": action_data,
+                    "enabled": True
+                }
+                self._next_id += 1
+                compiled.append(_CompiledRule(len(compiled), rule, regex, literal))
+            self._publish(compiled, appended=True)
+        return [cr.rule["id"] for cr in compiled[-len(prepared):]]
 
-    def get_rules(self) -> List[Dict]:
-        """获取所有规则列表"""
-        return self.rules
+    def get_rules(self, with_stats: bool = False) -> List[Dict]:
+        """获取所有规则列表；with_stats 为 True 时每条规则附带 stats（见 rule_stats）"""
+        if not with_stats:
+            return [dict(r) for r in self._snapshot.rules]
+        return [dict(cr.rule, stats=cr.stats.as_dict()) for cr in self._snapshot.compiled]
 
     def clear_rules(self):
-        """清空所有规则"""
-        self.rules = []
+        """清空所有规则（规则 ID 继续递增）"""
+        with self._write_lock:
+            self._publish([])
+
+    def set_rule_enabled(self, rule_id: str, enabled: bool) -> bool:
+        """启用或禁用规则；规则不存在返回 False"""
+        with self._write_lock:
+            compiled = list(self._snapshot.compiled)
+            for i, cr in enumerate(compiled):
+                if cr.rule["id"] == str(rule_id):
+                    if cr.rule["enabled"] != bool(enabled):
+                        rule = dict(cr.rule, enabled=bool(enabled))
+                        compiled[i] = _CompiledRule(cr.seq, rule, cr.regex, cr.literal, cr.stats)
+                        self._publish(compiled)
+                    return True
+        return False
+
+    # ---- 匹配（只读当前快照，不加锁） ----
+
+    def match_url(self, url: str, phase: str) -> List[Dict]:
+        """返回该阶段匹配 url 的已启用规则（按添加顺序）；结果缓存在当前快照上"""
+        snap = self._snapshot
+        if not snap.compiled:
+            return []
+        key = (phase, url)
+        cache = snap.cache
+        hits = cache.get(key)
+        if hits is not None:
+            self._cache_hits += 1
+            try:
+                cache.move_to_end(key)
+            except KeyError:
+                pass
+        else:
+            self._cache_misses += 1
+            bucket = snap.buckets.get(phase)
+            if bucket is None:
+                return []
+            found = []
+            clock = time.perf_counter
+            for cr in bucket.candidates(url):
+                if cr.literal not in url:
+                    continue
+                t0 = clock()
+                m = cr.regex.search(url)
+                st = cr.stats
+                st.match_seconds += clock() - t0
+                st.evaluations += 1
+                if m:
+                    found.append(cr)
+            if len(found) > 1:
+                found.sort(key=lambda c: c.seq)
+            hits = tuple(found)
+            # OrderedDict 的单个操作在 GIL 下是原子的；并发淘汰时可能已空，忽略即可
+            cache[key] = hits
+            if len(cache) > DECISION_CACHE_SIZE:
+                try:
+                    cache.popitem(last=False)
+                except KeyError:
+                    pass
+        if not hits:
+            return []
+        now = time.time()
+        for cr in hits:
+            cr.stats.matches += 1
+            cr.stats.last_matched = now
+        return [cr.rule for cr in hits]
+
+    def record_applied(self, rule: Dict):
+        """代理插件实际执行了规则动作（改写了请求头/响应体、阻断了请求）后调用"""
+        cr = self._snapshot.by_id.get(rule.get("id"))
+        if cr is not None:
+            cr.stats.applied += 1
+
+    def rule_stats(self) -> List[Dict]:
+        """每条规则的统计，按正则累计耗时从高到低排列"""
+        out = [dict(id=cr.rule["id"], type=cr.rule["type"], regex=cr.rule["regex"], enabled=cr.rule["enabled"],
+                    **cr.stats.as_dict())
+               for cr in self._snapshot.compiled]
+        out.sort(key=lambda r: (-r["match_ms"], -r["matches"]))
+        return out
+
+    def cache_stats(self) -> Dict:
+        """决策缓存统计：版本号、条数、命中/未命中次数与命中率（计数为近似值）"""
+        snap = self._snapshot
+        hits, misses = self._cache_hits, self._cache_misses
+        total = hits + misses
+        return {
+            "version": snap.version,
+            "rules": len(snap.rules),
+            "size": len(snap.cache),
+            "max_size": DECISION_CACHE_SIZE,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / total, 4) if total else None,
+        }
 
     def match_rules(self, flow, phase: str) -> List[Dict]:
         """
         根据请求/响应匹配适用的规则
-        
+
         Args:
             flow: mitmproxy 的 HTTPFlow 对象
             phase: 阶段标识，'request' 或 'response'
-            
+
         Returns:
             匹配的规则列表
         """
-        matched = []
-        url = flow.request.pretty_url
-        
-        for rule in self.rules:
-            if not rule["enabled"]:
-                continue
-            
-            # 根据阶段过滤规则类型
-            if phase == 'request' and 'response' in rule['type']:
-                continue
-            if phase == 'response' and 'request' in rule['type']:
-                continue
-
-            # 使用正则表达式匹配 URL
-            try:
-                if re.search(rule["regex"], url):
-                    matched.append(rule)
-            except re.error:
-                # 正则表达式错误，跳过该规则
-                pass
-                
-        return matched
+        return self.match_url(flow.request.pretty_url, phase)
 
 
 # 创建全局单例实例
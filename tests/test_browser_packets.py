@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from services import browser_packets
+
+
+def _packet(i):
+    return dict(method="GET", url="https://a.test/%d" % i, request_headers={}, request_body=b"", response_status=200,
+                response_headers={}, response_body=b"")
+
+
+def test_append_after_torn_last_line(tmp_path):
+    browser_packets.set_persist_path(tmp_path)
+    browser_packets.load_packets()
+    browser_packets.clear_packets()
+    browser_packets.add_packets([_packet(1), _packet(2)])
+    browser_packets.flush()
+    segment = sorted(tmp_path.glob("seg-*.ndjson"))[-1]
+    with open(segment, "a", encoding="utf-8") as f:
+        f.write('{"id": 3, "method": "GE')  # 崩溃时只写了一半的行
+
+    browser_packets.load_packets()
+    browser_packets.add_packets([_packet(4)])
+    browser_packets.flush()
+    browser_packets.load_packets()
+    try:
+        assert [p.url for p in browser_packets._PACKETS] == ["https://a.test/1", "https://a.test/2", "https://a.test/4"]
+    finally:
+        browser_packets.clear_packets()
+
+
+def test_count_cache_follows_appends_and_trims(tmp_path):
+    browser_packets.set_persist_path(tmp_path)
+    browser_packets.load_packets()
+    browser_packets.clear_packets()
+    browser_packets.set_retention(10)
+    try:
+        browser_packets.add_packets([_packet(i) for i in range(6)])
+        assert browser_packets.count_packets(url_contains="/1") == 1
+        browser_packets.add_packets([_packet(10 + i) for i in range(4)])
+        assert browser_packets.count_packets(url_contains="/1") == 5  # 只检查新追加的录包
+        browser_packets.add_packets([_packet(20 + i) for i in range(30)])  # 触发保留上限裁剪
+        expected = sum(1 for p in browser_packets._PACKETS if "/1" in p.url)
+        assert browser_packets.count_packets(url_contains="/1") == expected
+    finally:
+        browser_packets.set_retention(browser_packets.DEFAULT_MAX_PACKETS)
+        browser_packets.clear_packets()
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from services import browser_packets
+from services.packet_filter import compile_filter
+from services.packet_index import packet_keys
+
+STATUSES = [0, 101, 200, 204, 302, 404, 451, 500, 503, 599, 700]
+
+
+@pytest.fixture(scope="module")
+def store(tmp_path_factory):
+    browser_packets.set_persist_path(tmp_path_factory.mktemp("packets"))
+    browser_packets.load_packets()
+    browser_packets.clear_packets()
+    browser_packets.add_packets([
+        dict(method="GET", url="https://a.test/%d" % s, request_headers={}, request_body=b"", response_status=s,
+             response_headers={}, response_body=b"")
+        for s in STATUSES
+    ])
+    yield
+    browser_packets.clear_packets()
+
+
+@pytest.mark.parametrize("expr", [
+    "status < 400", "status <= 100", "status >= 0", "status > 500", "status >= 200 && status < 300",
+    "status < 1", "status > 599", "method == \"GET\" && status < 300",
+])
+def test_hinted_results_match_unhinted(store, expr):
+    compiled = compile_filter(expr)
+    assert compiled.hints  # 走索引
+    hinted = {str(p["id"]) for p in browser_packets.list_packets(filter_expr=expr, limit=1000)}
+    unhinted = {str(r.id) for r in browser_packets._PACKETS if compiled.match(r, packet_keys(r))}
+    assert hinted == unhinted
+    assert browser_packets.count_packets(filter_expr=expr) == len(unhinted)
+
+
+def test_status_zero_included_below_400(store):
+    statuses = {p["response_status"] for p in browser_packets.list_packets(filter_expr="status < 400", limit=1000)}
+    assert 0 in statuses
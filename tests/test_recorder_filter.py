@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from services.recorder_filter import RecorderFilter, address_predicate
+
+
+class _P:
+    def __init__(self, url):
+        self.url = url
+
+
+def test_enabled_without_addresses_records_everything():
+    f = RecorderFilter()
+    f.update({"enabled": True, "addresses": []})
+    assert f.should_record("a.com", "https://a.com/x")
+    assert f.stats()["dropped"] == 0
+
+
+def test_enabled_filter_drops_unmatched():
+    f = RecorderFilter()
+    f.update({"enabled": True, "addresses": ["example.com", "/api/"]})
+    assert f.should_record("www.example.com", "https://www.example.com/")
+    assert f.should_record("b.org", "https://b.org/api/v1")
+    assert not f.should_record("notexample.com", "https://notexample.com/")
+
+
+def test_view_predicate_matches_capture():
+    addresses = ["example.com", "/api/"]
+    f = RecorderFilter()
+    f.update({"enabled": True, "addresses": addresses})
+    pred = address_predicate(addresses)
+    for url, host in [("https://www.example.com/", "www.example.com"), ("https://notexample.com/", "notexample.com"),
+                      ("https://b.org/api/v1", "b.org"), ("https://b.org/x?u=example.com", "b.org")]:
+        assert pred(_P(url)) == f.should_record(host, url)
+    assert address_predicate([]) is None
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+import re
+
+import pytest
+
+from services.traffic_rules import required_literal, rule_phases, traffic_rules
+
+PATTERNS = [
+    r"api\.example\.com/v1",
+    r"(foo|bar)\.test/baz",
+    r"shop\.test/(item|cart)/\d+",
+    r"colou?r\.test",
+    r"a\.test/(page)?index",
+    r"cdn[0-9]+\.img\.test",
+    r"[a-z]+\.static\.test/.*\.js$",
+    r"(?i)EXAMPLE\.ORG",
+    r"(?i:Login)\.test/form",
+    r"^http://",
+    r"\.png$",
+    r"q=(a|b)?c",
+]
+URLS = [
+    "https://api.example.com/v1/users",
+    "https://api.example.com/v2/users",
+    "https://foo.test/baz",
+    "https://bar.test/baz?x=1",
+    "https://qux.test/baz",
+    "https://shop.test/item/42",
+    "https://shop.test/cart/x",
+    "https://color.test/",
+    "https://colour.test/",
+    "https://a.test/index",
+    "https://a.test/pageindex",
+    "https://cdn12.img.test/a.png",
+    "https://cdn.img.test/a.png",
+    "https://js.static.test/app/main.js",
+    "https://js.static.test/app/main.jsx",
+    "https://www.Example.Org/",
+    "https://LOGIN.test/form",
+    "https://login.TEST/form",
+    "http://plain.test/?q=bc",
+    "https://x.test/?q=ac",
+]
+TYPES = ["modify_request_header", "modify_response_body", "block_request", "custom"]
+
+
+@pytest.fixture
+def rules():
+    traffic_rules.set_persist_path(None)
+    traffic_rules.clear_rules()
+    yield traffic_rules
+    traffic_rules.clear_rules()
+
+
+def _expected(url, phase, added):
+    return [rid for rid, (rule_type, pattern) in added
+            if phase in rule_phases(rule_type) and re.search(pattern, url)]
+
+
+def test_required_literal_is_in_every_match():
+    assert required_literal(r"api\.example\.com/v1") == "api.example.com/v1"
+    assert required_literal(r"(foo|bar)\.test/baz") == ".test/baz"
+    assert required_literal(r"colou?r\.test") == "r.test"
+    assert required_literal(r"cdn[0-9]+\.img\.test") == ".img.test"
+    assert required_literal(r"(abc)+d") == "abc"
+    assert required_literal(r"(?i)EXAMPLE\.ORG") == ""
+    assert required_literal(r"(?i:Login)\.test/form") == ".test/form"
+    assert required_literal(r"(") == ""
+    for pattern in PATTERNS:
+        lit = required_literal(pattern)
+        for url in URLS:
+            m = re.search(pattern, url)
+            if m:
+                assert lit in url, (pattern, url)
+
+
+def test_match_url_agrees_with_re_search(rules):
+    items = [(TYPES[i % len(TYPES)], p, {}) for i, p in enumerate(PATTERNS)]
+    ids = rules.add_rules(items)
+    added = list(zip(ids, [(t, p) for t, p, _ in items]))
+    for _ in range(2):  # 第二轮全部命中决策缓存
+        for url in URLS:
+            for phase in ("request", "response"):
+                assert [r["id"] for r in rules.match_url(url, phase)] == _expected(url, phase, added), (url, phase)
+    stats = rules.cache_stats()
+    assert stats["size"] == len(URLS) * 2
+    assert stats["hits"] >= len(URLS) * 2
+
+
+def test_rule_changes_invalidate_decision_cache(rules):
+    rid = rules.add_rule("block_request", r"ads\.test", {})
+    url = "https://ads.test/banner"
+    assert [r["id"] for r in rules.match_url(url, "request")] == [rid]
+    rules.set_rule_enabled(rid, False)
+    assert rules.match_url(url, "request") == []
+    rules.set_rule_enabled(rid, True)
+    rid2 = rules.add_rule("block_request", r"(?i)ADS", {})
+    assert [r["id"] for r in rules.match_url(url, "request")] == [rid, rid2]
+    assert rules.match_url(url, "response") == []
+
+
+def test_trigram_buckets_limit_candidates(rules):
+    ids = rules.add_rules([("block_request", r"h%d\.example\.test" % i, {}) for i in range(200)])
+    ids.append(rules.add_rule("block_request", r"\d", {}))  # 没有字面量，每次都检查
+    old = rules._snapshot
+    bucket = old.buckets["request"]
+    candidates = bucket.candidates("https://h7.example.test/")
+    assert len(candidates) < 20
+    assert {cr.rule["id"] for cr in candidates if cr.regex.search("https://h7.example.test/")} == {ids[7], ids[-1]}
+    assert [r["id"] for r in rules.match_url("https://h7.example.test/", "request")] == [ids[7], ids[-1]]
+    # 追加规则只复制被改到的列表，旧快照的预筛字典不变
+    before = {g: list(lst) for g, lst in bucket.by_gram.items()}
+    rules.add_rule("block_request", r"h7\.example\.test/new", {})
+    assert {g: list(lst) for g, lst in bucket.by_gram.items()} == before
+    assert len(rules.match_url("https://h7.example.test/new", "request")) == 3
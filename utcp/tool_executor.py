@@ -8,6 +8,10 @@ from . import file_tool
 from . import traffic_tools
 from services import knowledge_base
 from services import browser_packets
+from services import packet_search
+
+# list_browser_packets 默认只返回摘要字段；录包头与 body 预览很长，需要时用 get_browser_packet 按 id 取
+_PACKET_LIST_FIELDS = browser_packets.SUMMARY_FIELDS
 
 
 def execute_tool(name: str, arguments: dict, llm_judge_callback=None, safe_mode: bool = False, project_root=None, uploads_dir=None, unlimited_wait: bool = False) -> str:
@@ -102,8 +106,43 @@ def execute_tool(name: str, arguments: dict, llm_judge_callback=None, safe_mode:
                     limit = 50
             else:
                 limit = 50
-            items = browser_packets.list_packets(url_contains=url_contains, limit=limit)
-            return json.dumps({"success": True, "protocol": "UTCP", "message": "ok", "data": {"packets": items, "count": len(items)}}, ensure_ascii=False)
+            times = {}
+            for key in ("since", "until"):
+                if args.get(key) not in (None, ""):
+                    try:
+                        times[key] = float(args[key])
+                    except (TypeError, ValueError):
+                        return json.dumps({"success": False, "protocol": "UTCP", "message": "%s 须为 Unix 时间戳" % key, "data": None}, ensure_ascii=False)
+            filters = dict(
+                url_contains=url_contains,
+                host=args.get("host") or None,
+                path_prefix=args.get("path_prefix") or None,
+                method=args.get("method") or None,
+                status=args.get("status") or None,
+                content_type=args.get("content_type") or None,
+                filter_expr=args.get("filter") or None,
+                **times,
+            )
+            try:
+                items = browser_packets.list_packets(
+                    limit=limit,
+                    after_id=args.get("after_id") or None,
+                    before_id=args.get("before_id") or None,
+                    fields=args.get("fields") or _PACKET_LIST_FIELDS,
+                    **filters,
+                )
+                total = browser_packets.count_packets(**filters) if args.get("with_total") in (True, 1, "1", "true") else None
+            except ValueError as e:
+                return json.dumps({"success": False, "protocol": "UTCP", "message": str(e), "data": None}, ensure_ascii=False)
+            data = {
+                "packets": items,
+                "count": len(items),
+                "latest_id": browser_packets.latest_id(),
+                "next_before_id": items[-1]["id"] if len(items) >= limit else None,
+            }
+            if total is not None:
+                data["total"] = total
+            return json.dumps({"success": True, "protocol": "UTCP", "message": "ok", "data": data}, ensure_ascii=False)
 
         if name == "get_browser_packet":
             packet_id = (args.get("packet_id") or "").strip()
@@ -112,19 +151,56 @@ def execute_tool(name: str, arguments: dict, llm_judge_callback=None, safe_mode:
             p = browser_packets.get_packet(packet_id)
             if not p:
                 return json.dumps({"success": False, "protocol": "UTCP", "message": "未找到该录包", "data": None}, ensure_ascii=False)
-            return json.dumps({"success": True, "protocol": "UTCP", "message": "ok", "data": p}, ensure_ascii=False)
+            try:
+                offset = max(0, int(args.get("body_offset") or 0))
+                length = max(1, min(262144, int(args.get("body_length") or 16384)))
+            except (TypeError, ValueError):
+                offset, length = 0, 16384
+            data = dict(p)
+            for which in ("request", "response"):
+                ref = p.get(which + "_body")
+                if not ref:
+                    continue
+                chunk = browser_packets.read_body(p, which, offset, offset + length)
+                if chunk is not None:
+                    # 完整 body 存于磁盘 blob：按字节区间返回文本，body_offset/body_length 可继续往后读
+                    data[which + "_body_text"] = chunk.decode("utf-8", errors="replace")
+                    data[which + "_body_range"] = [offset, offset + len(chunk), ref.get("size")]
+            return json.dumps({"success": True, "protocol": "UTCP", "message": "ok", "data": data}, ensure_ascii=False)
+
+        if name == "search_browser_packets":
+            query = args.get("query") or ""
+            if not query:
+                return json.dumps({"success": False, "protocol": "UTCP", "message": "缺少 query", "data": None}, ensure_ascii=False)
+            try:
+                limit = max(1, min(100, int(args.get("limit") or 20)))
+            except (TypeError, ValueError):
+                limit = 20
+            packet_search.index.start()
+            data = packet_search.index.search(query, limit=limit)
+            return json.dumps({"success": True, "protocol": "UTCP", "message": "ok", "data": data}, ensure_ascii=False)
 
         if name == "add_traffic_modification":
             url_regex = args.get("url_regex") or ""
             modification_type = args.get("modification_type") or ""
             data = args.get("data") or {}
             result = traffic_tools.add_traffic_modification(url_regex, modification_type, data)
-            return json.dumps({"success": result.get("success", False), "protocol": "UTCP", "message": result.get("message", ""), "data": result}, ensure_ascii=False)
+            return json.dumps({"success": result.get("success", False), "protocol": "UTCP", "message": result.get("message") or result.get("error", ""), "data": result}, ensure_ascii=False)
 
         if name == "clear_traffic_rules":
             result = traffic_tools.clear_traffic_rules()
             return json.dumps({"success": result.get("success", False), "protocol": "UTCP", "message": result.get("message", ""), "data": result}, ensure_ascii=False)
 
+        if name == "set_traffic_rule_enabled":
+            rule_id = str(args.get("rule_id") or "").strip()
+            if not rule_id:
+                return json.dumps({"success": False, "protocol": "UTCP", "message": "缺少 rule_id", "data": None}, ensure_ascii=False)
+            enabled = args.get("enabled", True)
+            if isinstance(enabled, str):
+                enabled = enabled.strip().lower() not in ("false", "0", "no", "off", "")
+            result = traffic_tools.set_traffic_rule_enabled(rule_id, bool(enabled))
+            return json.dumps({"success": result.get("success", False), "protocol": "UTCP", "message": result.get("message") or result.get("error", ""), "data": result}, ensure_ascii=False)
+
         if name == "list_traffic_rules":
             result = traffic_tools.list_traffic_rules()
             return json.dumps({"success": result.get("success", False), "protocol": "UTCP", "message": result.get("message", ""), "data": result}, ensure_ascii=False)
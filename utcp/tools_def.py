@@ -149,7 +149,7 @@ def get_openai_tools():
             "type": "function",
             "function": {
                 "name": "list_browser_packets",
-                "description": "列出记录器已录制的 HTTP 数据包（用户将浏览器 HTTP 代理设为记录器页显示的 127.0.0.1:端口 后访问网页的流量会被记录）。可用于分析用户浏览行为、抓包结果。",
+                "description": "列出记录器已录制的 HTTP 数据包（用户将浏览器 HTTP 代理设为记录器页显示的 127.0.0.1:端口 后访问网页的流量会被记录），按时间倒序。默认只返回摘要（id、时间、方法、URL、状态码、响应大小、类型），头与 body 用 get_browser_packet 按 id 获取；传 with_total=true 时另返回满足条件的总条数 total，录包较多时用 before_id / after_id 游标翻页。可用于分析用户浏览行为、抓包结果。",
                 "parameters": {
                     "type": "object",
                     "properties": {
@@ -161,6 +161,54 @@ def get_openai_tools():
                             "type": "integer",
                             "description": "可选。返回最多几条，默认 50，最大 200。",
                         },
+                        "before_id": {
+                            "type": "string",
+                            "description": "可选。翻页游标：只返回比该 id 更早的录包（传上次结果的 next_before_id）。",
+                        },
+                        "after_id": {
+                            "type": "string",
+                            "description": "可选。增量游标：只返回比该 id 更新的录包（传上次结果的 latest_id 可只看新流量）。",
+                        },
+                        "host": {
+                            "type": "string",
+                            "description": "可选。只返回该主机名的录包（精确匹配，如 api.example.com）。",
+                        },
+                        "path_prefix": {
+                            "type": "string",
+                            "description": "可选。只返回 URL 路径以此开头的录包，如 /api/v1/。",
+                        },
+                        "method": {
+                            "type": "string",
+                            "description": "可选。HTTP 方法，如 GET、POST。",
+                        },
+                        "status": {
+                            "type": "string",
+                            "description": "可选。响应状态码，可为具体值（404）或类别（4xx）。",
+                        },
+                        "content_type": {
+                            "type": "string",
+                            "description": "可选。响应 Content-Type，完整类型（application/json）或其中一段（json、image）。",
+                        },
+                        "since": {
+                            "type": "number",
+                            "description": "可选。只返回该 Unix 时间戳（秒）之后的录包。",
+                        },
+                        "until": {
+                            "type": "number",
+                            "description": "可选。只返回该 Unix 时间戳（秒）之前的录包。",
+                        },
+                        "with_total": {
+                            "type": "boolean",
+                            "description": "可选。为 true 时返回 total（满足条件的录包总数）；有 URL 或表达式过滤时需逐条检查，默认 false 不计算。",
+                        },
+                        "fields": {
+                            "type": "string",
+                            "description": "可选。返回的字段，逗号分隔，默认 id,time,method,url,response_status,size,content_type。另可选 request_headers、response_headers、request_body_preview、response_body_preview、req_size、legacy_id；all 返回完整录包（很长，慎用）。",
+                        },
+                        "filter": {
+                            "type": "string",
+                            "description": "可选。过滤表达式（类 Wireshark），如 host == \"a.test\" && status >= 400 && resp.body ~ \"token\"。字段：host、path、url、method、status、content_type、time、id、req.body、resp.body（只匹配 body 预览：启用 blob 存储时为前 4KB，否则前 64KB）、req.header.<名>、resp.header.<名>；运算：== != > >= < <=、~（正则）、contains、&& || ! 与括号。",
+                        },
                     },
                 },
             },
@@ -169,7 +217,7 @@ def get_openai_tools():
             "type": "function",
             "function": {
                 "name": "get_browser_packet",
-                "description": "根据 id 获取记录器某条录包的详情（请求头、请求体预览、响应头、响应体预览）。id 来自 list_browser_packets。",
+                "description": "根据 id 获取记录器某条录包的详情（请求头、请求体、响应头、响应体）。完整 body 存于磁盘时按 body_offset/body_length 分段返回（request_body_text / response_body_text）。id 来自 list_browser_packets。",
                 "parameters": {
                     "type": "object",
                     "properties": {
@@ -177,11 +225,40 @@ def get_openai_tools():
                             "type": "string",
                             "description": "录包 id。",
                         },
+                        "body_offset": {
+                            "type": "integer",
+                            "description": "可选。完整 body 的读取起点（字节），默认 0；结果中的 *_body_range 为 [起点, 终点, 总字节数]。",
+                        },
+                        "body_length": {
+                            "type": "integer",
+                            "description": "可选。本次读取的 body 字节数，默认 16384，最大 262144。",
+                        },
                     },
                     "required": ["packet_id"],
                 },
             },
         },
+        {
+            "type": "function",
+            "function": {
+                "name": "search_browser_packets",
+                "description": "在记录器录包的 URL、请求/响应头与 body 预览中全文检索字符串（不区分大小写），如 token、cookie 值或报错信息。返回命中录包的 id、命中字段与字符偏移及附近片段，按时间倒序；详情再用 get_browser_packet 获取。",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "query": {
+                            "type": "string",
+                            "description": "要查找的字符串（按子串匹配）。",
+                        },
+                        "limit": {
+                            "type": "integer",
+                            "description": "可选。最多返回几条录包，默认 20，最大 100。",
+                        },
+                    },
+                    "required": ["query"],
+                },
+            },
+        },
         {
             "type": "function",
             "function": {
@@ -237,11 +314,32 @@ def get_openai_tools():
                 },
             },
         },
+        {
+            "type": "function",
+            "function": {
+                "name": "set_traffic_rule_enabled",
+                "description": "启用或禁用一条流量拦截规则（规则 ID 来自 list_traffic_rules），禁用后规则保留但不再生效。",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "rule_id": {
+                            "type": "string",
+                            "description": "规则 ID",
+                        },
+                        "enabled": {
+                            "type": "boolean",
+                            "description": "true 启用，false 禁用",
+                        },
+                    },
+                    "required": ["rule_id", "enabled"],
+                },
+            },
+        },
         {
             "type": "function",
             "function": {
                 "name": "list_traffic_rules",
-                "description": "列出所有当前的流量拦截规则。用于查看已设置的拦截规则。",
+                "description": "列出所有当前的流量拦截规则。用于查看已设置的拦截规则；每条规则附带命中次数、动作执行次数、正则累计耗时与最近命中时间，可据此清理长期不命中或耗时高的规则。",
                 "parameters": {
                     "type": "object",
                     "properties": {},
@@ -5,6 +5,7 @@
 """
 import requests
 from services.traffic_rules import traffic_rules
+from services import proxy_metrics
 from services.browser_packets import get_packet
 
 
@@ -67,19 +68,44 @@ def clear_traffic_rules() -> dict:
         return {"success": False, "error": str(e)}
 
 
+def set_traffic_rule_enabled(rule_id: str, enabled: bool) -> dict:
+    """
+    启用或禁用一条流量拦截规则
+    
+    Args:
+        rule_id: 规则 ID（来自 list_traffic_rules）
+        enabled: True 启用，False 禁用
+    
+    Returns:
+        包含执行结果的字典
+    """
+    try:
+        if not traffic_rules.set_rule_enabled(rule_id, enabled):
+            return {"success": False, "error": f"未找到 ID 为 {rule_id} 的规则"}
+        return {"success": True, "message": f"规则 {rule_id} 已{'启用' if enabled else '禁用'}"}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
 def list_traffic_rules() -> dict:
     """
     列出所有当前的流量拦截规则
     
     Returns:
-        包含规则列表的字典
+        包含规则列表的字典：每条规则附带 stats（正则执行次数与累计耗时、命中次数、动作执行次数、最近命中时间），
+        另含匹配决策缓存的命中率与代理插件各阶段的耗时直方图
     """
     try:
-        rules = traffic_rules.get_rules()
+        rules = traffic_rules.get_rules(with_stats=True)
         return {
             "success": True,
             "message": f"当前共有 {len(rules)} 条规则",
-            "data": {"rules": rules, "count": len(rules)}
+            "data": {
+                "rules": rules,
+                "count": len(rules),
+                "cache": traffic_rules.cache_stats(),
+                "hook_latency": proxy_metrics.hook_stats(),
+            }
         }
     except Exception as e:
         return {"success": False, "error": str(e)}